@@ -3,6 +3,9 @@ from sqlalchemy import pool
 
 from app.models.base import Base, OTP
 from app.models.user import User
+from app.models.job import Job
+from app.models.heartbeat import ReplicaHeartbeat
+from app.models.token import RevokedToken
 from app.config import settings
 
 from logging.config import fileConfig
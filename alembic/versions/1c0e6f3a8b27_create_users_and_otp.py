@@ -0,0 +1,61 @@
+"""Create users and otp tables
+
+Revision ID: 1c0e6f3a8b27
+Revises:
+Create Date: 2026-10-18 16:20:11.504162
+
+The tables as `Base.metadata.create_all` used to create them at startup,
+before the initial migration. Databases created that way are already past
+this revision.
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1c0e6f3a8b27'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'users',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('email', sa.String(length=70), nullable=True),
+        sa.Column('first_name', sa.String(length=150), nullable=True),
+        sa.Column('last_name', sa.String(length=150), nullable=True),
+        sa.Column('date_of_birth', sa.Date(), nullable=True),
+        sa.Column('password', sa.String(length=128), nullable=False),
+        sa.Column('profile_picture', sa.String(length=255), nullable=True),
+        sa.Column('last_login', sa.DateTime(), nullable=True),
+        sa.Column('is_active', sa.Boolean(), nullable=True),
+        sa.Column('is_superuser', sa.Boolean(), nullable=True),
+        sa.Column('date_joined', sa.DateTime(), nullable=True),
+        sa.Column('deleted', sa.Boolean(), nullable=True),
+        sa.Column('two_factor', sa.Boolean(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_users_email', 'users', ['email'], unique=True)
+    op.create_index('ix_users_id', 'users', ['id'], unique=False)
+    op.create_table(
+        'otp',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('code', sa.String(length=10), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('used_for', sa.String(length=50), nullable=False),
+        sa.Column('s_time', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('otp')
+    op.drop_index('ix_users_id', table_name='users')
+    op.drop_index('ix_users_email', table_name='users')
+    op.drop_table('users')
@@ -0,0 +1,26 @@
+"""Index otp.s_time for the expired OTP reaper
+
+Revision ID: 3f6b8c2d9e41
+Revises: e8a2f05b6d19
+Create Date: 2026-10-18 12:40:09.671232
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f6b8c2d9e41'
+down_revision: Union[str, None] = 'e8a2f05b6d19'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_otp_s_time', 'otp', ['s_time'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_otp_s_time', table_name='otp')
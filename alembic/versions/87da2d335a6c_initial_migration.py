@@ -1,7 +1,7 @@
 """Initial migration
 
 Revision ID: 87da2d335a6c
-Revises: 
+Revises: 1c0e6f3a8b27
 Create Date: 2024-12-11 12:01:30.232389
 
 """
@@ -13,7 +13,7 @@ import sqlalchemy as sa
 
 # revision identifiers, used by Alembic.
 revision: str = '87da2d335a6c'
-down_revision: Union[str, None] = None
+down_revision: Union[str, None] = '1c0e6f3a8b27'
 branch_labels: Union[str, Sequence[str], None] = None
 depends_on: Union[str, Sequence[str], None] = None
 
@@ -0,0 +1,31 @@
+"""Add replica_heartbeat for measuring read replica lag
+
+Revision ID: 9a7c1e5d3b20
+Revises: 3f6b8c2d9e41
+Create Date: 2026-10-18 15:02:44.318027
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9a7c1e5d3b20'
+down_revision: Union[str, None] = '3f6b8c2d9e41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'replica_heartbeat',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('beat_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('replica_heartbeat')
@@ -0,0 +1,26 @@
+"""Add users.profile_picture_variants, the variants the worker wrote
+
+Revision ID: a5c3e7f90d12
+Revises: d3f81a6c2e94
+Create Date: 2026-10-18 22:41:07.318245
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a5c3e7f90d12'
+down_revision: Union[str, None] = 'd3f81a6c2e94'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('profile_picture_variants', sa.String(length=255), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'profile_picture_variants')
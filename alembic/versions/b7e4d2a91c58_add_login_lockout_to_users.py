@@ -0,0 +1,28 @@
+"""Add failed login counter and lockout to users
+
+Revision ID: b7e4d2a91c58
+Revises: 9a7c1e5d3b20
+Create Date: 2026-10-18 18:41:27.903115
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e4d2a91c58'
+down_revision: Union[str, None] = '9a7c1e5d3b20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('failed_logins', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('users', sa.Column('locked_until', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'locked_until')
+    op.drop_column('users', 'failed_logins')
@@ -0,0 +1,31 @@
+"""Unique OTP per user and purpose
+
+Revision ID: c41d9e7a0b3f
+Revises: 57b4060e12da
+Create Date: 2026-10-18 10:02:17.913475
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c41d9e7a0b3f'
+down_revision: Union[str, None] = '57b4060e12da'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Only the newest OTP per (user_id, used_for) was ever verifiable
+    op.execute(
+        "DELETE FROM otp WHERE id NOT IN "
+        "(SELECT MAX(id) FROM otp GROUP BY user_id, used_for)"
+    )
+    op.create_index('uq_otp_user_id_used_for', 'otp', ['user_id', 'used_for'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('uq_otp_user_id_used_for', table_name='otp')
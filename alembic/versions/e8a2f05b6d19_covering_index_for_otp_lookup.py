@@ -0,0 +1,28 @@
+"""Covering index for OTP lookup
+
+Revision ID: e8a2f05b6d19
+Revises: c41d9e7a0b3f
+Create Date: 2026-10-18 11:26:41.204587
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e8a2f05b6d19'
+down_revision: Union[str, None] = 'c41d9e7a0b3f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'ix_otp_user_id_used_for_s_time', 'otp', ['user_id', 'used_for', 's_time', 'code'], unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_otp_user_id_used_for_s_time', table_name='otp')
@@ -0,0 +1,28 @@
+"""Drop the OTP covering index, uq_otp_user_id_used_for serves the lookup
+
+Revision ID: f2d9b4a6c871
+Revises: a5c3e7f90d12
+Create Date: 2026-10-18 23:12:35.604118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2d9b4a6c871'
+down_revision: Union[str, None] = 'a5c3e7f90d12'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.drop_index('ix_otp_user_id_used_for_s_time', table_name='otp')
+
+
+def downgrade() -> None:
+    op.create_index(
+        'ix_otp_user_id_used_for_s_time', 'otp', ['user_id', 'used_for', 's_time', 'code'], unique=False
+    )
@@ -1,20 +1,27 @@
 from fastapi import (
-    BackgroundTasks,
     HTTPException,
     UploadFile,
     APIRouter,
     Security,
+    Request,
     status,
     Form,
     Body,
     File,
 )
-from fastapi.responses import JSONResponse
 
 from pydantic import EmailStr
 from typing import Optional
 
-from app.dependencies import JwtAuthDep, SessionDep, access_security, refresh_security
+from app.dependencies import (
+    CurrentUserDep,
+    JwtAuthDep,
+    ReplicaCurrentUserDep,
+    AsyncSessionDep,
+    async_session_maker,
+    access_security,
+    refresh_security,
+)
 from app.serializers.user import (
     UserForgotPasswordSer,
     ValidateTwoFactorSer,
@@ -25,80 +32,94 @@ from app.serializers.user import (
     UserLoginSer,
 )
 from app.utils import (
-    email_forgot_password_token,
-    account_activation_email,
-    two_factor_token_email,
     save_profile_picture,
-    update_email,
-    get_by_id,
-    db_commit,
+    adb_commit,
+)
+from app.services.rate_limit import rate_limiter
+from app.services.otp_sends import otp_sends
+from app.services.tokens import TokenCredentials, token_denylist
+from app.services.user_import import (
+    ImportFormatError,
+    UserImporter,
+    format_from_content_type,
+    iter_lines,
+    iter_rows,
 )
-from app.choices import OTPChoices
+from app.services.user_cache import user_cache
+from app.responses import ORJSONResponse, model_response
+from app.services.jobs import enqueue_job
+from app.choices import ImportFormatChoices, JobChoices, OTPChoices
 from app.models.user import User
 from app.models.base import OTP
 from app.config import settings
 
-from fastapi_jwt import JwtAuthorizationCredentials
+from sqlalchemy import select
 
 from datetime import date, datetime, timezone, timedelta
+import logging
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 
 @router.post("/v1/users/create/")
 async def create_new_user(
-    db: SessionDep, user: UserCreateSer, bg_tasks: BackgroundTasks
+    db: AsyncSessionDep, user: UserCreateSer
 ):
-    db_user = db.query(User).filter(User.email == user.email).first()
+    db_user = await db.scalar(select(User).where(User.email == user.email))
     if db_user:
         raise HTTPException(status_code=400, detail="Email already in use.")
 
     obj = User(**user.model_dump())
-    obj.set_password(user.password)
+    await obj.aset_password(user.password)
     db.add(obj)
-    db.commit()
+    await db.flush()
+    enqueue_job(db, JobChoices.OTP_EMAIL, user_id=obj.id, used_for=OTPChoices.ACCOUNT_ACTIVATION)
+    await db.commit()
     resp = {
         "id": obj.id,
         "email": obj.email,
         "msg": f"An Activation token is sent to {obj.email}.",
     }
-    bg_tasks.add_task(account_activation_email, db, obj)
-    return JSONResponse(content=resp, status_code=status.HTTP_201_CREATED)
+    return ORJSONResponse(content=resp, status_code=status.HTTP_201_CREATED)
 
 
-@router.post("/v1/users/activate/")
-async def activate_user_account(db: SessionDep, data: UserActivateSer):
-    db_user = db.query(User).filter(User.email == data.email).first()
+@router.post("/v1/users/activate/", dependencies=[rate_limiter.by_ip("otp")])
+async def activate_user_account(db: AsyncSessionDep, data: UserActivateSer):
+    await rate_limiter.check_email("otp", data.email)
+    db_user = await db.scalar(select(User).where(User.email == data.email))
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found.")
     if db_user.is_active:
         raise HTTPException(status_code=400, detail="User already active.")
 
-    otp_result, otp_message = OTP.verify_otp(db, db_user, data.otp, v_time=320)
+    otp_result, otp_message = await OTP.verify_otp(db, db_user, data.otp, v_time=320)
     if otp_result != 1:
         raise HTTPException(status_code=400, detail=otp_message)
 
     db_user.is_active = True
-    db_commit(db)
+    await adb_commit(db)
+    await user_cache.invalidate(db_user.id)
     return {"detail": "User account successfully activated."}
 
 
-@router.post("/v1/users/resend_activation_token/")
-async def resend_activation_token(
-    db: SessionDep, bg_tasks: BackgroundTasks, email: EmailStr = Body()
-):
-    db_user = db.query(User).filter(User.email == email).first()
-    if not db_user:
-        raise HTTPException(status_code=404, detail="User not found.")
-    if db_user.is_active:
-        raise HTTPException(status_code=400, detail="User is already active.")
-    bg_tasks.add_task(account_activation_email, db, db_user)
-    return {"detail": "Activation token sent."}
+@router.post("/v1/users/resend_activation_token/", dependencies=[rate_limiter.by_ip("send_email")])
+async def resend_activation_token(email: EmailStr = Body()):
+    def check(db_user: User | None):
+        if not db_user:
+            raise HTTPException(status_code=404, detail="User not found.")
+        if db_user.is_active:
+            raise HTTPException(status_code=400, detail="User is already active.")
+
+    next_send_at = await otp_sends.send(email, OTPChoices.ACCOUNT_ACTIVATION, check)
+    return {"detail": "Activation token sent.", "next_send_at": next_send_at}
 
 
-@router.post("/v1/users/login/")
-async def login(db: SessionDep, user: UserLoginSer, bg_tasks: BackgroundTasks):
-    db_user = db.query(User).filter(User.email == user.email).first()
+@router.post("/v1/users/login/", dependencies=[rate_limiter.by_ip("login")])
+async def login(db: AsyncSessionDep, user: UserLoginSer):
+    # Not from a replica: stickiness is per process, and one lagging behind a lockout would allow more guesses
+    await rate_limiter.check_email("login", user.email)
+    db_user = await db.scalar(select(User).where(User.email == user.email))
     if not db_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -117,14 +138,28 @@ async def login(db: SessionDep, user: UserLoginSer, bg_tasks: BackgroundTasks):
             detail="User is not active.",
         )
 
-    if not db_user.verify_password(user.password):
+    locked_for = db_user.locked_for()
+    if locked_for:
+        raise HTTPException(
+            status_code=status.HTTP_423_LOCKED,
+            detail="Account locked after too many failed logins, please try again later.",
+            headers={"Retry-After": str(max(1, round(locked_for)))},
+        )
+
+    if not await db_user.averify_password(user.password):
+        db_user.record_failed_login()
+        await adb_commit(db)
+        await user_cache.invalidate(db_user.id)
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid credentials.",
         )
 
     if db_user.two_factor:
-        bg_tasks.add_task(two_factor_token_email, db, db_user)
+        db_user.clear_failed_logins()
+        enqueue_job(db, JobChoices.OTP_EMAIL, user_id=db_user.id, used_for=OTPChoices.TWO_FACTOR)
+        await adb_commit(db)
+        await user_cache.invalidate(db_user.id)  # password may have been rehashed
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="A two-factor OTP has been sent to your email.",
@@ -135,8 +170,9 @@ async def login(db: SessionDep, user: UserLoginSer, bg_tasks: BackgroundTasks):
         "first_name": db_user.first_name,
         "last_name": db_user.last_name,
     }
-    db_user.last_login = datetime.now(timezone.utc)
-    db_commit(db)
+    db_user.record_login()
+    await adb_commit(db)
+    await user_cache.invalidate(db_user.id)
     access_token = access_security.create_access_token(subject=subject)
     refresh_token = refresh_security.create_refresh_token(subject=subject)
 
@@ -151,9 +187,13 @@ async def login(db: SessionDep, user: UserLoginSer, bg_tasks: BackgroundTasks):
 
 
 @router.post("/v1/users/refresh/token/")
-def refresh_tokens(
-    credentials: JwtAuthorizationCredentials = Security(refresh_security),
+async def refresh_tokens(
+    db: AsyncSessionDep,
+    credentials: TokenCredentials = Security(refresh_security),
 ):
+    # Refresh tokens are single use, a stolen one stops working once either party refreshes
+    token_denylist.revoke(db, credentials.claims)
+    await adb_commit(db)
     access_token = access_security.create_access_token(subject=credentials.subject)
     refresh_token = refresh_security.create_refresh_token(
         subject=credentials.subject,
@@ -163,65 +203,71 @@ def refresh_tokens(
     return {"access_token": access_token, "refresh_token": refresh_token}
 
 
-@router.post("/v1/users/reset_forgot_password/", status_code=status.HTTP_200_OK)
-async def reset_forgot_password(db: SessionDep, data: UserForgotPasswordSer):
-    db_user = db.query(User).filter(User.email == data.email).first()
+@router.post(
+    "/v1/users/reset_forgot_password/", status_code=status.HTTP_200_OK, dependencies=[rate_limiter.by_ip("otp")]
+)
+async def reset_forgot_password(db: AsyncSessionDep, data: UserForgotPasswordSer):
+    await rate_limiter.check_email("otp", data.email)
+    db_user = await db.scalar(select(User).where(User.email == data.email))
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found.")
 
-    otp_result, otp_message = OTP.verify_otp(
+    otp_result, otp_message = await OTP.verify_otp(
         db, db_user, data.otp, OTPChoices.FORGOT_PASSWORD, 120
     )
     if otp_result != 1:
         raise HTTPException(status_code=400, detail=otp_message)
 
-    db_user.set_password(data.password)
-    db_commit(db)
+    await db_user.aset_password(data.password)
+    await adb_commit(db)
+    await user_cache.invalidate(db_user.id)
     return {"detail": "Password updated successfully."}
 
 
-@router.post("/v1/users/request_forgot_password/", status_code=status.HTTP_200_OK)
-async def request_forgot_password(
-    db: SessionDep, bg_tasks: BackgroundTasks, email: EmailStr = Body(embed=True)
-):
-    db_user = db.query(User).filter(User.email == email).first()
-    if not db_user:
-        raise HTTPException(status_code=404, detail="User not found.")
+@router.post(
+    "/v1/users/request_forgot_password/",
+    status_code=status.HTTP_200_OK,
+    dependencies=[rate_limiter.by_ip("send_email")],
+)
+async def request_forgot_password(email: EmailStr = Body(embed=True)):
+    def check(db_user: User | None):
+        if not db_user:
+            raise HTTPException(status_code=404, detail="User not found.")
 
-    bg_tasks.add_task(email_forgot_password_token, db, db_user)
-    return None
+    next_send_at = await otp_sends.send(email, OTPChoices.FORGOT_PASSWORD, check)
+    return {"detail": "An OTP is sent to your email.", "next_send_at": next_send_at}
 
 
 @router.post("/v1/users/reset_password/", status_code=status.HTTP_204_NO_CONTENT)
 async def reset_password(
-    db: SessionDep,
-    auth: JwtAuthDep,
+    db: AsyncSessionDep,
+    db_user: CurrentUserDep,
     new_password: str = Body(embed=True, min_length=8, max_length=50),
 ):
-    db_user: User = get_by_id(db, User, auth["id"])
-    if not db_user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
-        )
-    db_user.set_password(new_password)
-    db_commit(db)
+    await db_user.aset_password(new_password)
+    await adb_commit(db)
+    await user_cache.invalidate(db_user.id)
     return None
 
 
-@router.post("/v1/users/validate_two_factor/", status_code=status.HTTP_200_OK)
-async def validate_two_factor(db: SessionDep, data: ValidateTwoFactorSer):
-    db_user = db.query(User).filter(User.email == data.email).first()
+@router.post(
+    "/v1/users/validate_two_factor/", status_code=status.HTTP_200_OK, dependencies=[rate_limiter.by_ip("otp")]
+)
+async def validate_two_factor(db: AsyncSessionDep, data: ValidateTwoFactorSer):
+    await rate_limiter.check_email("otp", data.email)
+    db_user = await db.scalar(select(User).where(User.email == data.email))
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found.")
 
-    otp_result, otp_message = OTP.verify_otp(
+    otp_result, otp_message = await OTP.verify_otp(
         db, db_user, data.otp, OTPChoices.TWO_FACTOR, 120
     )
     if otp_result != 1:
         raise HTTPException(status_code=400, detail=otp_message)
 
-    db_user.last_login = datetime.now(timezone.utc)
-    db_commit(db)
+    db_user.record_login()
+    await adb_commit(db)
+    await user_cache.invalidate(db_user.id)
     subject = {
         "id": db_user.id,
         "first_name": db_user.first_name,
@@ -236,60 +282,45 @@ async def validate_two_factor(db: SessionDep, data: ValidateTwoFactorSer):
     }
 
 
-@router.post("/v1/users/resend_two_factor/", status_code=status.HTTP_200_OK)
-async def resend_two_factor(
-    db: SessionDep, bg_tasks: BackgroundTasks, email: EmailStr = Body()
-):
-    db_user = db.query(User).filter(User.email == email).first()
-    if not db_user:
-        raise HTTPException(status_code=404, detail="User not found.")
-
-    if not db_user.two_factor:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Two factor authentication is disabled.",
-        )
+@router.post(
+    "/v1/users/resend_two_factor/", status_code=status.HTTP_200_OK, dependencies=[rate_limiter.by_ip("send_email")]
+)
+async def resend_two_factor(email: EmailStr = Body()):
+    def check(db_user: User | None):
+        if not db_user:
+            raise HTTPException(status_code=404, detail="User not found.")
+        if not db_user.two_factor:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Two factor authentication is disabled.",
+            )
 
-    bg_tasks.add_task(two_factor_token_email, db, db_user)
-    return {"detail": "Two factor OTP sent."}
+    next_send_at = await otp_sends.send(email, OTPChoices.TWO_FACTOR, check)
+    return {"detail": "Two factor OTP sent.", "next_send_at": next_send_at}
 
 
 @router.get("/v1/users/toggle_two_factor/", status_code=status.HTTP_200_OK)
-async def toggle_two_factor(db: SessionDep, auth: JwtAuthDep):
-    db_user: User = get_by_id(db, User, auth["id"])
-    if not db_user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
-        )
+async def toggle_two_factor(db: AsyncSessionDep, db_user: CurrentUserDep):
     db_user.two_factor = not db_user.two_factor
-    db_commit(db)
+    await adb_commit(db)
+    await user_cache.invalidate(db_user.id)
     return {"two_factor": db_user.two_factor}
 
 
 @router.get("/v1/users/me/", response_model=UserResponseSer)
-async def my_profile(db: SessionDep, auth: JwtAuthDep):
-    db_user: User = get_by_id(db, User, auth["id"])
-    if not db_user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
-        )
-    return db_user
+async def my_profile(db_user: ReplicaCurrentUserDep):
+    return model_response(UserResponseSer, db_user)
 
 
 @router.patch("/v1/users/me/", response_model=UserResponseSer)
 async def update_user(
-    db: SessionDep,
-    auth: JwtAuthDep,
+    db: AsyncSessionDep,
+    db_user: CurrentUserDep,
     first_name: Optional[str] = Form(None),
     last_name: Optional[str] = Form(None),
     date_of_birth: Optional[str] = Form(None),
     profile_picture: Optional[UploadFile] = File(None),
 ):
-    db_user: User = get_by_id(db, User, auth["id"])
-    if not db_user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
-        )
     db_user.last_name = last_name if last_name else db_user.last_name
     db_user.first_name = first_name if first_name else db_user.first_name
     if date_of_birth:
@@ -301,45 +332,48 @@ async def update_user(
             )
     if profile_picture:
         try:
-            db_user.profile_picture = save_profile_picture(profile_picture)
+            path = await save_profile_picture(profile_picture)
+            if path != db_user.profile_picture:
+                db_user.profile_picture = path
+                db_user.profile_picture_variants = None  # until the worker has written them
+            enqueue_job(db, JobChoices.PROFILE_PICTURE, path=path, user_id=db_user.id)
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(
                 status_code=500, detail=f"Error saving profile picture: {str(e)}"
             )
 
-    db_commit(db)
-    return db_user
+    await adb_commit(db)
+    await user_cache.invalidate(db_user.id)
+    return model_response(UserResponseSer, db_user)
 
 
-@router.patch("/v1/users/change_email/", status_code=status.HTTP_200_OK)
-async def change_email(db: SessionDep, auth: JwtAuthDep, data: UpdateEmailSer):
-    db_user: User = get_by_id(db, User, auth["id"])
-    if not db_user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
-        )
+@router.patch(
+    "/v1/users/change_email/", status_code=status.HTTP_200_OK, responses={200: {"model": UserResponseSer}}
+)
+async def change_email(db: AsyncSessionDep, db_user: CurrentUserDep, data: UpdateEmailSer):
     if not data.otp:
-        update_email(db, db_user, data.email)
+        enqueue_job(
+            db, JobChoices.OTP_EMAIL, user_id=db_user.id, used_for=OTPChoices.UPDATE_EMAIL, email=data.email
+        )
+        await adb_commit(db)
         return {"detail": f"An OTP is sent to {data.email}."}
 
-    otp_result, otp_message = OTP.verify_otp(db, db_user, data.otp, v_type=OTPChoices.UPDATE_EMAIL)
+    otp_result, otp_message = await OTP.verify_otp(db, db_user, data.otp, v_type=OTPChoices.UPDATE_EMAIL)
     if otp_result != 1:
         raise HTTPException(status_code=400, detail=otp_message)
 
     # org_email = db_user.email
     # You can send an aknowleding email to previous email
     db_user.email = data.email
-    db_commit(db)
-    return db_user
+    await adb_commit(db)
+    await user_cache.invalidate(db_user.id)
+    return model_response(UserResponseSer, db_user)
 
 
 @router.delete("/v1/users/me/", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_user(db: SessionDep, auth: JwtAuthDep):
-    db_user: User = get_by_id(db, User, auth["id"])
-    if not db_user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
-        )
+async def delete_user(db: AsyncSessionDep, db_user: CurrentUserDep):
     if db_user.deleted:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="User already deleted"
@@ -348,11 +382,63 @@ async def delete_user(db: SessionDep, auth: JwtAuthDep):
     db_user.deleted_at = datetime.now(timezone.utc)
     db_user.is_active = False
     db_user.deleted = True
-    db_commit(db)
+    await adb_commit(db)
+    await user_cache.invalidate(db_user.id)
+    return None
+
+
+@router.post("/v1/users/logout/", status_code=status.HTTP_204_NO_CONTENT)
+async def logout(db: AsyncSessionDep, auth: JwtAuthDep, refresh_token: Optional[str] = Body(None, embed=True)):
+    token_denylist.revoke(db, auth.claims)
+    if refresh_token:
+        claims = refresh_security.decode(refresh_token)
+        if claims and claims["subject"].get("id") == auth["id"]:
+            token_denylist.revoke(db, claims)
+    await adb_commit(db)
+    return None
+
+
+@router.post("/v1/users/logout_all/", status_code=status.HTTP_204_NO_CONTENT)
+async def logout_all(db: AsyncSessionDep, auth: JwtAuthDep):
+    token_denylist.revoke_user(db, auth["id"])
+    token_denylist.revoke(db, auth.claims)  # in case it was minted in this same second
+    await adb_commit(db)
     return None
 
 
-# logout
-# logout from all devices
-# account locking in case of multiple failed login attempts (it can be a brute force attack)
+@router.post("/v1/users/import/")
+async def import_users(
+    request: Request,
+    db: AsyncSessionDep,
+    db_user: CurrentUserDep,
+    format: ImportFormatChoices | None = None,
+    send_activation_email: bool = True,
+):
+    """Creates the users of a CSV or NDJSON body, see app.services.user_import.
+
+    The format comes from the Content-Type (text/csv, application/x-ndjson)
+    unless given. Imports that outlast the proxy's timeouts belong to
+    `python -m app.import_users`. A body that stops being readable partway is
+    a 400 with the report of the rows before it.
+    """
+    if not db_user.is_superuser:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only superusers can import users.")
+    # The import takes minutes, do not keep a connection for the user check
+    await db.close()
+
+    def log_progress(progress):
+        logger.info("Importing users for %s: %s", db_user.email, progress.as_dict(errors=False))
+
+    try:
+        format = format or format_from_content_type(request.headers.get("content-type"))
+    except ImportFormatError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    importer = UserImporter(async_session_maker, send_activation=send_activation_email, on_progress=log_progress)
+    progress = await importer.run(iter_rows(iter_lines(request.stream()), format))
+    # Unreadable input partway: what was created before it is in the report
+    if progress.error:
+        return ORJSONResponse(content=progress.as_dict(), status_code=status.HTTP_400_BAD_REQUEST)
+    return progress.as_dict()
+
+
 # User activity log (login history, IP addresses, login times, password resets)
@@ -7,3 +7,19 @@ class OTPChoices(str, Enum):
     FORGOT_PASSWORD = "forgot_pass"
     UPDATE_EMAIL = "upd_email"
     TWO_FACTOR = "two_factor"
+
+
+class JobChoices(str, Enum):
+    OTP_EMAIL = "otp_email"
+    PROFILE_PICTURE = "profile_picture"
+
+
+class JobStatusChoices(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    FAILED = "failed"
+
+
+class ImportFormatChoices(str, Enum):
+    CSV = "csv"
+    NDJSON = "ndjson"
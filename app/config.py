@@ -6,9 +6,41 @@ import os
 load_dotenv()
 
 
+def rate(value: str) -> tuple[int, float]:
+    """`10/60` -> (10, 60.0), at most 10 requests per 60 seconds."""
+    count, _, seconds = value.partition("/")
+    return int(count), float(seconds)
+
+
 class Settings():
     DATABASE_URL: str = os.getenv("DATABASE_URL")
+    # Defaults to DATABASE_URL with its async driver, e.g. sqlite+aiosqlite, postgresql+asyncpg
+    ASYNC_DATABASE_URL: str = os.getenv("ASYNC_DATABASE_URL")
+    # Comma separated, same form as DATABASE_URL, reads of ReplicaSessionDep sessions go there
+    DATABASE_REPLICA_URLS: list[str] = [url for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url]
+    REPLICA_STICKY_SECONDS: float = float(os.getenv("REPLICA_STICKY_SECONDS", 5))
+    REPLICA_MAX_LAG: float = float(os.getenv("REPLICA_MAX_LAG", 5))
+    REPLICA_LAG_CHECK_INTERVAL: float = float(os.getenv("REPLICA_LAG_CHECK_INTERVAL", 1))
+    # Per engine (sync and async) and per process
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", 10))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", 20))
+    DB_POOL_TIMEOUT: float = float(os.getenv("DB_POOL_TIMEOUT", 30))
+    DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", 1800))
+    DB_POOL_PRE_PING: bool = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("true", "1")
+    # Prepared statements kept per connection (sqlite3 cached_statements, asyncpg)
+    DB_STATEMENT_CACHE_SIZE: int = int(os.getenv("DB_STATEMENT_CACHE_SIZE", 256))
+    DB_STATEMENT_TIMEOUT: int = int(os.getenv("DB_STATEMENT_TIMEOUT", 0))  # ms, Postgres only, 0 disables
+    SQLITE_BUSY_TIMEOUT: int = int(os.getenv("SQLITE_BUSY_TIMEOUT", 5000))  # ms a writer waits for the lock
+    # Connections each process opens per engine at startup, before the first request
+    DB_POOL_WARMUP: int = int(os.getenv("DB_POOL_WARMUP", 2))
+    # error (refuse to start), warn or off when the database is not at the Alembic head
+    SCHEMA_CHECK: str = os.getenv("SCHEMA_CHECK", "error")
     SECRET_KEY: str = os.getenv("SECRET_KEY")
+    # Prometheus metrics at /metrics of the API, and on this port of the worker when not 0
+    METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", "true").lower() in ("true", "1")
+    WORKER_METRICS_PORT: int = int(os.getenv("WORKER_METRICS_PORT", 0))
+    # Development and staging: record each request's SQL, report duplicate and lazy-load queries
+    SQL_PROFILE: bool = os.getenv("SQL_PROFILE", "false").lower() in ("true", "1")
     DEBUG: bool = os.getenv("DEBUG", "false").lower() in ("true", "1")
 
     APP_TITLE: str = os.getenv("APP_TITLE")
@@ -27,8 +59,104 @@ class Settings():
     MAILJET_SENDER_EMAIL: str = os.getenv("MAILJET_SENDER_EMAIL")
     MAILJET_SENDER_NAME: str = os.getenv("MAILJET_SENDER_NAME")
 
+    # mailjet, smtp, memory (kept in process) or file (JSON lines at EMAIL_FILE_PATH)
+    EMAIL_TRANSPORT: str = os.getenv("EMAIL_TRANSPORT", "mailjet")
+    EMAIL_FILE_PATH: str = os.getenv("EMAIL_FILE_PATH", "emails.jsonl")
+    EMAIL_BATCH_SIZE: int = int(os.getenv("EMAIL_BATCH_SIZE", 50))
+    EMAIL_BATCH_LINGER: float = float(os.getenv("EMAIL_BATCH_LINGER", 0.05))
+    EMAIL_MAX_CONCURRENCY: int = int(os.getenv("EMAIL_MAX_CONCURRENCY", 4))
+    EMAIL_MAX_RETRIES: int = int(os.getenv("EMAIL_MAX_RETRIES", 3))
+    EMAIL_RETRY_BACKOFF: float = float(os.getenv("EMAIL_RETRY_BACKOFF", 1))
+    EMAIL_QUEUE_SIZE: int = int(os.getenv("EMAIL_QUEUE_SIZE", 10000))
+
+    SMTP_HOST: str = os.getenv("SMTP_HOST", "localhost")
+    SMTP_PORT: int = int(os.getenv("SMTP_PORT", 587))
+    SMTP_USERNAME: str = os.getenv("SMTP_USERNAME")
+    SMTP_PASSWORD: str = os.getenv("SMTP_PASSWORD")
+    SMTP_USE_TLS: bool = os.getenv("SMTP_USE_TLS", "true").lower() in ("true", "1")
+
+    # Stored hashes with a different cost are rehashed on the next successful login
+    BCRYPT_ROUNDS: int = int(os.getenv("BCRYPT_ROUNDS", 12))
+    PASSWORD_HASH_WORKERS: int = int(os.getenv("PASSWORD_HASH_WORKERS", 4))
+    PASSWORD_HASH_QUEUE_SIZE: int = int(os.getenv("PASSWORD_HASH_QUEUE_SIZE", 32))
+    PASSWORD_HASH_QUEUE_TIMEOUT: float = float(os.getenv("PASSWORD_HASH_QUEUE_TIMEOUT", 5))
+    # Bulk user import: processes hashing passwords, rows per transaction, row errors kept in the report
+    USER_IMPORT_WORKERS: int = int(os.getenv("USER_IMPORT_WORKERS", os.cpu_count() or 1))
+    USER_IMPORT_BATCH_SIZE: int = int(os.getenv("USER_IMPORT_BATCH_SIZE", 1000))
+    USER_IMPORT_MAX_ERRORS: int = int(os.getenv("USER_IMPORT_MAX_ERRORS", 1000))
+
+    # Longest OTP validity is 320s (activation), older rows are deleted by the reaper
+    OTP_MAX_AGE: float = float(os.getenv("OTP_MAX_AGE", 600))
+    OTP_REAPER_INTERVAL: float = float(os.getenv("OTP_REAPER_INTERVAL", 300))  # 0 disables the in-app reaper
+    OTP_REAPER_BATCH_SIZE: int = int(os.getenv("OTP_REAPER_BATCH_SIZE", 5000))
+    # Requests to send an OTP again within this many seconds of the last one share it
+    OTP_RESEND_COOLDOWN: float = float(os.getenv("OTP_RESEND_COOLDOWN", 60))
+
+    PROFILE_PICTURE_MAX_SIZE: int = int(os.getenv("PROFILE_PICTURE_MAX_SIZE", 5 * 1024 * 1024))
+    UPLOAD_CHUNK_SIZE: int = int(os.getenv("UPLOAD_CHUNK_SIZE", 64 * 1024))
+    MAX_CONCURRENT_UPLOADS: int = int(os.getenv("MAX_CONCURRENT_UPLOADS", 8))
+    # Square thumbnails generated by the worker for every uploaded picture
+    PROFILE_PICTURE_SIZES: tuple[int, ...] = tuple(
+        int(size) for size in os.getenv("PROFILE_PICTURE_SIZES", "64,256").split(",")
+    )
+    PROFILE_PICTURE_FORMATS: tuple[str, ...] = tuple(os.getenv("PROFILE_PICTURE_FORMATS", "webp,avif").split(","))
+    PROFILE_PICTURE_QUALITY: int = int(os.getenv("PROFILE_PICTURE_QUALITY", 80))
+    # Preference order, br and zstd are skipped unless `brotli` / `zstandard` are installed
+    COMPRESSION_ENCODINGS: list[str] = os.getenv("COMPRESSION_ENCODINGS", "zstd,br,gzip").split(",")
+    COMPRESSION_MINIMUM_SIZE: int = int(os.getenv("COMPRESSION_MINIMUM_SIZE", 1024))
+    COMPRESSION_LEVELS: dict[str, int] = {
+        "gzip": int(os.getenv("COMPRESSION_GZIP_LEVEL", 6)),
+        "br": int(os.getenv("COMPRESSION_BROTLI_QUALITY", 4)),
+        "zstd": int(os.getenv("COMPRESSION_ZSTD_LEVEL", 3)),
+    }
+    COMPRESSION_CONTENT_TYPES: list[str] = os.getenv(
+        "COMPRESSION_CONTENT_TYPES", "text/*,application/json,application/javascript,application/xml,image/svg+xml"
+    ).split(",")
+    # Serve `<file>.br` / `<file>.gz` next to a static file to clients that accept them
+    STATIC_PRECOMPRESSED: bool = os.getenv("STATIC_PRECOMPRESSED", "true").lower() in ("true", "1")
+
+    # Cache lifetime of static files without a content hash in their name, 0 always revalidates
+    STATIC_MAX_AGE: int = int(os.getenv("STATIC_MAX_AGE", 0))
+    # e.g. /_static, let nginx serve the files from an `internal` location instead of Python
+    STATIC_ACCEL_REDIRECT_PREFIX: str = os.getenv("STATIC_ACCEL_REDIRECT_PREFIX")
+    IMAGE_PROCESS_WORKERS: int = int(os.getenv("IMAGE_PROCESS_WORKERS", os.cpu_count() or 1))
+
+    # memory (per process LRU, for a single API process: invalidations do not reach the others),
+    # redis (shared, needs USER_CACHE_REDIS_URL) or none
+    USER_CACHE_BACKEND: str = os.getenv("USER_CACHE_BACKEND", "memory")
+    USER_CACHE_REDIS_URL: str = os.getenv("USER_CACHE_REDIS_URL", "redis://localhost:6379/0")
+    USER_CACHE_SIZE: int = int(os.getenv("USER_CACHE_SIZE", 10000))
+    USER_CACHE_TTL: float = float(os.getenv("USER_CACHE_TTL", 30))
+
+    # memory (per worker), redis (shared between workers, needs RATE_LIMIT_REDIS_URL) or none
+    RATE_LIMIT_BACKEND: str = os.getenv("RATE_LIMIT_BACKEND", "memory")
+    RATE_LIMIT_REDIS_URL: str = os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+    RATE_LIMIT_MAX_KEYS: int = int(os.getenv("RATE_LIMIT_MAX_KEYS", 100000))
+    # `<requests>/<seconds>` per client IP and per email address, for logins, OTP checks and sending emails
+    RATE_LIMITS: dict[str, tuple[int, float]] = {
+        "login_ip": rate(os.getenv("RATE_LIMIT_LOGIN_IP", "20/60")),
+        "login_email": rate(os.getenv("RATE_LIMIT_LOGIN_EMAIL", "10/300")),
+        "otp_ip": rate(os.getenv("RATE_LIMIT_OTP_IP", "20/60")),
+        "otp_email": rate(os.getenv("RATE_LIMIT_OTP_EMAIL", "5/300")),
+        "send_email_ip": rate(os.getenv("RATE_LIMIT_SEND_EMAIL_IP", "10/600")),
+        "send_email_email": rate(os.getenv("RATE_LIMIT_SEND_EMAIL_EMAIL", "3/600")),
+    }
+    # Consecutive failed logins that lock an account for LOGIN_LOCKOUT_SECONDS, 0 disables
+    LOGIN_LOCKOUT_THRESHOLD: int = int(os.getenv("LOGIN_LOCKOUT_THRESHOLD", 5))
+    LOGIN_LOCKOUT_SECONDS: float = float(os.getenv("LOGIN_LOCKOUT_SECONDS", 900))
+
+    WORKER_CONCURRENCY: int = int(os.getenv("WORKER_CONCURRENCY", 4))
+    WORKER_POLL_INTERVAL: float = float(os.getenv("WORKER_POLL_INTERVAL", 1))
+    JOB_LEASE_SECONDS: float = float(os.getenv("JOB_LEASE_SECONDS", 60))
+    JOB_MAX_ATTEMPTS: int = int(os.getenv("JOB_MAX_ATTEMPTS", 5))
+    JOB_RETRY_BACKOFF: float = float(os.getenv("JOB_RETRY_BACKOFF", 5))
+
     ACCESS_TOKEN_EXPIRE: int = int(os.getenv("ACCESS_TOKEN_EXPIRE", 1))
     REFRESH_TOKEN_EXPIRE: int = int(os.getenv("ACCESS_TOKEN_EXPIRE", 30))
+    # Decoded claims kept per worker, 0 decodes every token on every request
+    TOKEN_CACHE_SIZE: int = int(os.getenv("TOKEN_CACHE_SIZE", 10000))
+    # How long a logout in one worker takes to be seen by the others
+    TOKEN_REVOCATION_SYNC_INTERVAL: float = float(os.getenv("TOKEN_REVOCATION_SYNC_INTERVAL", 2))
 
 
 settings = Settings()
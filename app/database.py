@@ -0,0 +1,219 @@
+"""Engine factory for the sync and async engines, configured from Settings.
+
+SQLite runs in WAL mode, so readers never block the writer or each other.
+Writes follow the driver's default of beginning the transaction at the first
+INSERT/UPDATE/DELETE rather than at the first SELECT, which keeps SQLite's
+single write lock as short as possible. Within a process, writers queue on an
+asyncio lock taken at that first statement and released when the connection
+goes back to the pool. Only one connection ever contends for the SQLite lock,
+instead of every writer polling it through the busy handler's sleeps.
+busy_timeout still covers writers in other processes.
+"""
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlalchemy import Engine, create_engine, event, exc, make_url
+
+from app.profiling import current_profile
+from app.config import settings
+from app import metrics
+
+from dataclasses import dataclass
+from weakref import WeakKeyDictionary
+from sqlalchemy.util import await_only
+import asyncio
+import time
+
+
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+
+def get_async_database_url(url: str) -> str:
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername)).render_as_string(
+        hide_password=False
+    )
+
+
+@dataclass
+class PoolStats:
+    checkouts: int = 0
+    # checkouts that found no idle connection and no overflow left, so had to queue
+    waits: int = 0
+    timeouts: int = 0
+    wait_seconds: float = 0.0
+    max_wait_seconds: float = 0.0
+
+    def record(self, waited: float, queued: bool):
+        self.checkouts += 1
+        self.waits += queued
+        self.wait_seconds += waited
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+
+class InstrumentedPoolMixin:
+    """Times every checkout, `stats` survives `recreate` (e.g. engine.dispose())."""
+
+    stats: PoolStats
+
+    def _do_get(self):
+        queued = self._max_overflow > -1 and self.checkedin() == 0 and self.overflow() >= self._max_overflow
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.stats.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            self.stats.record(waited, queued)
+            self.wait_metric.observe(waited)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.stats = self.stats
+        pool.wait_metric = self.wait_metric
+        return pool
+
+    def saturation(self) -> float:
+        """Checked out connections over the most the pool will ever open."""
+        capacity = self.size() + max(self._max_overflow, 0)
+        return self.checkedout() / capacity if capacity else 0.0
+
+
+class InstrumentedQueuePool(InstrumentedPoolMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def engine_options(url: str, is_async: bool) -> dict:
+    url = make_url(url)
+    backend, driver = url.get_backend_name(), url.get_driver_name()
+    connect_args = {}
+
+    if backend == "sqlite":
+        connect_args["check_same_thread"] = False
+        connect_args["cached_statements"] = settings.DB_STATEMENT_CACHE_SIZE
+        if url.database in (None, "", ":memory:"):
+            # In-memory databases keep SQLAlchemy's default single connection pool
+            return {"connect_args": connect_args}
+    elif driver == "asyncpg":
+        connect_args["prepared_statement_cache_size"] = settings.DB_STATEMENT_CACHE_SIZE
+        if settings.DB_STATEMENT_TIMEOUT:
+            connect_args["server_settings"] = {"statement_timeout": str(settings.DB_STATEMENT_TIMEOUT)}
+    elif backend == "postgresql" and settings.DB_STATEMENT_TIMEOUT:
+        connect_args["options"] = f"-c statement_timeout={settings.DB_STATEMENT_TIMEOUT}"
+
+    return {
+        "connect_args": connect_args,
+        "poolclass": InstrumentedAsyncQueuePool if is_async else InstrumentedQueuePool,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        # A local SQLite file has no server to drop idle connections, skip the extra round trip
+        "pool_pre_ping": settings.DB_POOL_PRE_PING and backend != "sqlite",
+    }
+
+
+def configure_sqlite(engine: Engine):
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={settings.SQLITE_BUSY_TIMEOUT}")
+        cursor.close()
+
+
+def configure_sqlite_writer_lock(engine: Engine):
+    locks: WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Lock] = WeakKeyDictionary()
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def acquire_writer_lock(conn, cursor, statement, parameters, context, executemany):
+        if context is None or not (context.isinsert or context.isupdate or context.isdelete):
+            return
+        info = conn.connection.info
+        if "writer_lock" in info:
+            return
+        lock = locks.setdefault(asyncio.get_running_loop(), asyncio.Lock())
+        try:
+            await_only(asyncio.wait_for(lock.acquire(), settings.SQLITE_BUSY_TIMEOUT / 1000))
+        except asyncio.TimeoutError:
+            raise exc.TimeoutError(f"Waited {settings.SQLITE_BUSY_TIMEOUT}ms for the SQLite writer lock")
+        info["writer_lock"] = lock
+
+    @event.listens_for(engine, "checkin")
+    @event.listens_for(engine, "close")
+    def release_writer_lock(dbapi_connection, connection_record=None):
+        if connection_record is not None and "writer_lock" in connection_record.info:
+            connection_record.info.pop("writer_lock").release()
+
+
+def instrument_queries(engine: Engine):
+    """Counts and times every statement, and adds them to the current request's totals and profile."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_query(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def end_query(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        metrics.db_queries.inc()
+        metrics.db_query_duration.observe(elapsed)
+        stats = metrics.request_db_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.seconds += elapsed
+        profile = current_profile.get()
+        if profile is not None:
+            profile.record(statement, elapsed)
+
+    @event.listens_for(engine, "handle_error")
+    def failed_query(context):
+        if context.connection is not None and context.connection.info.get("query_started"):
+            context.connection.info["query_started"].pop()
+
+
+def attach_stats(engine: Engine):
+    if isinstance(engine.pool, InstrumentedPoolMixin):
+        engine.pool.stats = PoolStats()
+        engine.pool.wait_metric = metrics.db_pool_wait.labels(engine.url.render_as_string())
+    instrument_queries(engine)
+
+
+def build_engine(url: str) -> Engine:
+    engine = create_engine(url, **engine_options(url, is_async=False))
+    if engine.dialect.name == "sqlite":
+        configure_sqlite(engine)
+    attach_stats(engine)
+    return engine
+
+
+def build_async_engine(url: str) -> AsyncEngine:
+    engine = create_async_engine(url, **engine_options(url, is_async=True))
+    if engine.dialect.name == "sqlite":
+        configure_sqlite(engine.sync_engine)
+        configure_sqlite_writer_lock(engine.sync_engine)
+    attach_stats(engine.sync_engine)
+    return engine
+
+
+def pool_status(engine: Engine | AsyncEngine) -> dict:
+    pool = engine.pool
+    if not isinstance(pool, InstrumentedPoolMixin):
+        return {}
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": max(pool.overflow(), 0),
+        "saturation": round(pool.saturation(), 3),
+        **vars(pool.stats),
+    }
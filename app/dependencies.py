@@ -1,21 +1,39 @@
 from fastapi import Depends, HTTPException, Security, status
 
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 from sqlalchemy.orm import Session
-from sqlalchemy import create_engine
 
+from app.database import build_async_engine, build_engine, get_async_database_url
+from app.services.replicas import ReplicaRouter, RoutingSession, read_your_writes
+from app.services.tokens import AccessSecurity, RefreshSecurity, TokenCredentials
+from app.services.user_cache import user_cache
+from app.models.user import User
 from app.config import settings
 
-from fastapi_jwt import (
-    JwtAuthorizationCredentials,
-    JwtAccessBearerCookie,
-    JwtRefreshBearer,
-)
-
 from datetime import timedelta
 from typing import Annotated
 
 
-engine = create_engine(settings.DATABASE_URL, connect_args={"check_same_thread": False})
+engine = build_engine(settings.DATABASE_URL)
+async_database_url = settings.ASYNC_DATABASE_URL or get_async_database_url(settings.DATABASE_URL)
+async_engine = build_async_engine(async_database_url)
+replica_router = ReplicaRouter(
+    async_engine,
+    [build_async_engine(get_async_database_url(url)) for url in settings.DATABASE_REPLICA_URLS],
+    sticky_seconds=settings.REPLICA_STICKY_SECONDS,
+    max_lag=settings.REPLICA_MAX_LAG,
+)
+# Objects stay usable after commit, touching an expired attribute would need implicit IO
+async_session_maker = async_sessionmaker(
+    async_engine, expire_on_commit=False, sync_session_class=RoutingSession, router=replica_router
+)
+replica_session_maker = async_sessionmaker(
+    async_engine,
+    expire_on_commit=False,
+    sync_session_class=RoutingSession,
+    router=replica_router,
+    info={"replica_reads": True},
+)
 
 
 def get_session():
@@ -23,12 +41,22 @@ def get_session():
         yield session
 
 
-access_security = JwtAccessBearerCookie(
+async def get_async_session():
+    async with async_session_maker() as session:
+        yield session
+
+
+async def get_replica_session():
+    async with replica_session_maker() as session:
+        yield session
+
+
+access_security = AccessSecurity(
     secret_key=settings.SECRET_KEY,
     auto_error=False,
     access_expires_delta=timedelta(hours=settings.ACCESS_TOKEN_EXPIRE),
 )
-refresh_security = JwtRefreshBearer(
+refresh_security = RefreshSecurity(
     secret_key=settings.SECRET_KEY,
     auto_error=True,
     refresh_expires_delta=timedelta(days=settings.REFRESH_TOKEN_EXPIRE),
@@ -36,7 +64,7 @@ refresh_security = JwtRefreshBearer(
 
 
 def get_jwt_credentials(
-    credentials: JwtAuthorizationCredentials = Security(access_security),
+    credentials: TokenCredentials = Security(access_security),
 ):
     if not credentials:
         raise HTTPException(
@@ -45,5 +73,29 @@ def get_jwt_credentials(
     return credentials
 
 
-JwtAuthDep = Annotated[JwtAuthorizationCredentials, Depends(get_jwt_credentials)]
+JwtAuthDep = Annotated[TokenCredentials, Depends(get_jwt_credentials)]
 SessionDep = Annotated[Session, Depends(get_session)]
+AsyncSessionDep = Annotated[AsyncSession, Depends(get_async_session)]
+# Reads may be served by a replica, see app.services.replicas
+ReplicaSessionDep = Annotated[AsyncSession, Depends(get_replica_session)]
+
+
+async def get_current_user(db: AsyncSessionDep, auth: JwtAuthDep) -> User:
+    user = await user_cache.get(db, auth["id"])
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
+        )
+    return user
+
+
+CurrentUserDep = Annotated[User, Depends(get_current_user)]
+
+
+async def get_current_user_from_replica(db: ReplicaSessionDep, auth: JwtAuthDep) -> User:
+    read_your_writes(db, user_id=auth["id"])
+    return await get_current_user(db, auth)
+
+
+# For read-only endpoints, the user is attached to a ReplicaSessionDep session
+ReplicaCurrentUserDep = Annotated[User, Depends(get_current_user_from_replica)]
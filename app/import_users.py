@@ -0,0 +1,89 @@
+"""Imports user accounts from a CSV or NDJSON file, see app.services.user_import.
+
+    python -m app.import_users users.csv
+    python -m app.import_users users.ndjson --no-activation-email --errors errors.ndjson
+    gunzip -c users.csv.gz | python -m app.import_users - --format csv
+
+Progress goes to stderr after every batch. The report goes to stdout as
+JSON, with the first USER_IMPORT_MAX_ERRORS row errors. --errors writes
+every one of them, one JSON object per line. Exits with 1 when a row failed
+or the input stopped being readable, the report then has an `error`.
+"""
+from app.services.user_import import (
+    ImportProgress,
+    UserImporter,
+    iter_lines,
+    iter_rows,
+    shutdown,
+)
+from app.dependencies import async_engine, async_session_maker
+from app.choices import ImportFormatChoices
+from app.config import settings
+
+from pathlib import Path
+import argparse
+import asyncio
+import json
+import sys
+
+
+SUFFIXES = {".csv": ImportFormatChoices.CSV, ".ndjson": ImportFormatChoices.NDJSON, ".jsonl": ImportFormatChoices.NDJSON}
+CHUNK_SIZE = 256 * 1024
+
+
+async def read_chunks(f):
+    while chunk := await asyncio.to_thread(f.read, CHUNK_SIZE):
+        yield chunk
+
+
+def print_progress(progress: ImportProgress):
+    print(
+        f"{progress.rows} rows, {progress.created} created, {progress.failed} failed, "
+        f"{progress.users_per_second:.0f} users/s",
+        file=sys.stderr,
+    )
+
+
+async def run(path: str, format: ImportFormatChoices, send_activation: bool, batch_size: int, errors) -> ImportProgress:
+    def write_error(error):
+        errors.write(json.dumps(vars(error)) + "\n")
+
+    importer = UserImporter(
+        async_session_maker,
+        send_activation=send_activation,
+        batch_size=batch_size,
+        on_progress=print_progress,
+        on_error=write_error if errors else None,
+    )
+    try:
+        if path == "-":
+            return await importer.run(iter_rows(iter_lines(read_chunks(sys.stdin.buffer)), format))
+        with open(path, "rb") as f:
+            return await importer.run(iter_rows(iter_lines(read_chunks(f)), format))
+    finally:
+        shutdown()
+        await async_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="file to import, - for stdin")
+    parser.add_argument("--format", choices=[choice.value for choice in ImportFormatChoices], help="default: from the suffix")
+    parser.add_argument("--no-activation-email", dest="send_activation", action="store_false")
+    parser.add_argument("--batch-size", type=int, default=settings.USER_IMPORT_BATCH_SIZE)
+    parser.add_argument("--errors", type=argparse.FileType("w"), help="write every row error to this file")
+    args = parser.parse_args()
+
+    format = args.format or SUFFIXES.get(Path(args.path).suffix.lower())
+    if format is None:
+        parser.error("pass --format, it cannot be told from the file name")
+
+    progress = asyncio.run(
+        run(args.path, ImportFormatChoices(format), args.send_activation, args.batch_size, args.errors)
+    )
+    print(json.dumps(progress.as_dict(), indent=2))
+    sys.exit(1 if progress.failed or progress.error else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Import time report of a module, from a cold interpreter.
+
+    python -m app.importtime                    # app.main, best of 3 runs
+    python -m app.importtime app.worker --top 30
+    python -m app.importtime --why httpx        # which import chain pulls httpx in
+
+Runs `python -X importtime -c "import <module>"` in fresh processes and
+summarizes its output by top-level package and by module self time.
+"""
+from dataclasses import dataclass
+from pathlib import Path
+import subprocess
+import argparse
+import json
+import sys
+import os
+import re
+
+
+ROOT = Path(__file__).resolve().parent.parent
+LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+@dataclass
+class ImportRecord:
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+    parent: str | None = None
+
+    @property
+    def package(self) -> str:
+        return self.module.partition(".")[0]
+
+
+def parse_importtime(output: str) -> list[ImportRecord]:
+    """Parses `-X importtime` output. A module is printed after everything it imported."""
+    records, pending = [], []
+    for line in output.splitlines():
+        match = LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, module = match.groups()
+        record = ImportRecord(module, int(self_us), int(cumulative_us), depth=(len(indent) - 1) // 2)
+        while pending and pending[-1].depth > record.depth:
+            pending.pop().parent = module
+        pending.append(record)
+        records.append(record)
+    return records
+
+
+def measure(module: str = "app.main", runs: int = 3, cwd: Path | str = ROOT, env: dict | None = None) -> list[ImportRecord]:
+    """Imports `module` in `runs` fresh interpreters, returns the records of the fastest one."""
+    env = {**os.environ, **(env or {})}
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(ROOT), env.get("PYTHONPATH")]))
+    best = None
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=cwd, env=env, capture_output=True, text=True,
+        )
+        if result.returncode:
+            error = "\n".join(line for line in result.stderr.splitlines() if not LINE.match(line))
+            raise RuntimeError(f"Importing {module} failed:\n{error}")
+        records = parse_importtime(result.stderr)
+        if best is None or total_ms(records) < total_ms(best):
+            best = records
+    return best
+
+
+def total_ms(records: list[ImportRecord]) -> float:
+    return sum(r.cumulative_us for r in records if r.depth == 0) / 1000
+
+
+def by_package(records: list[ImportRecord]) -> dict[str, float]:
+    """Self time per top-level package in ms, slowest first."""
+    totals: dict[str, float] = {}
+    for record in records:
+        totals[record.package] = totals.get(record.package, 0) + record.self_us / 1000
+    return dict(sorted(totals.items(), key=lambda item: item[1], reverse=True))
+
+
+def import_chain(records: list[ImportRecord], module: str) -> list[str]:
+    """`module`, the module that first imported it, and so on up to the root import."""
+    parents = {r.module: r.parent for r in records}
+    if module not in parents:
+        return []
+    chain = [module]
+    while parents.get(chain[-1]):
+        chain.append(parents[chain[-1]])
+    return chain
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("module", nargs="?", default="app.main")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--why", metavar="MODULE")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    records = measure(args.module, args.runs)
+    packages = list(by_package(records).items())[: args.top]
+    modules = sorted(records, key=lambda r: r.self_us, reverse=True)[: args.top]
+    chain = import_chain(records, args.why) if args.why else None
+
+    if args.json:
+        print(json.dumps({
+            "module": args.module,
+            "total_ms": round(total_ms(records), 2),
+            "modules_imported": len(records),
+            "packages_ms": {name: round(ms, 2) for name, ms in packages},
+            "modules_self_ms": {r.module: round(r.self_us / 1000, 2) for r in modules},
+            **({"why": chain} if chain is not None else {}),
+        }, indent=2))
+        return
+
+    print(f"import {args.module}: {total_ms(records):.1f}ms, {len(records)} modules (best of {args.runs})\n")
+    print(f"{'self ms':>9}  package")
+    for name, ms in packages:
+        print(f"{ms:9.1f}  {name}")
+    print(f"\n{'self ms':>9}  {'cumul ms':>9}  module")
+    for r in modules:
+        print(f"{r.self_us / 1000:9.1f}  {r.cumulative_us / 1000:9.1f}  {r.module}")
+    if chain is not None:
+        print(f"\n{args.why}: " + (" <- ".join(chain) if chain else "not imported"))
+
+
+if __name__ == "__main__":
+    main()
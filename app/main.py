@@ -1,10 +1,79 @@
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.middleware.gzip import GZipMiddleware
-from fastapi import FastAPI, staticfiles
+from fastapi.responses import Response
+from fastapi import FastAPI
 
-from app.dependencies import engine
-from app.models.base import Base
+from app.middlewares.compression import CompressionMiddleware
+from app.middlewares.body_size import MaxBodySizeMiddleware
+from app.middlewares.sql_profiler import SQLProfilerMiddleware
+from app.middlewares.metrics import MetricsMiddleware
+from app.startup import StartupTimings, check_schema, warm_pool
+from app.services.otp_reaper import run_otp_reaper
+from app.services.password import password_hasher
+from app.services import user_import
+from app.services.email import email_service
+from app.services.tokens import token_denylist
+from app.staticfiles import CachedStaticFiles
+from app.responses import ORJSONResponse
+from app.dependencies import async_engine, async_session_maker, engine, replica_router
+from app.metrics import CONTENT_TYPE, Gauge, registry
+from app.database import pool_status
 from app.config import settings
+from app.api.v1 import user
+
+from contextlib import asynccontextmanager
+import asyncio
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    timings = StartupTimings()
+    with timings.phase("total"):
+        with timings.phase("schema_check"):
+            await check_schema(async_engine, settings.SCHEMA_CHECK)
+
+        async def warm_pools():
+            with timings.phase("warm_pool"):
+                await asyncio.gather(
+                    *(warm_pool(e, settings.DB_POOL_WARMUP) for e in (async_engine, *replica_router.replicas))
+                )
+
+        async def warm_bcrypt():
+            with timings.phase("warm_bcrypt"):
+                await password_hasher.warm_up()
+
+        async def load_denylist():
+            with timings.phase("load_denylist"):
+                await token_denylist.sync(async_session_maker)
+
+        await asyncio.gather(warm_pools(), warm_bcrypt(), load_denylist())
+
+        with timings.phase("background_tasks"):
+            if settings.OTP_REAPER_INTERVAL:
+                app.state.otp_reaper = asyncio.create_task(run_otp_reaper(settings.OTP_REAPER_INTERVAL))
+            if replica_router.replicas:
+                app.state.replica_monitor = asyncio.create_task(
+                    replica_router.run_monitor(settings.REPLICA_LAG_CHECK_INTERVAL)
+                )
+            app.state.token_denylist_sync = asyncio.create_task(
+                token_denylist.run_sync(async_session_maker, settings.TOKEN_REVOCATION_SYNC_INTERVAL)
+            )
+    app.state.startup_timings = timings
+    logger.info("Started in %.1fms: %s", timings["total"], timings)
+
+    yield
+
+    for name in ("otp_reaper", "replica_monitor", "token_denylist_sync"):
+        if getattr(app.state, name, None):
+            getattr(app.state, name).cancel()
+    await email_service.stop()
+    password_hasher.shutdown()
+    user_import.shutdown()
+    for e in (async_engine, *replica_router.replicas):
+        await e.dispose()
 
 
 app = FastAPI(
@@ -22,6 +91,8 @@ app = FastAPI(
         "name": settings.APP_LICENSE_NAME,
         "identifier": settings.APP_LICENSE_IDENTIFIER,
     },
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
 )
 
 
@@ -33,25 +104,68 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-app.add_middleware(GZipMiddleware)  # Compress responses
+app.add_middleware(
+    CompressionMiddleware,
+    encodings=settings.COMPRESSION_ENCODINGS,
+    levels=settings.COMPRESSION_LEVELS,
+    content_types=settings.COMPRESSION_CONTENT_TYPES,
+    minimum_size=settings.COMPRESSION_MINIMUM_SIZE,
+)
+# Form fields of the profile update are tiny, leave 64KB of room for them
+app.add_middleware(MaxBodySizeMiddleware, max_body_size=settings.PROFILE_PICTURE_MAX_SIZE + 64 * 1024)
+if settings.SQL_PROFILE:
+    app.add_middleware(SQLProfilerMiddleware)
+if settings.METRICS_ENABLED:
+    # Outermost, so the time includes compression and every other middleware
+    app.add_middleware(MetricsMiddleware)
 
 
 # Include API routes
-def configure_routing():
-    from app.api.v1 import user
-
-    app.mount("/app/static", staticfiles.StaticFiles(directory="app/static"), name="static")
-    # app.include_router(base.router, prefix="/base", tags=["base"])
-    app.include_router(user.router, prefix="/api", tags=["user"])
-
-@app.on_event("startup")
-def startup_event():
-    from app.models.base import OTP
-    from app.models.user import User
-    Base.metadata.create_all(engine)
-    configure_routing()
+app.mount(
+    "/app/static",
+    CachedStaticFiles(
+        directory="app/static",
+        check_dir=False,  # created by the first profile picture upload
+        accel_redirect_prefix=settings.STATIC_ACCEL_REDIRECT_PREFIX,
+        max_age=settings.STATIC_MAX_AGE,
+        precompressed_types=settings.COMPRESSION_CONTENT_TYPES if settings.STATIC_PRECOMPRESSED else (),
+    ),
+    name="static",
+)
+# app.include_router(base.router, prefix="/base", tags=["base"])
+app.include_router(user.router, prefix="/api", tags=["user"])
 
 
 @app.get("/ping")
 async def ping():
     return {"status": "pong"}
+
+
+@app.get("/ping/pool")
+async def pool_metrics():
+    """Connection pool checkout waits and saturation, per engine."""
+    replicas = {}
+    for replica in replica_router.replicas:
+        name = replica.url.render_as_string()
+        replicas[name] = {"lag_seconds": replica_router.lag.get(name), **pool_status(replica)}
+    return {"async": pool_status(async_engine), "sync": pool_status(engine), "replicas": replicas}
+
+
+@registry.collector
+def pool_gauges():
+    checked_out = Gauge("db_pool_checked_out", "Connections checked out of the pool.", ["engine"])
+    size = Gauge("db_pool_size", "Connections the pool keeps open.", ["engine"])
+    for e in (engine, async_engine, *replica_router.replicas):
+        status = pool_status(e)
+        if status:
+            name = e.url.render_as_string()
+            checked_out.labels(name).set(status["checked_out"])
+            size.labels(name).set(status["size"])
+    return [checked_out, size]
+
+
+if settings.METRICS_ENABLED:
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        return Response(registry.render(), media_type=CONTENT_TYPE)
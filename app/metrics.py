@@ -0,0 +1,240 @@
+"""Process metrics in the Prometheus text format.
+
+The API serves them at /metrics and the worker on --metrics-port.
+
+Recording is a float addition, or a bisect plus two additions for a
+histogram, with no lock. Everything is recorded from the event loop thread
+except the sync engine's SQL events, and an increment racing there can at
+worst be lost. Histogram buckets are fixed when the metric is created and
+only made cumulative when scraped. Values of other modules that already
+count things (caches, limiters, the reaper) are read at scrape time by
+`collector` callbacks.
+"""
+from dataclasses import dataclass
+from contextvars import ContextVar
+from typing import Callable, Iterable
+from bisect import bisect_left
+import asyncio
+import math
+
+
+# Seconds, from a cached read to a slow bcrypt call or email API
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple[str, ...], object] = {}
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def labels(self, *values: str):
+        """The child of one label combination, keep it around on hot paths."""
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def samples(self) -> Iterable[tuple[str, tuple[str, ...], tuple[str, ...], float]]:
+        """(name suffix, label names, label values, value)"""
+        for values, child in self._children.items():
+            yield "", self.labelnames, values, child.value
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for suffix, names, values, value in self.samples():
+            lines.append(f"{self.name}{suffix}{format_labels(names, values)} {format_value(value)}")
+        return "\n".join(lines)
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self._children[()].value += amount
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, amount: float = 1):
+        self._children[()].value -= amount
+
+    def set(self, value: float):
+        self._children[()].value = value
+
+
+class _Buckets:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # the last one is +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _Buckets(self.buckets)
+
+    def observe(self, value: float):
+        self._children[()].observe(value)
+
+    def samples(self):
+        names = self.labelnames + ("le",)
+        for values, child in self._children.items():
+            total = 0
+            for bound, count in zip((*self.buckets, math.inf), child.counts):
+                total += count
+                yield "_bucket", names, (*values, format_value(bound)), total
+            yield "_sum", self.labelnames, values, child.sum
+            yield "_count", self.labelnames, values, total
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+        self._collectors: list[Callable[[], Iterable[Metric]]] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, *args, **kwargs) -> Counter:
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs) -> Gauge:
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        return self.register(Histogram(*args, **kwargs))
+
+    def collector(self, fn: Callable[[], Iterable[Metric]]):
+        """Registers `fn`, called on every scrape for metrics built from other modules' state."""
+        self._collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        metrics = list(self._metrics.values())
+        for collect in self._collectors:
+            metrics.extend(collect())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.counter("http_requests_total", "HTTP requests served.", ["method", "route", "status"])
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds", "Time to serve an HTTP request.", ["method", "route"]
+)
+http_in_flight = registry.gauge("http_requests_in_flight", "HTTP requests being served.")
+db_queries = registry.counter("db_queries_total", "SQL statements executed.")
+db_query_duration = registry.histogram(
+    "db_query_duration_seconds", "Time to execute a SQL statement.", buckets=QUERY_BUCKETS
+)
+db_request_queries = registry.histogram(
+    "db_request_queries", "SQL statements executed per HTTP request.", ["route"], buckets=COUNT_BUCKETS
+)
+db_request_duration = registry.histogram(
+    "db_request_duration_seconds", "Time spent executing SQL per HTTP request.", ["route"]
+)
+db_pool_wait = registry.histogram(
+    "db_pool_checkout_wait_seconds", "Time to check a connection out of the pool.", ["engine"], buckets=QUERY_BUCKETS
+)
+password_hash_duration = registry.histogram(
+    "password_hash_duration_seconds", "Time bcrypt takes to hash or verify a password.", ["operation"]
+)
+password_hash_rejected = registry.counter(
+    "password_hash_rejected_total", "Password hashing calls refused with a 503, the hashing queue was full."
+)
+email_send_duration = registry.histogram(
+    "email_send_duration_seconds", "Time of one transport call sending a batch of emails.", ["transport"]
+)
+emails_sent = registry.counter("emails_sent_total", "Emails delivered to the transport.", ["transport"])
+email_failures = registry.counter(
+    "email_failures_total", "Emails given up on, after retries for transient errors.", ["transport", "reason"]
+)
+
+
+@dataclass
+class RequestDBStats:
+    queries: int = 0
+    seconds: float = 0.0
+
+
+# Set for the duration of an HTTP request by MetricsMiddleware
+request_db_stats: ContextVar[RequestDBStats | None] = ContextVar("request_db_stats", default=None)
+
+
+async def serve(host: str, port: int) -> asyncio.Server:
+    """Answers any HTTP request on `port` with the metrics, for processes without an API (the worker)."""
+
+    async def respond(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 10)
+            body = registry.render().encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: %s\r\nContent-Length: %d\r\nConnection: close\r\n\r\n"
+                % (CONTENT_TYPE.encode(), len(body))
+                + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(respond, host, port)
@@ -0,0 +1,63 @@
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+class MaxBodySizeMiddleware:
+    """Rejects multipart bodies larger than `max_body_size` with a 413.
+
+    A declared Content-Length over the limit is refused before anything is
+    read. A chunked body is cut off as soon as its running total crosses the
+    limit, so an oversized upload is never spooled to disk in full.
+    """
+
+    def __init__(self, app: ASGIApp, max_body_size: int):
+        self.app = app
+        self.max_body_size = max_body_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not self._is_multipart(scope):
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope["headers"]:
+            if name != b"content-length":
+                continue
+            # Digits only, int() would also take signs, spaces and underscores
+            if not value.isdigit():
+                response = JSONResponse({"detail": "Invalid Content-Length."}, status_code=400)
+            elif int(value) > self.max_body_size:
+                response = JSONResponse(
+                    {"detail": "Request body too large."},
+                    status_code=413,
+                    headers={"Connection": "close"},
+                )
+            else:
+                continue
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_size:
+                    # Re-raised by FastAPI's body parsing and rendered as a 413
+                    raise HTTPException(
+                        status_code=413,
+                        detail="Request body too large.",
+                    )
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+    @staticmethod
+    def _is_multipart(scope: Scope) -> bool:
+        for name, value in scope["headers"]:
+            if name == b"content-type":
+                return value.startswith(b"multipart/form-data")
+        return False
@@ -0,0 +1,178 @@
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+import zlib
+
+try:
+    import brotli
+except ImportError:  # optional, `pip install brotli`
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional, `pip install zstandard`
+    zstandard = None
+
+
+class GzipEncoder:
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+
+class BrotliEncoder:
+    def __init__(self, level: int):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.finish()
+
+
+class ZstdEncoder:
+    def __init__(self, level: int):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+
+def get_encoders() -> dict[str, type]:
+    encoders = {"gzip": GzipEncoder}
+    if brotli is not None:
+        encoders["br"] = BrotliEncoder
+    if zstandard is not None:
+        encoders["zstd"] = ZstdEncoder
+    return encoders
+
+
+def parse_accept_encoding(header: str) -> dict[str, float]:
+    """`gzip, br;q=0.5` -> {"gzip": 1.0, "br": 0.5}"""
+    encodings = {}
+    for item in header.split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        name, _, value = params.strip().partition("=")
+        if name.strip() == "q":
+            try:
+                q = float(value)
+            except ValueError:
+                q = 0.0
+        encodings[coding] = q
+    return encodings
+
+
+def negotiate_encoding(header: str, preference: list[str]) -> str | None:
+    """Picks the encoding with the highest q, ties go to the earliest one in `preference`."""
+    accepted = parse_accept_encoding(header)
+    best, best_q = None, 0.0
+    for encoding in preference:
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def media_type_matches(media_type: str, allowed: list[str]) -> bool:
+    return media_type in allowed or f"{media_type.partition('/')[0]}/*" in allowed
+
+
+class CompressionMiddleware:
+    """Compresses responses with zstd, brotli or gzip, whichever the client prefers.
+
+    Only responses whose content type is in `content_types` (`text/*` style
+    wildcards allowed) and whose body is at least `minimum_size` bytes are
+    compressed. Small JSON bodies, images and responses that already carry a
+    Content-Encoding, e.g. precompressed static files, are passed through.
+    Encodings whose library is not installed are skipped.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        encodings: list[str],
+        levels: dict[str, int],
+        content_types: list[str],
+        minimum_size: int = 1024,
+    ):
+        self.app = app
+        available = get_encoders()
+        self.encoders = {encoding: available[encoding] for encoding in encodings if encoding in available}
+        self.levels = levels
+        self.content_types = content_types
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""), list(self.encoders))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Message | None = None
+        encoder = None
+
+        async def send_compressed(message: Message):
+            nonlocal start, encoder
+            if message["type"] == "http.response.start":
+                start = message  # held back until the first body chunk decides the headers
+                return
+
+            more_body = message.get("more_body", False)
+            if start is not None:
+                held, start = start, None
+                if message["type"] == "http.response.body":
+                    headers = MutableHeaders(raw=held["headers"])
+                    if self.should_compress(held["status"], headers, message.get("body", b""), more_body):
+                        encoder = self.encoders[encoding](self.levels[encoding])
+                        headers["content-encoding"] = encoding
+                        if "accept-encoding" not in headers.get("vary", "").lower():
+                            headers.add_vary_header("Accept-Encoding")
+                        if "etag" in headers and not headers["etag"].startswith("W/"):
+                            headers["etag"] = f"W/{headers['etag']}"  # not byte-identical to the file anymore
+                        if not more_body:
+                            body = encoder.compress(message.get("body", b"")) + encoder.flush()
+                            headers["content-length"] = str(len(body))
+                            await send(held)
+                            await send({"type": "http.response.body", "body": body})
+                            return
+                        del headers["content-length"]
+                await send(held)
+
+            if encoder is None or message["type"] != "http.response.body":
+                await send(message)
+                return
+            body = encoder.compress(message.get("body", b""))
+            if not more_body:
+                body += encoder.flush()
+            elif not body:
+                return
+            await send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
+
+    def should_compress(self, status: int, headers: MutableHeaders, body: bytes, more_body: bool) -> bool:
+        if status < 200 or status in (204, 206, 304) or "content-encoding" in headers:
+            return False
+        media_type = headers.get("content-type", "").partition(";")[0].strip().lower()
+        if not media_type_matches(media_type, self.content_types):
+            return False
+        if "content-length" in headers:
+            return int(headers["content-length"]) >= self.minimum_size
+        return more_body or len(body) >= self.minimum_size
@@ -0,0 +1,66 @@
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.metrics import (
+    RequestDBStats,
+    request_db_stats,
+    db_request_duration,
+    db_request_queries,
+    http_request_duration,
+    http_requests,
+    http_in_flight,
+)
+
+import time
+
+
+def route_label(scope: Scope) -> str:
+    """Path template of the route that served the request, as its router declares it.
+
+    Requests no route matched share `unmatched`, so the number of series
+    stays bounded whatever paths clients send.
+    """
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    if "app_root_path" in scope:
+        # Served by a mounted app, e.g. the static files
+        return scope["root_path"][len(scope["app_root_path"]):] + "/{path}"
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """Counts and times HTTP requests, with the SQL each one ran."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        stats = RequestDBStats()
+        token = request_db_stats.set(stats)
+        http_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            http_in_flight.dec()
+            request_db_stats.reset(token)
+
+            path = route_label(scope)
+            method = scope["method"]
+            http_requests.labels(method, path, str(status_code)).inc()
+            http_request_duration.labels(method, path).observe(elapsed)
+            db_request_queries.labels(path).observe(stats.queries)
+            db_request_duration.labels(path).observe(stats.seconds)
@@ -0,0 +1,32 @@
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.profiling import sql_profiler
+
+
+class SQLProfilerMiddleware:
+    """Profiles the SQL of each request, with the totals in the X-DB-Queries and X-DB-Time (ms) headers."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        with sql_profiler.profile(f"{scope['method']} {scope['path']}") as profile:
+
+            async def send_wrapper(message: Message):
+                if message["type"] == "http.response.start":
+                    headers = MutableHeaders(scope=message)
+                    headers["X-DB-Queries"] = str(len(profile.queries))
+                    headers["X-DB-Time"] = f"{profile.seconds * 1000:.2f}"
+                    headers["X-DB-Duplicate-Queries"] = str(sum(profile.duplicates().values()))
+                    headers["X-DB-Lazy-Loads"] = str(len(profile.lazy_loads()))
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                sql_profiler.finish(profile)
@@ -1,9 +1,10 @@
-from sqlalchemy import Column, String, Integer, ForeignKey, DateTime
+from sqlalchemy import Column, String, Integer, ForeignKey, DateTime, Index, select
 from sqlalchemy.orm import relationship, DeclarativeBase
 
 from app.choices import OTPChoices
 
-from datetime import datetime, timezone
+from datetime import datetime
+from secrets import compare_digest
 
 
 class Base(DeclarativeBase):
@@ -18,28 +19,37 @@ class OTP(Base):
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     user = relationship("User", back_populates="otps")
     used_for = Column(String(50), nullable=False, default=OTPChoices.ACCOUNT_ACTIVATION)
-    s_time = Column(DateTime, default=datetime.now(timezone.utc), nullable=False)
+    s_time = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        # One live OTP per user and purpose, create_otp upserts on it
+        Index("uq_otp_user_id_used_for", "user_id", "used_for", unique=True),
+        # Range scans of the expired OTP reaper
+        Index("ix_otp_s_time", "s_time"),
+    )
 
     def __str__(self):
         return f"{self.user.name}, OTP for {self.used_for}"
 
     @classmethod
-    def verify_otp(
+    async def verify_otp(
         cls, session, user, code, v_type=OTPChoices.ACCOUNT_ACTIVATION, v_time=120
     ):
         try:
             # Fetch the last OTP for this user and type
             obj = (
-                session.query(cls)
-                .filter_by(user_id=user.id, used_for=v_type)
-                .order_by(cls.s_time.desc())
-                .first()
-            )
+                await session.execute(
+                    select(cls.code, cls.s_time)
+                    .filter_by(user_id=user.id, used_for=v_type)
+                    .order_by(cls.s_time.desc())
+                    .limit(1)
+                )
+            ).first()
 
             if obj:
-                c_time = (datetime.utcnow() - obj.s_time).seconds <= v_time
+                c_time = (datetime.utcnow() - obj.s_time).total_seconds() <= v_time
                 if c_time:
-                    if code == obj.code:
+                    if compare_digest(str(code), obj.code):
                         return 1, ""  # OTP matched
                     else:
                         return 2, "OTP is Invalid."  # OTP Wrong
@@ -0,0 +1,12 @@
+from sqlalchemy import Column, Integer, DateTime
+
+from app.models.base import Base
+
+
+class ReplicaHeartbeat(Base):
+    """Single row the API rewrites on the primary, its age on a replica is that replica's lag."""
+
+    __tablename__ = "replica_heartbeat"
+
+    id = Column(Integer, primary_key=True)
+    beat_at = Column(DateTime, nullable=False)
@@ -0,0 +1,25 @@
+from sqlalchemy import Column, Integer, String, DateTime, Text, JSON, Index
+
+from app.choices import JobStatusChoices
+from app.models.base import Base
+
+from datetime import datetime
+
+
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(50), nullable=False)
+    payload = Column(JSON, nullable=False, default=dict)
+    status = Column(String(20), nullable=False, default=JobStatusChoices.QUEUED)
+    attempts = Column(Integer, nullable=False, default=0)
+    # Not claimable before this time, doubles as the lease expiry while running
+    available_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (Index("ix_jobs_status_available_at", "status", "available_at"),)
+
+    def __str__(self):
+        return f"{self.kind} job #{self.id} ({self.status})"
@@ -0,0 +1,24 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index
+
+from app.models.base import Base
+
+from datetime import datetime
+
+
+class RevokedToken(Base):
+    """A logged out token, or with no `jti` every token of the user issued before `revoked_at`."""
+
+    __tablename__ = "revoked_tokens"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    jti = Column(String(36), nullable=True)
+    revoked_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    # When the revoked token(s) would have expired anyway, the row is useless after that
+    expires_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        # Incremental loads of the in-process denylists
+        Index("ix_revoked_tokens_revoked_at", "revoked_at"),
+        Index("ix_revoked_tokens_expires_at", "expires_at"),
+    )
@@ -1,11 +1,11 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Date
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Date, case, inspect
+from sqlalchemy.ext.asyncio import async_object_session
 from sqlalchemy.orm import relationship
-from passlib.context import CryptContext
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 
+from app.services.password import password_hasher, pwd_context
 from app.models.base import Base
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from app.config import settings
 
 
 class User(Base):
@@ -19,6 +19,8 @@ class User(Base):
     date_of_birth = Column(Date, nullable=True)
     password = Column(String(128), nullable=False)
     profile_picture = Column(String(255), nullable=True)
+    # "<size>.<format>" of the variants the worker wrote, comma separated, see app.services.images
+    profile_picture_variants = Column(String(255), nullable=True)
     last_login = Column(DateTime, nullable=True)
     is_active = Column(Boolean, default=False)
     is_superuser = Column(Boolean, default=False)
@@ -26,6 +28,9 @@ class User(Base):
     deleted = Column(Boolean, default=False)
     deleted_at = Column(DateTime, nullable=True)
     two_factor = Column(Boolean, default=False)
+    # Consecutive failed logins, the account is locked until `locked_until` once they reach the threshold
+    failed_logins = Column(Integer, default=0, server_default="0", nullable=False)
+    locked_until = Column(DateTime, nullable=True)
 
     otps = relationship("OTP", back_populates="user")
 
@@ -37,3 +42,42 @@ class User(Base):
 
     def set_password(self, password: str):
         self.password = pwd_context.hash(password)
+
+    async def averify_password(self, password: str) -> bool:
+        # Users from app.services.user_cache come without their password hash
+        if "password" in inspect(self).unloaded:
+            await async_object_session(self).refresh(self, ["password"])
+        verified, new_hash = await password_hasher.verify_and_update(password, self.password)
+        if verified and new_hash:
+            self.password = new_hash
+        return verified
+
+    async def aset_password(self, password: str):
+        self.password = await password_hasher.hash(password)
+
+    def locked_for(self) -> float:
+        """Seconds left of a lockout, 0 when the account is not locked."""
+        if self.locked_until is None:
+            return 0
+        return max((self.locked_until - datetime.utcnow()).total_seconds(), 0)
+
+    def record_failed_login(self):
+        """Counts a failed login, locking the account once LOGIN_LOCKOUT_THRESHOLD is reached.
+
+        Both columns are updated in SQL at flush, so concurrent failures all count.
+        """
+        if not settings.LOGIN_LOCKOUT_THRESHOLD:
+            return
+        reached = User.failed_logins + 1 >= settings.LOGIN_LOCKOUT_THRESHOLD
+        locked_until = datetime.utcnow() + timedelta(seconds=settings.LOGIN_LOCKOUT_SECONDS)
+        self.failed_logins = case((reached, 0), else_=User.failed_logins + 1)
+        self.locked_until = case((reached, locked_until), else_=User.locked_until)
+
+    def clear_failed_logins(self):
+        if self.failed_logins or self.locked_until:
+            self.failed_logins = 0
+            self.locked_until = None
+
+    def record_login(self):
+        self.last_login = datetime.now(timezone.utc)
+        self.clear_failed_logins()
@@ -0,0 +1,148 @@
+"""Per-request SQL profiling, for development and staging (SQL_PROFILE).
+
+Every statement a request runs is recorded with its time and the line of
+app code that issued it. Statements that run more than once with the same
+SQL (the N+1 pattern: one query per row of a previous result) are reported
+as duplicates, and those issued by a lazy-loaded relationship are marked
+with it. SQLProfilerMiddleware adds the totals to the response headers and
+logs a warning for each request with duplicates or lazy loads.
+
+The call site of a statement run by an AsyncSession is outside the greenlet
+that executes it, so the frames of the greenlets waiting on it are walked too.
+"""
+from sqlalchemy.orm import ORMExecuteState, Session
+from sqlalchemy import event
+
+from dataclasses import dataclass, field
+from contextlib import contextmanager
+from contextvars import ContextVar
+from collections import Counter
+from pathlib import Path
+import logging
+import sys
+
+
+logger = logging.getLogger(__name__)
+
+APP_DIR = Path(__file__).resolve().parent
+ROOT_DIR = APP_DIR.parent
+# Where statements pass through on their way to the database, never the call site
+SKIPPED_FILES = {str(APP_DIR / "database.py"), str(Path(__file__).resolve())}
+
+
+def frames():
+    frame = sys._getframe(1)
+    while frame is not None:
+        yield frame
+        frame = frame.f_back
+    greenlet = sys.modules.get("greenlet")
+    if greenlet is None:
+        return
+    current = greenlet.getcurrent()
+    while current.parent is not None:
+        current = current.parent
+        frame = current.gr_frame
+        while frame is not None:
+            yield frame
+            frame = frame.f_back
+
+
+def call_site() -> str:
+    """`path:line function` of the innermost app frame running the current statement."""
+    for frame in frames():
+        filename = frame.f_code.co_filename
+        if filename.startswith(str(APP_DIR)) and filename not in SKIPPED_FILES:
+            return f"{Path(filename).relative_to(ROOT_DIR)}:{frame.f_lineno} {frame.f_code.co_name}"
+    return "unknown"
+
+
+@dataclass
+class QueryRecord:
+    statement: str
+    seconds: float
+    call_site: str
+    # `Model.relationship` when issued by a lazy load
+    lazy_load: str | None = None
+
+
+@dataclass
+class QueryProfile:
+    label: str = ""
+    queries: list[QueryRecord] = field(default_factory=list)
+    _lazy_load: str | None = None
+
+    def record(self, statement: str, seconds: float):
+        self.queries.append(QueryRecord(statement, seconds, call_site(), self._lazy_load))
+        self._lazy_load = None
+
+    @property
+    def seconds(self) -> float:
+        return sum(query.seconds for query in self.queries)
+
+    def duplicates(self) -> dict[str, int]:
+        """Statements run more than once, with how many times."""
+        return {statement: n for statement, n in Counter(q.statement for q in self.queries).items() if n > 1}
+
+    def lazy_loads(self) -> list[QueryRecord]:
+        return [query for query in self.queries if query.lazy_load]
+
+    def report(self) -> str:
+        duplicates = self.duplicates()
+        lines = [f"{self.label}: {len(self.queries)} queries in {self.seconds * 1000:.2f}ms"]
+        for i, query in enumerate(self.queries, 1):
+            flags = []
+            if query.statement in duplicates:
+                flags.append(f"duplicate x{duplicates[query.statement]}")
+            if query.lazy_load:
+                flags.append(f"lazy load of {query.lazy_load}")
+            flags = f" [{', '.join(flags)}]" if flags else ""
+            statement = " ".join(query.statement.split())
+            lines.append(f"  {i}. {query.seconds * 1000:.2f}ms {query.call_site}{flags}\n     {statement}")
+        return "\n".join(lines)
+
+
+# Set while a request (or a block in a test) is profiled
+current_profile: ContextVar[QueryProfile | None] = ContextVar("current_profile", default=None)
+
+
+class SQLProfiler:
+    def __init__(self):
+        self._collectors: list[list[QueryProfile]] = []
+
+    @contextmanager
+    def profile(self, label: str = ""):
+        """Records the statements run in the block, in this context."""
+        profile = QueryProfile(label)
+        token = current_profile.set(profile)
+        try:
+            yield profile
+        finally:
+            current_profile.reset(token)
+
+    @contextmanager
+    def collect(self):
+        """Gathers the profiles of the requests finished during the block, from any thread."""
+        profiles: list[QueryProfile] = []
+        self._collectors.append(profiles)
+        try:
+            yield profiles
+        finally:
+            self._collectors.remove(profiles)
+
+    def finish(self, profile: QueryProfile):
+        for profiles in self._collectors:
+            profiles.append(profile)
+        if profile.duplicates() or profile.lazy_loads():
+            logger.warning("Duplicate or lazy-load queries in %s", profile.report())
+
+
+sql_profiler = SQLProfiler()
+
+
+@event.listens_for(Session, "do_orm_execute")
+def mark_lazy_load(state: ORMExecuteState):
+    profile = current_profile.get()
+    # Only SELECTs have loader options, bulk INSERT/UPDATE go through this event too
+    if profile is not None and state.is_select and state.lazy_loaded_from is not None:
+        mapper, relationship = state.loader_strategy_path.path[-2:]
+        profile._lazy_load = f"{mapper.class_.__name__}.{relationship.key}"
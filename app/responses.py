@@ -0,0 +1,27 @@
+from fastapi.responses import JSONResponse, Response
+
+from pydantic import BaseModel
+
+from typing import Any
+
+import orjson
+
+
+class ORJSONResponse(JSONResponse):
+    """Default response class, encodes the dicts returned by handlers with orjson."""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+def model_response(serializer: type[BaseModel], obj: Any, status_code: int = 200) -> Response:
+    """Validates `obj` once and writes the JSON straight from pydantic-core.
+
+    Returning a Response skips FastAPI's own validation of the handler's
+    result. Keep `response_model` on the route for the OpenAPI schema.
+    """
+    return Response(
+        content=serializer.model_validate(obj).model_dump_json(),
+        status_code=status_code,
+        media_type="application/json",
+    )
@@ -1,21 +1,35 @@
-from pydantic import BaseModel, Field, EmailStr
+from pydantic import BaseModel, Field, EmailStr, WithJsonSchema, computed_field
+
+from app.services.images import variant_urls
 
 from datetime import date, datetime
+from typing import Annotated
+
+
+# Stored emails were validated on the way in, re-validating one costs more than the rest of the payload
+StoredEmail = Annotated[str, WithJsonSchema({"type": "string", "format": "email"})]
 
 
 class UserResponseSer(BaseModel):
     id: int
     # username: str
-    email: EmailStr
+    email: StoredEmail
     first_name: str
     last_name: str
     date_of_birth: date | None 
     profile_picture: str | None
+    profile_picture_variants_: str | None = Field(None, alias="profile_picture_variants", exclude=True)
     last_login: datetime | None
     is_active: bool
     is_superuser: bool
     date_joined: datetime
 
+    @computed_field
+    @property
+    def profile_picture_variants(self) -> dict[str, dict[str, str]]:
+        # {"64": {"webp": ..., "avif": ...}, ...}, once the worker has written them
+        return variant_urls(self.profile_picture, self.profile_picture_variants_)
+
     class Config:
         from_attributes = True
 
@@ -0,0 +1,406 @@
+from app.config import settings
+from app import metrics
+
+from email.message import EmailMessage as MIMEMessage
+from dataclasses import dataclass, asdict
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING
+from pathlib import Path
+import asyncio
+import logging
+import random
+import json
+import time
+
+if TYPE_CHECKING:
+    import httpx
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class EmailMessage:
+    to: str
+    subject: str
+    text: str
+    html: str | None = None
+
+
+class TransientEmailError(Exception):
+    """Delivery failed in a way that is worth retrying (network errors, 429, 5xx)."""
+
+
+class EmailDeliveryError(Exception):
+    pass
+
+
+class EmailRejectedError(EmailDeliveryError):
+    """The provider refused the messages (4xx, 5xx SMTP replies), sending them again will not help."""
+
+
+# Index in the batch of a message that was not delivered, to why
+Failures = dict[int, TransientEmailError | EmailRejectedError]
+
+
+class EmailTransport(ABC):
+    max_batch_size: int = 1
+
+    @abstractmethod
+    async def send(self, messages: list[EmailMessage]) -> Failures:
+        """Sends `messages`, returns the ones that failed on their own.
+
+        Raises TransientEmailError or EmailRejectedError when none was sent.
+        """
+
+    async def close(self) -> None:
+        pass
+
+
+class MailjetTransport(EmailTransport):
+    API_URL = "https://api.mailjet.com/v3.1/send"
+    max_batch_size = 50  # Mailjet's limit for the `Messages` array
+
+    def __init__(self, api_key: str, api_secret: str, sender_email: str, sender_name: str, max_connections: int):
+        self.sender = {"Email": sender_email, "Name": sender_name}
+        self.auth = (api_key or "", api_secret or "")
+        self.max_connections = max_connections
+        self._client: "httpx.AsyncClient | None" = None
+
+    @property
+    def client(self) -> "httpx.AsyncClient":
+        # One keep-alive pool per process, created inside the running loop
+        if self._client is None:
+            # Imported on first use, httpx pulls in click, rich and pygments, ~100ms the API never needs
+            import httpx
+
+            self._client = httpx.AsyncClient(
+                auth=self.auth,
+                timeout=httpx.Timeout(10.0),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+            )
+        return self._client
+
+    def _payload(self, message: EmailMessage) -> dict:
+        payload = {
+            "From": self.sender,
+            "To": [{"Email": message.to}],
+            "Subject": message.subject,
+            "TextPart": message.text,
+        }
+        if message.html:
+            payload["HTMLPart"] = message.html
+        return payload
+
+    async def send(self, messages: list[EmailMessage]) -> Failures:
+        import httpx
+
+        try:
+            resp = await self.client.post(
+                self.API_URL, json={"Messages": [self._payload(m) for m in messages]}
+            )
+        except httpx.HTTPError as e:
+            raise TransientEmailError(str(e)) from e
+
+        if resp.status_code == 429 or resp.status_code >= 500:
+            raise TransientEmailError(f"Mailjet responded with {resp.status_code}")
+        # A 400 with one result per message means some of them were sent, a 401 has none
+        results = self._results(resp)
+        if results is not None and len(results) == len(messages):
+            return {i: self._failure(result) for i, result in enumerate(results) if result.get("Status") != "success"}
+        if resp.status_code != 200:
+            raise EmailRejectedError(f"Mailjet responded with {resp.status_code}: {resp.text}")
+        return {}
+
+    @staticmethod
+    def _failure(result: dict) -> TransientEmailError | EmailRejectedError:
+        errors = result.get("Errors") or []
+        reason = "; ".join(str(e.get("ErrorMessage", "")) for e in errors) or str(result.get("Status"))
+        codes = [e.get("StatusCode") for e in errors if isinstance(e.get("StatusCode"), int)]
+        if codes and all(code == 429 or code >= 500 for code in codes):
+            return TransientEmailError(reason)
+        return EmailRejectedError(reason)
+
+    @staticmethod
+    def _results(resp: "httpx.Response") -> list[dict] | None:
+        try:
+            results = resp.json()["Messages"]
+        except (ValueError, KeyError, TypeError):
+            return None
+        return results if isinstance(results, list) and all(isinstance(r, dict) for r in results) else None
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class SMTPTransport(EmailTransport):
+    max_batch_size = 50  # Messages sent over one SMTP connection
+
+    def __init__(self, host: str, port: int, username: str, password: str, use_tls: bool, sender: str):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.sender = sender
+
+    def _send_sync(self, messages: list[EmailMessage]) -> Failures:
+        """Sends `messages` over one connection, the ones before a failure stay sent."""
+        import smtplib
+
+        failures = {}
+        with smtplib.SMTP(self.host, self.port, timeout=10) as smtp:
+            if self.use_tls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            for i, message in enumerate(messages):
+                mime = MIMEMessage()
+                mime["From"] = self.sender
+                mime["To"] = message.to
+                mime["Subject"] = message.subject
+                mime.set_content(message.text)
+                if message.html:
+                    mime.add_alternative(message.html, subtype="html")
+                try:
+                    smtp.send_message(mime)
+                except (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException) as e:
+                    failures[i] = smtp_failure(e)
+                except OSError as e:
+                    # The connection is gone, this message and the rest were not sent
+                    failures.update(dict.fromkeys(range(i, len(messages)), smtp_failure(e)))
+                    break
+        return failures
+
+    async def send(self, messages: list[EmailMessage]) -> Failures:
+        try:
+            return await asyncio.to_thread(self._send_sync, messages)
+        except OSError as e:  # smtplib's errors are OSErrors
+            raise smtp_failure(e) from e
+
+
+def smtp_failure(e: OSError) -> TransientEmailError | EmailRejectedError:
+    return TransientEmailError(str(e)) if is_transient_smtp_error(e) else EmailRejectedError(str(e))
+
+
+def is_transient_smtp_error(e: OSError) -> bool:
+    """Connection errors and 4xx replies are, 5xx replies (bad credentials, unknown recipient) are not."""
+    import smtplib
+
+    if isinstance(e, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in e.recipients.values())
+    if isinstance(e, smtplib.SMTPResponseException):
+        return 400 <= e.smtp_code < 500
+    if isinstance(e, smtplib.SMTPServerDisconnected):
+        return True
+    # Anything else smtplib raises is a protocol problem, e.g. no STARTTLS, other OSErrors are network errors
+    return not isinstance(e, smtplib.SMTPException)
+
+
+class MemoryTransport(EmailTransport):
+    """Keeps delivered messages in `outbox`, for tests and local load runs."""
+
+    max_batch_size = 50
+
+    def __init__(self):
+        self.outbox: list[EmailMessage] = []
+
+    async def send(self, messages: list[EmailMessage]) -> Failures:
+        self.outbox.extend(messages)
+        return {}
+
+
+class FileTransport(EmailTransport):
+    """Appends delivered messages to a JSON lines file."""
+
+    max_batch_size = 50
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+
+    def _write(self, messages: list[EmailMessage]) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a") as f:
+            for message in messages:
+                f.write(json.dumps(asdict(message)) + "\n")
+
+    async def send(self, messages: list[EmailMessage]) -> Failures:
+        await asyncio.to_thread(self._write, messages)
+        return {}
+
+
+class EmailService:
+    """Queues messages and delivers them in batches from a background task.
+
+    Up to `batch_size` messages that arrive within `linger` seconds of each
+    other go out in one transport call, at most `max_concurrency` calls are in
+    flight, and transient failures are retried with exponential backoff.
+    """
+
+    def __init__(
+        self,
+        transport: EmailTransport,
+        batch_size: int,
+        max_concurrency: int,
+        max_retries: int,
+        retry_backoff: float,
+        linger: float,
+        queue_size: int,
+    ):
+        self.transport = transport
+        name = type(transport).__name__.removesuffix("Transport").lower()
+        self._send_time = metrics.email_send_duration.labels(name)
+        self._sent = metrics.emails_sent.labels(name)
+        self._gave_up = metrics.email_failures.labels(name, "retries_exhausted")
+        self._failed = metrics.email_failures.labels(name, "error")
+        self.batch_size = max(1, min(batch_size, transport.max_batch_size))
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.linger = linger
+        self.queue_size = queue_size
+        self._max_concurrency = max_concurrency
+        self._queue: asyncio.Queue | None = None
+        self._slots: asyncio.Semaphore | None = None
+        self._dispatcher: asyncio.Task | None = None
+        self._deliveries: set[asyncio.Task] = set()
+
+    def start(self):
+        if self._dispatcher is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            self._slots = asyncio.Semaphore(self._max_concurrency)
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def stop(self, timeout: float = 10):
+        if self._dispatcher is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Dropping %d undelivered email(s) on shutdown", self._queue.qsize())
+        self._dispatcher.cancel()
+        self._dispatcher = None
+        await self.transport.close()
+
+    def enqueue(self, message: EmailMessage):
+        """Fire and forget, failures are only logged."""
+        self.start()
+        try:
+            self._queue.put_nowait((message, None))
+        except asyncio.QueueFull:
+            logger.error("Email queue is full, dropping email to '%s'", message.to)
+
+    async def send(self, message: EmailMessage):
+        """Waits until the batch holding `message` is delivered, raises EmailDeliveryError otherwise."""
+        self.start()
+        delivered = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((message, delivered))
+        except asyncio.QueueFull:
+            raise EmailDeliveryError("Email queue is full")
+        await delivered
+
+    async def _dispatch(self):
+        while True:
+            batch = [await self._queue.get()]
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.linger
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    break
+
+            await self._slots.acquire()
+            task = asyncio.create_task(self._deliver(batch))
+            self._deliveries.add(task)
+            task.add_done_callback(self._deliveries.discard)
+
+    async def _deliver(self, batch: list[tuple[EmailMessage, asyncio.Future | None]]):
+        # Index in the batch of every message still to send, only those are retried
+        pending = list(range(len(batch)))
+        # Index of every message that was not delivered, to the error its sender gets
+        errors: dict[int, EmailDeliveryError] = {}
+        try:
+            for attempt in range(self.max_retries + 1):
+                started = time.perf_counter()
+                try:
+                    failures = await self.transport.send([batch[i][0] for i in pending])
+                except (TransientEmailError, EmailRejectedError) as e:
+                    failures = dict.fromkeys(range(len(pending)), e)
+                except Exception as e:
+                    logger.exception("Failed to send %d email(s)", len(pending))
+                    failures = dict.fromkeys(range(len(pending)), EmailDeliveryError(str(e)))
+                self._send_time.observe(time.perf_counter() - started)
+
+                retry, reason = [], None
+                for position, i in enumerate(pending):
+                    failure = failures.get(position)
+                    if isinstance(failure, TransientEmailError):
+                        retry.append(i)
+                        reason = failure
+                    elif failure is not None:
+                        errors[i] = failure
+                refused = len(failures) - len(retry)
+                self._sent.inc(len(pending) - len(failures))
+                self._failed.inc(refused)
+                logger.info("Sent %d email(s), %d refused, %d to retry", len(pending) - len(failures), refused, len(retry))
+                pending = retry
+                if not pending:
+                    break
+                if attempt == self.max_retries:
+                    self._gave_up.inc(len(pending))
+                    logger.error("Giving up on %d email(s) after %d attempts: %s", len(pending), attempt + 1, reason)
+                    errors.update(dict.fromkeys(pending, EmailDeliveryError(str(reason))))
+                    break
+                delay = self.retry_backoff * 2**attempt
+                await asyncio.sleep(delay + random.uniform(0, delay / 2))
+        finally:
+            self._slots.release()
+            for i, (_, delivered) in enumerate(batch):
+                if delivered is not None and not delivered.done():
+                    if i not in errors:
+                        delivered.set_result(None)
+                    else:
+                        delivered.set_exception(errors[i])
+                self._queue.task_done()
+
+
+def get_transport(name: str) -> EmailTransport:
+    if name == "mailjet":
+        return MailjetTransport(
+            settings.MAILJET_API_PUB,
+            settings.MAILJET_API_PRI,
+            settings.MAILJET_SENDER_EMAIL,
+            settings.MAILJET_SENDER_NAME,
+            max_connections=settings.EMAIL_MAX_CONCURRENCY,
+        )
+    if name == "smtp":
+        return SMTPTransport(
+            settings.SMTP_HOST,
+            settings.SMTP_PORT,
+            settings.SMTP_USERNAME,
+            settings.SMTP_PASSWORD,
+            settings.SMTP_USE_TLS,
+            sender=f"{settings.MAILJET_SENDER_NAME} <{settings.MAILJET_SENDER_EMAIL}>",
+        )
+    if name == "memory":
+        return MemoryTransport()
+    if name == "file":
+        return FileTransport(settings.EMAIL_FILE_PATH)
+    raise ValueError(f"Unknown EMAIL_TRANSPORT '{name}'")
+
+
+email_service = EmailService(
+    get_transport(settings.EMAIL_TRANSPORT),
+    batch_size=settings.EMAIL_BATCH_SIZE,
+    max_concurrency=settings.EMAIL_MAX_CONCURRENCY,
+    max_retries=settings.EMAIL_MAX_RETRIES,
+    retry_backoff=settings.EMAIL_RETRY_BACKOFF,
+    linger=settings.EMAIL_BATCH_LINGER,
+    queue_size=settings.EMAIL_QUEUE_SIZE,
+)
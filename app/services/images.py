@@ -0,0 +1,122 @@
+"""Thumbnails and WebP/AVIF variants of uploaded profile pictures.
+
+Uploads are stored as `<sha256>.<ext>`, and every variant is derived from that
+name as `<sha256>_<size>.<format>`. The same picture uploaded twice is stored
+and processed once, and a variant URL never changes its content.
+
+The worker records the variants it has on the users of the picture, in
+`profile_picture_variants`. Only those are advertised, a format this Pillow
+build cannot encode or a picture not processed yet has no URLs.
+"""
+from app.config import settings
+
+from typing import TYPE_CHECKING
+from functools import lru_cache
+from pathlib import Path
+import asyncio
+import logging
+import re
+import os
+
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+
+logger = logging.getLogger(__name__)
+
+HASHED_NAME = re.compile(r"^[0-9a-f]{64}$")
+SAVE_OPTIONS = {
+    "webp": {"method": 4},
+    "avif": {"speed": 8},
+    "jpeg": {"optimize": True, "progressive": True},
+}
+
+_pool: "ProcessPoolExecutor | None" = None
+
+
+def variant_path(path: str | Path, size: int, format: str) -> Path:
+    path = Path(path)
+    return path.with_name(f"{path.stem}_{size}.{format}")
+
+
+@lru_cache(maxsize=4096)
+def variant_urls(path: str | None, variants: str | None) -> dict[str, dict[str, str]]:
+    """URLs of the `variants` of `path`, keyed by size, then format. Empty for legacy, non hashed uploads.
+
+    Runs for every serialized user, so it sticks to string operations and is cached.
+    """
+    if not path or not variants:
+        return {}
+    stem = path.rpartition("/")[2].partition(".")[0]
+    if not HASHED_NAME.match(stem):
+        return {}
+    prefix = f"{path.rpartition('.')[0]}_"
+    urls = {}
+    for variant in variants.split(","):
+        size, _, format = variant.partition(".")
+        urls.setdefault(size, {})[format] = f"{prefix}{size}.{format}"
+    return urls
+
+
+def make_variants(path: str, sizes: tuple[int, ...], formats: tuple[str, ...], quality: int) -> list[str]:
+    """Writes the missing variants of `path`, returns every variant it has as `<size>.<format>`.
+
+    CPU bound, runs in a worker process. Variants that already exist, from an
+    earlier upload of the same picture, are kept. Formats this Pillow build
+    cannot encode are left out.
+    """
+    from PIL import Image, ImageOps, features
+
+    formats = [format for format in formats if format not in ("webp", "avif") or features.check(format)]
+    variants = []
+    with Image.open(path) as image:
+        image.draft("RGB", (max(sizes), max(sizes)))  # JPEG only, decodes at a reduced scale
+        image = ImageOps.exif_transpose(image)
+        has_alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+        image = image.convert("RGBA" if has_alpha else "RGB")
+
+        for size in sorted(sizes, reverse=True):
+            thumbnail = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+            for format in formats:
+                dest = variant_path(path, size, format)
+                variants.append(f"{size}.{format}")
+                if dest.exists():
+                    continue
+                tmp = dest.with_name(f".{dest.name}.{os.getpid()}.part")
+                try:
+                    thumbnail.save(tmp, format=format.upper(), quality=quality, **SAVE_OPTIONS.get(format, {}))
+                    os.replace(tmp, dest)
+                except BaseException:
+                    tmp.unlink(missing_ok=True)
+                    raise
+    return variants
+
+
+def get_pool() -> "ProcessPoolExecutor":
+    global _pool
+    if _pool is None:
+        from concurrent.futures import ProcessPoolExecutor
+
+        _pool = ProcessPoolExecutor(max_workers=settings.IMAGE_PROCESS_WORKERS)
+    return _pool
+
+
+async def process_profile_picture(path: str) -> list[str]:
+    loop = asyncio.get_running_loop()
+    variants = await loop.run_in_executor(
+        get_pool(),
+        make_variants,
+        path,
+        settings.PROFILE_PICTURE_SIZES,
+        settings.PROFILE_PICTURE_FORMATS,
+        settings.PROFILE_PICTURE_QUALITY,
+    )
+    logger.info("%s has variant(s) %s", path, ", ".join(variants))
+    return variants
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
@@ -0,0 +1,86 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update, delete
+
+from app.choices import JobChoices, JobStatusChoices
+from app.models.job import Job
+from app.config import settings
+
+from datetime import datetime, timedelta
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_job(db: AsyncSession, kind: JobChoices, **payload) -> Job:
+    """Adds a job to the session, it becomes visible to workers once the caller commits.
+
+    Payloads must be JSON serializable, pass ids rather than ORM objects.
+    """
+    job = Job(kind=kind, payload=payload)
+    db.add(job)
+    return job
+
+
+async def claim_jobs(db: AsyncSession, limit: int, lease: float) -> list[Job]:
+    """Leases up to `limit` due jobs, a job whose lease expires is handed out again.
+
+    Unless it has had JOB_MAX_ATTEMPTS already: a job that kills the worker running it
+    (OOM, a crash in an image codec) never records a failure, it is failed here instead.
+    """
+    now = datetime.utcnow()
+    abandoned = await db.execute(
+        update(Job)
+        .where(
+            Job.status == JobStatusChoices.RUNNING,
+            Job.available_at <= now,
+            Job.attempts >= settings.JOB_MAX_ATTEMPTS,
+        )
+        .values(status=JobStatusChoices.FAILED, last_error="Lease expired on the last attempt, the worker died or hung")
+        .execution_options(synchronize_session=False)
+    )
+    if abandoned.rowcount:
+        logger.error("Failed %d job(s) whose last attempt never finished", abandoned.rowcount)
+    due = (
+        select(Job.id)
+        .where(
+            Job.status.in_([JobStatusChoices.QUEUED, JobStatusChoices.RUNNING]),
+            Job.available_at <= now,
+        )
+        .order_by(Job.available_at, Job.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    result = await db.scalars(
+        update(Job)
+        .where(Job.id.in_(due.scalar_subquery()))
+        .values(
+            status=JobStatusChoices.RUNNING,
+            attempts=Job.attempts + 1,
+            available_at=now + timedelta(seconds=lease),
+        )
+        .returning(Job),
+        execution_options={"synchronize_session": False},
+    )
+    jobs = list(result)
+    await db.commit()
+    return jobs
+
+
+async def complete_job(db: AsyncSession, job: Job):
+    await db.execute(delete(Job).where(Job.id == job.id))
+    await db.commit()
+
+
+async def retry_or_fail_job(db: AsyncSession, job: Job, error: str, retry: bool = True):
+    if not retry or job.attempts >= settings.JOB_MAX_ATTEMPTS:
+        values = {"status": JobStatusChoices.FAILED, "last_error": error}
+    else:
+        delay = settings.JOB_RETRY_BACKOFF * 2 ** (job.attempts - 1)
+        values = {
+            "status": JobStatusChoices.QUEUED,
+            "available_at": datetime.utcnow() + timedelta(seconds=delay),
+            "last_error": error,
+        }
+    await db.execute(update(Job).where(Job.id == job.id).values(**values))
+    await db.commit()
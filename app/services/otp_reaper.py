@@ -0,0 +1,113 @@
+"""Deletes expired OTPs in bounded batches.
+
+Runs inside the app every OTP_REAPER_INTERVAL seconds, or from cron/CLI with
+
+    python -m app.services.otp_reaper --once
+"""
+from sqlalchemy import delete, select
+
+from app.dependencies import async_session_maker
+from app.models.user import User  # noqa: F401, mapper OTP.user resolves to
+from app.metrics import Counter, Gauge, registry
+from app.models.base import OTP
+from app.config import settings
+
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta
+import argparse
+import asyncio
+import logging
+import json
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ReaperStats:
+    runs: int = 0
+    rows_reaped: int = 0
+    seconds: float = 0.0
+    last_run_rows: int = 0
+    last_run_seconds: float = 0.0
+    last_run_at: datetime | None = None
+
+
+reaper_stats = ReaperStats()
+
+
+@registry.collector
+def reaper_metrics():
+    runs = Counter("otp_reaper_runs_total", "Runs of the expired OTP reaper.")
+    runs.inc(reaper_stats.runs)
+    rows = Counter("otp_reaper_rows_total", "Expired OTPs deleted.")
+    rows.inc(reaper_stats.rows_reaped)
+    seconds = Counter("otp_reaper_seconds_total", "Time spent reaping expired OTPs.")
+    seconds.inc(reaper_stats.seconds)
+    last_rows = Gauge("otp_reaper_last_run_rows", "Expired OTPs deleted by the last run.")
+    last_rows.set(reaper_stats.last_run_rows)
+    last_seconds = Gauge("otp_reaper_last_run_seconds", "Time the last run of the reaper took.")
+    last_seconds.set(reaper_stats.last_run_seconds)
+    return [runs, rows, seconds, last_rows, last_seconds]
+
+
+async def reap_expired_otps(batch_size: int = None, max_age: float = None) -> int:
+    """Deletes OTPs older than `max_age` seconds, one transaction per `batch_size` rows."""
+    batch_size = batch_size or settings.OTP_REAPER_BATCH_SIZE
+    max_age = max_age or settings.OTP_MAX_AGE
+    cutoff = datetime.utcnow() - timedelta(seconds=max_age)
+    started = time.perf_counter()
+
+    reaped = 0
+    while True:
+        async with async_session_maker() as db:
+            expired = select(OTP.id).where(OTP.s_time < cutoff).limit(batch_size)
+            result = await db.execute(
+                delete(OTP).where(OTP.id.in_(expired.scalar_subquery())),
+                execution_options={"synchronize_session": False},
+            )
+            await db.commit()
+        reaped += result.rowcount
+        if result.rowcount < batch_size:
+            break
+        await asyncio.sleep(0)  # let requests interleave between batches
+
+    elapsed = time.perf_counter() - started
+    reaper_stats.runs += 1
+    reaper_stats.rows_reaped += reaped
+    reaper_stats.seconds += elapsed
+    reaper_stats.last_run_rows = reaped
+    reaper_stats.last_run_seconds = elapsed
+    reaper_stats.last_run_at = datetime.utcnow()
+    logger.info("Reaped %d expired OTP(s) in %.3fs", reaped, elapsed)
+    return reaped
+
+
+async def run_otp_reaper(interval: float, batch_size: int = None, max_age: float = None):
+    while True:
+        try:
+            await reap_expired_otps(batch_size, max_age)
+        except Exception:
+            logger.exception("OTP reaper run failed")
+        await asyncio.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--once", action="store_true", help="Run a single pass and exit")
+    parser.add_argument("--interval", type=float, default=settings.OTP_REAPER_INTERVAL or 300)
+    parser.add_argument("--batch-size", type=int, default=settings.OTP_REAPER_BATCH_SIZE)
+    parser.add_argument("--max-age", type=float, default=settings.OTP_MAX_AGE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    if args.once:
+        asyncio.run(reap_expired_otps(args.batch_size, args.max_age))
+        print(json.dumps(asdict(reaper_stats), default=str))
+    else:
+        asyncio.run(run_otp_reaper(args.interval, args.batch_size, args.max_age))
+
+
+if __name__ == "__main__":
+    main()
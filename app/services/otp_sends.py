@@ -0,0 +1,124 @@
+"""Coalesces the OTP emails users ask to be sent again.
+
+A send is keyed by (email, purpose). Every request looks the user up and
+runs its check, so a user activated since the last send gets the error, not
+a stale "sent". The first request that passes issues the send and requests
+arriving while it runs wait for that same issuance. Requests in the
+OTP_RESEND_COOLDOWN seconds after it get its next send time back, without
+another query, a job row or an email. Every response says when the next send
+is allowed.
+
+The window starts at the `s_time` of the user's last OTP for that purpose,
+read once per issuance. That makes it hold across workers and restarts. A
+job the worker has not run yet is only known to the process that enqueued it.
+"""
+from sqlalchemy import select
+
+from app.dependencies import replica_session_maker
+from app.services.replicas import read_your_writes
+from app.services.rate_limit import rate_limiter
+from app.services.jobs import enqueue_job
+from app.choices import JobChoices, OTPChoices
+from app.metrics import Counter, registry
+from app.models.user import User
+from app.models.base import OTP
+from app.utils import adb_commit
+from app.config import settings
+
+from datetime import datetime, timedelta, timezone
+from collections import OrderedDict
+from typing import Awaitable, Callable, Hashable
+import asyncio
+import time
+
+
+class SingleFlight:
+    """Runs one call per key at a time, and shares its result until the expiry it returns.
+
+    The call runs in its own task, so a caller that goes away does not cancel
+    it for the others. Failures are shared with the callers waiting on it
+    but are not kept.
+    """
+
+    def __init__(self):
+        self._calls: dict[Hashable, asyncio.Task] = {}
+        # key -> (monotonic expiry, result), in insertion order
+        self._results: OrderedDict[Hashable, tuple[float, object]] = OrderedDict()
+        self.calls = 0
+        self.coalesced = 0
+
+    async def run(self, key: Hashable, fn: Callable[[], Awaitable[tuple[object, float]]]):
+        """Result of `fn`, which returns it with the seconds it stays valid for."""
+        entry = self._results.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self.coalesced += 1
+                return entry[1]
+            del self._results[key]
+
+        task = self._calls.get(key)
+        if task is None:
+            self.calls += 1
+            task = self._calls[key] = asyncio.ensure_future(self._call(key, fn))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    async def _call(self, key: Hashable, fn):
+        try:
+            result, ttl = await fn()
+        finally:
+            del self._calls[key]
+        now = time.monotonic()
+        if ttl > 0:
+            self._results[key] = (now + ttl, result)
+            self._results.move_to_end(key)
+        # TTLs are bounded, so the oldest entries are the first to expire
+        while self._results and next(iter(self._results.values()))[0] <= now:
+            self._results.popitem(last=False)
+        return result
+
+
+class OTPSends:
+    def __init__(self, cooldown: float):
+        self.cooldown = cooldown
+        self.flight = SingleFlight()
+
+    async def send(self, email: str, used_for: OTPChoices, check: Callable[[User | None], None]) -> datetime:
+        """Issues a `used_for` OTP email unless one was sent within the cooldown.
+
+        `check` raises an HTTPException when the user cannot be sent one. Returns when
+        the next send is allowed.
+        """
+        async with replica_session_maker() as db:
+            read_your_writes(db, email=email)
+            user = await db.scalar(select(User).where(User.email == email))
+        check(user)
+        return await self.flight.run((email.lower(), used_for), lambda: self._issue(user.id, email, used_for))
+
+    async def _issue(self, user_id: int, email: str, used_for: OTPChoices) -> tuple[datetime, float]:
+        async with replica_session_maker() as db:
+            read_your_writes(db, user_id=user_id, email=email)
+            now = datetime.now(timezone.utc)
+            last_sent = await db.scalar(select(OTP.s_time).filter_by(user_id=user_id, used_for=used_for))
+            if last_sent is not None:
+                next_send_at = last_sent.replace(tzinfo=timezone.utc) + timedelta(seconds=self.cooldown)
+                if next_send_at > now:
+                    return next_send_at, (next_send_at - now).total_seconds()
+
+            # Only sends count towards the per-email limit, repeats inside the window are free
+            await rate_limiter.check_email("send_email", email)
+            enqueue_job(db, JobChoices.OTP_EMAIL, user_id=user_id, used_for=used_for)
+            await adb_commit(db)
+        return now + timedelta(seconds=self.cooldown), self.cooldown
+
+
+otp_sends = OTPSends(settings.OTP_RESEND_COOLDOWN)
+
+
+@registry.collector
+def otp_send_metrics():
+    requests = Counter("otp_send_requests_total", "Requests to send an OTP email again.", ["result"])
+    requests.labels("issued").inc(otp_sends.flight.calls)
+    requests.labels("coalesced").inc(otp_sends.flight.coalesced)
+    return [requests]
@@ -0,0 +1,76 @@
+from fastapi import HTTPException, status
+
+from passlib.context import CryptContext
+
+from app.config import settings
+from app import metrics
+
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import time
+
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.BCRYPT_ROUNDS
+)
+
+
+class PasswordHasher:
+    """Runs bcrypt off the event loop on a bounded thread pool.
+
+    bcrypt releases the GIL while hashing, so threads give real parallelism.
+    At most `workers + queue_size` calls are admitted at once, callers beyond
+    that wait up to `queue_timeout` seconds for a slot and then get a 503.
+    """
+
+    def __init__(self, context: CryptContext, workers: int, queue_size: int, queue_timeout: float):
+        self.context = context
+        self.queue_timeout = queue_timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hasher")
+        self._slots = asyncio.Semaphore(workers + queue_size)
+        self._hash_time = metrics.password_hash_duration.labels("hash")
+        self._verify_time = metrics.password_hash_duration.labels("verify")
+
+    async def _run(self, timer, fn, *args):
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            metrics.password_hash_rejected.inc()
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server is busy, please try again later.",
+                headers={"Retry-After": str(max(1, round(self.queue_timeout)))},
+            )
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            timer.observe(time.perf_counter() - started)
+            self._slots.release()
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self._hash_time, self.context.hash, password)
+
+    async def verify_and_update(self, password: str, hashed: str) -> tuple[bool, str | None]:
+        """Returns whether the password matches, and a new hash when the stored cost is outdated."""
+        return await self._run(self._verify_time, self.context.verify_and_update, password, hashed)
+
+    async def warm_up(self):
+        """Loads the bcrypt backend, which runs its self test, and starts a hashing thread."""
+        await asyncio.get_running_loop().run_in_executor(self._executor, lambda: self.context.handler().get_backend())
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def hash_passwords(passwords: list[str]) -> list[str]:
+    """Hashes of `passwords`, run in the worker processes of the bulk user import."""
+    return [pwd_context.hash(password) for password in passwords]
+
+
+password_hasher = PasswordHasher(
+    pwd_context,
+    workers=settings.PASSWORD_HASH_WORKERS,
+    queue_size=settings.PASSWORD_HASH_QUEUE_SIZE,
+    queue_timeout=settings.PASSWORD_HASH_QUEUE_TIMEOUT,
+)
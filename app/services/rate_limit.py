@@ -0,0 +1,148 @@
+"""Per-IP and per-email request limits of the authentication endpoints.
+
+Limits are sliding window counters: a key keeps the hit count of the current
+and the previous fixed window, and the previous one is weighted by how much
+of it the sliding window still covers. That is three integers per key, and
+O(1) per hit, whatever the limit. Rejected hits are not counted.
+
+They run before the user is loaded and before any bcrypt work, so a burst of
+credential stuffing costs a dict lookup per request once over the limit.
+"""
+from fastapi import Depends, HTTPException, Request, status
+
+from app.metrics import Counter, registry
+from app.config import settings
+
+from collections import OrderedDict
+import math
+import time
+
+
+def retry_after(previous: int, current: int, limit: int, elapsed: float, window: float) -> float:
+    """Seconds until one more hit fits under `limit`, `elapsed` is the fraction of the current window gone."""
+    if current < limit:
+        # The weight of the previous window has to decay enough
+        needed = 1 - (limit - 1 - current) / previous
+        return max(needed - elapsed, 0) * window
+    # Only the next window can fit it, once enough of this one slid out
+    return (1 - elapsed) * window + max(1 - (limit - 1) / current, 0) * window
+
+
+class MemoryRateLimitBackend:
+    """Per-process counters, the least recently hit keys are dropped beyond `max_keys`."""
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        # key -> (window number, previous window count, current window count)
+        self._counters: OrderedDict[str, tuple[int, int, int]] = OrderedDict()
+
+    async def hit(self, key: str, limit: int, window: float) -> float | None:
+        """Counts a hit on `key`, or returns how many seconds to wait when over `limit`."""
+        position = time.monotonic() / window
+        number = int(position)
+        stored, previous, current = self._counters.get(key, (number, 0, 0))
+        if stored == number - 1:
+            previous, current = current, 0
+        elif stored != number:
+            previous, current = 0, 0
+
+        elapsed = position - number
+        if previous * (1 - elapsed) + current + 1 > limit:
+            return retry_after(previous, current, limit, elapsed, window)
+
+        self._counters[key] = (number, previous, current + 1)
+        self._counters.move_to_end(key)
+        if len(self._counters) > self.max_keys:
+            self._counters.popitem(last=False)
+        return None
+
+
+class RedisRateLimitBackend:
+    """Shared between workers, one atomic script call per hit."""
+
+    SCRIPT = """
+    local number = tonumber(ARGV[3])
+    local current_key = KEYS[1] .. ':' .. number
+    local current = tonumber(redis.call('GET', current_key) or '0')
+    local previous = tonumber(redis.call('GET', KEYS[1] .. ':' .. (number - 1)) or '0')
+    if previous * (1 - tonumber(ARGV[4])) + current + 1 > tonumber(ARGV[1]) then
+        return {0, previous, current}
+    end
+    redis.call('INCR', current_key)
+    redis.call('PEXPIRE', current_key, math.ceil(tonumber(ARGV[2]) * 2000))
+    return {1, previous, current + 1}
+    """
+
+    def __init__(self, url: str, prefix: str = "rate:"):
+        import redis.asyncio as redis
+
+        self.prefix = prefix
+        self._redis = redis.from_url(url)
+        self._script = self._redis.register_script(self.SCRIPT)
+
+    async def hit(self, key: str, limit: int, window: float) -> float | None:
+        position = time.time() / window
+        number = int(position)
+        elapsed = position - number
+        allowed, previous, current = await self._script(
+            keys=[f"{self.prefix}{key}"], args=[limit, window, number, elapsed]
+        )
+        return None if allowed else retry_after(int(previous), int(current), limit, elapsed, window)
+
+
+class NullRateLimitBackend:
+    async def hit(self, key: str, limit: int, window: float) -> float | None:
+        return None
+
+
+class RateLimiter:
+    def __init__(self, backend, limits: dict[str, tuple[int, float]]):
+        self.backend = backend
+        self.limits = limits
+        self.rejected = 0
+
+    async def check(self, scope: str, key: str):
+        """Counts a hit on `key` in `scope`, raises a 429 once over the scope's limit."""
+        limit, window = self.limits[scope]
+        wait = await self.backend.hit(f"{scope}:{key}", limit, window)
+        if wait is not None:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests, please try again later.",
+                headers={"Retry-After": str(max(1, math.ceil(wait)))},
+            )
+
+    async def check_email(self, action: str, email: str):
+        await self.check(f"{action}_email", email.lower())
+
+    def by_ip(self, action: str):
+        """Route dependency limiting `action` per client IP.
+
+        The IP is the socket peer, run uvicorn with --proxy-headers behind a proxy.
+        """
+
+        async def limit_ip(request: Request):
+            await self.check(f"{action}_ip", request.client.host if request.client else "unknown")
+
+        return Depends(limit_ip)
+
+
+def get_backend(name: str):
+    if name == "memory":
+        return MemoryRateLimitBackend(settings.RATE_LIMIT_MAX_KEYS)
+    if name == "redis":
+        return RedisRateLimitBackend(settings.RATE_LIMIT_REDIS_URL)
+    if name == "none":
+        return NullRateLimitBackend()
+    raise ValueError(f"Unknown RATE_LIMIT_BACKEND '{name}'")
+
+
+rate_limiter = RateLimiter(get_backend(settings.RATE_LIMIT_BACKEND), settings.RATE_LIMITS)
+
+
+@registry.collector
+def rate_limit_metrics():
+    rejected = Counter("rate_limit_rejected_total", "Requests refused with a 429 by the rate limits.")
+    rejected.inc(rate_limiter.rejected)
+    return [rejected]
@@ -0,0 +1,181 @@
+"""Routes the reads of opted-in sessions to read replicas.
+
+Sessions from `ReplicaSessionDep` send SELECTs to a healthy replica and
+everything else (flushes, INSERT/UPDATE/DELETE, SELECT ... FOR UPDATE) to the
+primary. A session reads from the primary once it has written. Keys passed to
+`read_your_writes` stick to the primary for REPLICA_STICKY_SECONDS after any
+session commits a change to that user. A replica whose heartbeat is more than
+REPLICA_MAX_LAG seconds old is skipped, and with none left reads fall back to
+the primary.
+
+Stickiness is tracked per process. Try it locally with two SQLite files:
+
+    DATABASE_REPLICA_URLS=sqlite:///./replica.db
+    python -m app.services.replicas copy    # snapshot the primary into the replicas
+"""
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy.orm import Session
+from sqlalchemy import Delete, Insert, TextClause, Update, event, inspect, make_url, select, update
+
+from app.models.heartbeat import ReplicaHeartbeat
+from app.models.user import User
+from app.config import settings
+
+from collections import OrderedDict
+from datetime import datetime
+import argparse
+import asyncio
+import logging
+import sqlite3
+import random
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class ReplicaRouter:
+    def __init__(self, primary: AsyncEngine, replicas: list[AsyncEngine], sticky_seconds: float, max_lag: float):
+        self.primary = primary
+        self.replicas = replicas
+        self.healthy = list(replicas)
+        self.lag: dict[str, float] = {}
+        self.sticky_seconds = sticky_seconds
+        self.max_lag = max_lag
+        self._sticky: OrderedDict[str, float] = OrderedDict()
+
+    def mark_written(self, keys: set[str]):
+        now = time.monotonic()
+        while self._sticky and next(iter(self._sticky.values())) < now:
+            self._sticky.popitem(last=False)
+        for key in keys:
+            self._sticky[key] = now + self.sticky_seconds
+            self._sticky.move_to_end(key)
+
+    def is_sticky(self, keys) -> bool:
+        now = time.monotonic()
+        return any(self._sticky.get(key, 0) > now for key in keys)
+
+    def choose(self):
+        return random.choice(self.healthy).sync_engine if self.healthy else self.primary.sync_engine
+
+    async def check_lag(self):
+        now = datetime.utcnow()
+        async with self.primary.begin() as conn:
+            result = await conn.execute(update(ReplicaHeartbeat).where(ReplicaHeartbeat.id == 1).values(beat_at=now))
+            if not result.rowcount:
+                await conn.execute(ReplicaHeartbeat.__table__.insert().values(id=1, beat_at=now))
+
+        healthy = []
+        for replica in self.replicas:
+            name = replica.url.render_as_string()
+            try:
+                async with replica.connect() as conn:
+                    beat_at = await conn.scalar(select(ReplicaHeartbeat.beat_at).where(ReplicaHeartbeat.id == 1))
+            except Exception as e:
+                logger.warning("Replica %s is unreachable: %s", name, e)
+                beat_at = None
+            self.lag[name] = (now - beat_at).total_seconds() if beat_at else float("inf")
+            if self.lag[name] <= self.max_lag:
+                healthy.append(replica)
+        if len(healthy) < len(self.healthy):
+            logger.warning("%d of %d replica(s) within %ss of the primary", len(healthy), len(self.replicas), self.max_lag)
+        self.healthy = healthy
+
+    async def run_monitor(self, interval: float):
+        while True:
+            try:
+                await self.check_lag()
+            except Exception:
+                logger.exception("Replica lag check failed")
+            await asyncio.sleep(interval)
+
+
+class RoutingSession(Session):
+    """Session whose reads go through `router` when `info["replica_reads"]` is set."""
+
+    def __init__(self, *args, router: ReplicaRouter | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.router = router
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if (
+            self.router is None
+            or not self.info.get("replica_reads")
+            # bind_arguments={"bind": ...} picks the engine, e.g. the primary for the user cache
+            or kwargs.get("bind") is not None
+            or self._flushing
+            or self.info.get("wrote")
+            or isinstance(clause, (Insert, Update, Delete, TextClause))
+            or getattr(clause, "_for_update_arg", None) is not None
+            or self.router.is_sticky(self.info.get("sticky_keys", ()))
+        ):
+            return super().get_bind(mapper, clause=clause, **kwargs)
+        return self.router.choose()
+
+
+def user_keys(user_id: int | None = None, email: str | None = None) -> set[str]:
+    keys = set()
+    if user_id is not None:
+        keys.add(f"user:{user_id}")
+    if email:
+        keys.add(f"email:{email.lower()}")
+    return keys
+
+
+def read_your_writes(db: AsyncSession, user_id: int | None = None, email: str | None = None):
+    """Reads of `db` go to the primary while this user has a recent write."""
+    db.info.setdefault("sticky_keys", set()).update(user_keys(user_id, email))
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def collect_written_users(session: RoutingSession, flush_context):
+    session.info["wrote"] = True
+    keys = session.info.setdefault("written_keys", set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, User):
+            keys |= user_keys(obj.id, obj.email)
+            for old_email in inspect(obj).attrs.email.history.deleted or ():
+                keys |= user_keys(email=old_email)
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def stick_written_users(session: RoutingSession):
+    keys = session.info.pop("written_keys", None)
+    if keys and session.router is not None:
+        session.router.mark_written(keys)
+
+
+@event.listens_for(RoutingSession, "after_soft_rollback")
+def forget_written_users(session: RoutingSession, previous_transaction):
+    session.info.pop("written_keys", None)
+
+
+def copy_sqlite(primary_url: str, replica_urls: list[str]):
+    """Snapshots a SQLite primary into SQLite replica files with the backup API."""
+    source = sqlite3.connect(make_url(primary_url).database)
+    for url in replica_urls:
+        with sqlite3.connect(make_url(url).database) as dest:
+            source.backup(dest)
+        logger.info("Copied %s to %s", primary_url, url)
+    source.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["copy", "lag"])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    if args.command == "copy":
+        copy_sqlite(settings.DATABASE_URL, settings.DATABASE_REPLICA_URLS)
+    else:
+        from app.dependencies import replica_router
+
+        asyncio.run(replica_router.check_lag())
+        for name, lag in replica_router.lag.items():
+            print(f"{name}\t{lag:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
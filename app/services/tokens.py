@@ -0,0 +1,230 @@
+"""Decoded claims cache and revocation of the JWTs.
+
+fastapi_jwt verifies the signature and the claims of the token on every
+request. The securities below keep the claims of recently seen tokens in a
+bounded LRU instead, an expired token is never served from it.
+
+Revocations live in `revoked_tokens` and every process mirrors the live ones
+in memory, so checking a token is two dict lookups and no query:
+
+- logout revokes a token by its `jti`, until the token expires
+- logout from all devices revokes every token of the user issued before then
+
+A process sees its own revocations as soon as their transaction commits and
+those of other processes after at most TOKEN_REVOCATION_SYNC_INTERVAL seconds.
+"""
+from fastapi_jwt import JwtAccessBearerCookie, JwtAuthorizationCredentials, JwtRefreshBearer
+from fastapi_jwt.jwt_backends.abstract_backend import BackendException
+from fastapi import HTTPException, status
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import Session
+from sqlalchemy import select, delete, event
+
+from app.metrics import Counter, Gauge, registry
+from app.models.token import RevokedToken
+from app.config import settings
+
+from datetime import datetime, timedelta, timezone
+from collections import OrderedDict
+import asyncio
+import logging
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+def epoch(value: datetime) -> float:
+    """Seconds since the epoch of a naive UTC datetime, as stored in the database."""
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+class TokenCache:
+    """Claims of the most recently used tokens, keyed by the encoded token."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._claims: OrderedDict[str, dict] = OrderedDict()
+
+    def get(self, token: str) -> dict | None:
+        claims = self._claims.get(token)
+        if claims is None or claims["exp"] <= time.time():
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._claims.move_to_end(token)
+        return claims
+
+    def set(self, token: str, claims: dict):
+        if not self.maxsize:
+            return
+        self._claims[token] = claims
+        self._claims.move_to_end(token)
+        if len(self._claims) > self.maxsize:
+            self._claims.popitem(last=False)
+
+
+class TokenDenylist:
+    """In-process copy of the live rows of `revoked_tokens`."""
+
+    # Rows are read again for this long after they were written, to catch
+    # transactions that committed after a later row was already synced
+    SYNC_OVERLAP = timedelta(seconds=60)
+
+    def __init__(self):
+        self._jtis: dict[str, float] = {}  # jti -> expiry
+        self._users: dict[int, tuple[int, float]] = {}  # user id -> (tokens issued before are revoked, expiry)
+        self._synced_at: datetime | None = None
+        self._pruned_at = 0.0
+
+    def __len__(self) -> int:
+        return len(self._jtis) + len(self._users)
+
+    def is_revoked(self, claims: dict) -> bool:
+        if claims.get("jti") in self._jtis:
+            return True
+        revoked = self._users.get(claims["subject"].get("id"))
+        return revoked is not None and claims["iat"] < revoked[0]
+
+    def add(self, row: RevokedToken):
+        expires_at = epoch(row.expires_at)
+        if row.jti:
+            self._jtis[row.jti] = expires_at
+        else:
+            # iat has a one second resolution, tokens minted in the same second as the revocation survive it
+            not_before = int(epoch(row.revoked_at))
+            if not_before > self._users.get(row.user_id, (0, 0))[0]:
+                self._users[row.user_id] = (not_before, expires_at)
+
+    def revoke(self, db: AsyncSession, claims: dict):
+        """Revokes the token of `claims` until it expires, the caller commits."""
+        self._revoke(
+            db,
+            user_id=claims["subject"]["id"],
+            jti=claims["jti"],
+            revoked_at=datetime.utcnow(),
+            expires_at=datetime.fromtimestamp(claims["exp"], timezone.utc).replace(tzinfo=None),
+        )
+
+    def revoke_user(self, db: AsyncSession, user_id: int):
+        """Revokes every token of the user issued so far, the caller commits."""
+        now = datetime.utcnow()
+        lifetime = max(timedelta(hours=settings.ACCESS_TOKEN_EXPIRE), timedelta(days=settings.REFRESH_TOKEN_EXPIRE))
+        self._revoke(db, user_id=user_id, revoked_at=now, expires_at=now + lifetime)
+
+    def _revoke(self, db: AsyncSession, **values):
+        db.add(RevokedToken(**values))
+        # Held in memory once the row is committed, see add_committed_revocations. A copy,
+        # the session's row may be expired by then
+        db.info.setdefault("revocations", []).append((self, RevokedToken(**values)))
+
+    async def sync(self, session_maker: async_sessionmaker, prune_interval: float = 300):
+        """Loads the revocations written since the last sync, and drops the expired ones every `prune_interval`."""
+        now = datetime.utcnow()
+        query = select(RevokedToken).where(RevokedToken.expires_at > now)
+        if self._synced_at is not None:
+            query = query.where(RevokedToken.revoked_at >= self._synced_at - self.SYNC_OVERLAP)
+        async with session_maker() as db:
+            for row in await db.scalars(query):
+                self.add(row)
+            self._synced_at = now
+
+            if time.monotonic() - self._pruned_at >= prune_interval:
+                self._pruned_at = time.monotonic()
+                cutoff = time.time()
+                self._jtis = {jti: expiry for jti, expiry in self._jtis.items() if expiry > cutoff}
+                self._users = {user: entry for user, entry in self._users.items() if entry[1] > cutoff}
+                await db.execute(delete(RevokedToken).where(RevokedToken.expires_at <= now))
+                await db.commit()
+
+    async def run_sync(self, session_maker: async_sessionmaker, interval: float):
+        while True:
+            try:
+                await self.sync(session_maker)
+            except Exception:
+                logger.exception("Token denylist sync failed")
+            await asyncio.sleep(interval)
+
+
+@event.listens_for(Session, "after_commit")
+def add_committed_revocations(session: Session):
+    for denylist, row in session.info.pop("revocations", ()):
+        denylist.add(row)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def forget_revocations(session: Session, previous_transaction):
+    session.info.pop("revocations", None)
+
+
+token_cache = TokenCache(settings.TOKEN_CACHE_SIZE)
+token_denylist = TokenDenylist()
+
+
+@registry.collector
+def token_metrics():
+    lookups = Counter("token_cache_lookups_total", "Lookups of the decoded JWT claims cache.", ["result"])
+    lookups.labels("hit").inc(token_cache.hits)
+    lookups.labels("miss").inc(token_cache.misses)
+    revoked = Gauge("token_denylist_entries", "Revoked tokens and users logged out everywhere, held in memory.")
+    revoked.set(len(token_denylist))
+    return [lookups, revoked]
+
+
+class TokenCredentials(JwtAuthorizationCredentials):
+    def __init__(self, claims: dict):
+        super().__init__(claims["subject"], claims.get("jti"))
+        self.claims = claims
+
+
+class CachedTokenSecurity:
+    """Mixed into the fastapi_jwt securities: claims come from `token_cache`, revoked tokens are refused."""
+
+    token_type: str | None = None
+
+    def decode(self, token: str) -> dict | None:
+        """Claims of a valid token, None otherwise."""
+        claims = token_cache.get(token)
+        if claims is None:
+            try:
+                claims = self.jwt_backend.decode(token, self.secret_key)
+            except BackendException:
+                return None
+            token_cache.set(token, claims)
+        return claims
+
+    async def _get_payload(self, bearer, cookie) -> dict | None:
+        token = str(bearer.credentials) if bearer else str(cookie) if cookie else None
+        claims = self.decode(token) if token else None
+        if claims is None:
+            # Missing or invalid, fastapi_jwt reports why
+            return await super()._get_payload(bearer, cookie)
+        if token_denylist.is_revoked(claims):
+            if self.auto_error:
+                raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token has been revoked")
+            return None
+        return claims
+
+    async def _get_credentials(self, bearer, cookie) -> TokenCredentials | None:
+        claims = await self._get_payload(bearer, cookie)
+        if claims is None:
+            return None
+        if self.token_type and claims.get("type") != self.token_type:
+            if self.auto_error:
+                raise HTTPException(
+                    status_code=status.HTTP_401_UNAUTHORIZED,
+                    detail=f"Invalid token: 'type' is not '{self.token_type}'",
+                )
+            return None
+        return TokenCredentials(claims)
+
+
+class AccessSecurity(CachedTokenSecurity, JwtAccessBearerCookie):
+    pass
+
+
+class RefreshSecurity(CachedTokenSecurity, JwtRefreshBearer):
+    token_type = "refresh"
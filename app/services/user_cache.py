@@ -0,0 +1,134 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy import inspect, select
+
+from app.metrics import Counter, registry
+from app.models.user import User
+from app.config import settings
+
+from collections import OrderedDict
+import pickle
+import time
+
+
+class MemoryCacheBackend:
+    """Per-process LRU with a TTL, entries are evicted lazily on access.
+
+    `invalidate` only reaches the process it runs in, so with several API
+    processes the others keep serving a user up to the TTL old. Use it with a
+    single process, and the redis backend otherwise.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[int, tuple[float, dict]] = OrderedDict()
+
+    async def get(self, key: int) -> dict | None:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    async def set(self, key: int, value: dict):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    async def delete(self, key: int):
+        self._data.pop(key, None)
+
+
+class RedisCacheBackend:
+    """Shared between workers, so an invalidation in one is seen by all of them."""
+
+    def __init__(self, url: str, ttl: float, prefix: str = "user:"):
+        import redis.asyncio as redis
+
+        self.ttl = ttl
+        self.prefix = prefix
+        self._redis = redis.from_url(url)
+
+    async def get(self, key: int) -> dict | None:
+        value = await self._redis.get(f"{self.prefix}{key}")
+        return pickle.loads(value) if value is not None else None
+
+    async def set(self, key: int, value: dict):
+        await self._redis.set(f"{self.prefix}{key}", pickle.dumps(value), px=int(self.ttl * 1000))
+
+    async def delete(self, key: int):
+        await self._redis.delete(f"{self.prefix}{key}")
+
+
+class NullCacheBackend:
+    async def get(self, key: int) -> dict | None:
+        return None
+
+    async def set(self, key: int, value: dict):
+        pass
+
+    async def delete(self, key: int):
+        pass
+
+
+class UserCache:
+    """Caches the column values of users by id, except the password hash.
+
+    A hit is attached to the request's session with `merge(load=False)`, which
+    needs no query, so handlers can still modify and commit the user. Its
+    password is loaded when it is first read. Every write to a user must be
+    followed by `invalidate`. A miss is read from the primary even in a
+    replica session, a lagging replica's row would be served to write
+    endpoints too.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._columns = [attr.key for attr in inspect(User).column_attrs if attr.key != "password"]
+
+    async def get(self, db: AsyncSession, user_id: int) -> User | None:
+        values = await self.backend.get(user_id)
+        if values is not None:
+            self.hits += 1
+            user = User(**values)
+            make_transient_to_detached(user)
+            return await db.merge(user, load=False)
+
+        self.misses += 1
+        # From the primary in a replica session too, see the class docstring
+        user = await db.scalar(select(User).where(User.id == user_id), bind_arguments={"bind": db.sync_session.bind})
+        if user:
+            await self.backend.set(user_id, {key: getattr(user, key) for key in self._columns})
+        return user
+
+    async def invalidate(self, user_id: int):
+        await self.backend.delete(user_id)
+
+
+def get_backend(name: str):
+    if name == "memory":
+        return MemoryCacheBackend(settings.USER_CACHE_SIZE, settings.USER_CACHE_TTL)
+    if name == "redis":
+        return RedisCacheBackend(settings.USER_CACHE_REDIS_URL, settings.USER_CACHE_TTL)
+    if name == "none":
+        return NullCacheBackend()
+    raise ValueError(f"Unknown USER_CACHE_BACKEND '{name}'")
+
+
+user_cache = UserCache(get_backend(settings.USER_CACHE_BACKEND))
+
+
+@registry.collector
+def user_cache_metrics():
+    lookups = Counter("user_cache_lookups_total", "Lookups of the user cache.", ["result"])
+    lookups.labels("hit").inc(user_cache.hits)
+    lookups.labels("miss").inc(user_cache.misses)
+    return [lookups]
@@ -0,0 +1,318 @@
+"""Bulk import of user accounts from CSV or NDJSON.
+
+Input is read line by line as it arrives, so a file is never held in memory.
+A CSV has a header row and one user per line. An NDJSON file has one JSON
+object per line. Both use the fields of a signup: email, password, first_name
+and last_name. Rows are validated like a signup and grouped into batches of
+USER_IMPORT_BATCH_SIZE. Each batch goes through these steps:
+
+- one `IN` query finds the emails already taken;
+- its passwords are hashed in USER_IMPORT_WORKERS processes;
+- its users are inserted with one executemany in one transaction;
+- with `send_activation`, its activation email jobs go into that same
+  transaction.
+
+An email signed up between the check and the insert fails the insert on the
+unique index. The batch is then checked again and the rest of it inserted.
+
+Input that stops being readable partway, e.g. bytes that are not UTF-8, ends
+the import. The rows before it are still imported and the report carries the
+error, batches already committed stay committed.
+"""
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy import exc, insert, select
+from pydantic import ValidationError
+
+from app.choices import ImportFormatChoices, JobChoices, OTPChoices
+from app.services.password import hash_passwords
+from app.serializers.user import UserCreateSer
+from app.models.user import User
+from app.models.job import Job
+from app.config import settings
+
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, AsyncIterable, AsyncIterator, Callable
+import asyncio
+import json
+import time
+import csv
+
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+
+# A user is a few hundred bytes, longer lines are not rows
+MAX_LINE_LENGTH = 64 * 1024
+REQUIRED_COLUMNS = ("email", "password", "first_name", "last_name")
+CONTENT_TYPES = {
+    "text/csv": ImportFormatChoices.CSV,
+    "application/x-ndjson": ImportFormatChoices.NDJSON,
+    "application/jsonl": ImportFormatChoices.NDJSON,
+}
+
+_pool: "ProcessPoolExecutor | None" = None
+
+
+class ImportFormatError(ValueError):
+    """The input as a whole cannot be read, as opposed to one of its rows."""
+
+
+@dataclass
+class RowError:
+    line: int
+    email: str | None
+    error: str
+
+
+@dataclass
+class ImportProgress:
+    rows: int = 0
+    created: int = 0
+    failed: int = 0
+    seconds: float = 0.0
+    # The first USER_IMPORT_MAX_ERRORS of them
+    errors: list[RowError] = field(default_factory=list)
+    # Why the input stopped being read, see ImportFormatError
+    error: str | None = None
+
+    @property
+    def users_per_second(self) -> float:
+        return self.created / self.seconds if self.seconds else 0.0
+
+    def as_dict(self, errors: bool = True) -> dict:
+        report = {
+            "rows": self.rows,
+            "created": self.created,
+            "failed": self.failed,
+            "seconds": round(self.seconds, 3),
+            "users_per_second": round(self.users_per_second, 1),
+        }
+        if self.error:
+            report["error"] = self.error
+        if errors:
+            report["errors"] = [vars(error) for error in self.errors]
+        return report
+
+
+def get_pool() -> "ProcessPoolExecutor":
+    global _pool
+    if _pool is None:
+        from concurrent.futures import ProcessPoolExecutor
+        import multiprocessing
+
+        # Not forked, the API and the CLI have threads (bcrypt, aiosqlite) a fork would copy mid-flight
+        _pool = ProcessPoolExecutor(settings.USER_IMPORT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+def format_from_content_type(content_type: str | None) -> ImportFormatChoices:
+    media_type = (content_type or "").partition(";")[0].strip().lower()
+    if media_type not in CONTENT_TYPES:
+        raise ImportFormatError(f"Send text/csv or application/x-ndjson, not {media_type or 'no content type'}.")
+    return CONTENT_TYPES[media_type]
+
+
+async def iter_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[str]:
+    """Lines of UTF-8 `chunks`, without their line endings.
+
+    Lines are split before they are decoded, a newline byte is never part of a
+    UTF-8 character, so a bad byte fails its own line and not the ones before it.
+    """
+    pending = b""
+    number = 0
+    async for chunk in chunks:
+        *lines, pending = (pending + chunk).split(b"\n")
+        for line in lines:
+            number += 1
+            yield decode_line(line, number)
+        if len(pending) > MAX_LINE_LENGTH:
+            raise ImportFormatError(f"Line {number + 1} is longer than {MAX_LINE_LENGTH} bytes.")
+    if pending.rstrip(b"\r"):
+        yield decode_line(pending, number + 1)
+
+
+def decode_line(line: bytes, number: int) -> str:
+    try:
+        # The first line may start with a byte order mark, spreadsheets write one
+        return line.decode("utf-8-sig" if number == 1 else "utf-8").rstrip("\r")
+    except UnicodeDecodeError:
+        raise ImportFormatError(f"Line {number} is not UTF-8.")
+
+
+async def iter_rows(lines: AsyncIterable[str], format: ImportFormatChoices) -> AsyncIterator[tuple[int, dict | None, str | None]]:
+    """(line number, fields, error) of every row, blank lines are skipped.
+
+    CSV fields are parsed one line at a time, a quoted field cannot span lines.
+    """
+    columns = None
+    number = 0
+    async for line in lines:
+        number += 1
+        if not line.strip():
+            continue
+        if format == ImportFormatChoices.NDJSON:
+            try:
+                fields = json.loads(line)
+            except ValueError as e:
+                yield number, None, f"Invalid JSON: {e}"
+                continue
+            if not isinstance(fields, dict):
+                yield number, None, "Expected a JSON object."
+            else:
+                yield number, fields, None
+            continue
+
+        try:
+            values = next(csv.reader([line]))
+        except csv.Error as e:
+            yield number, None, f"Invalid CSV: {e}"
+            continue
+        if columns is None:
+            columns = [column.strip().lower() for column in values]
+            missing = [column for column in REQUIRED_COLUMNS if column not in columns]
+            if missing:
+                raise ImportFormatError(f"The CSV header has no {', '.join(missing)} column.")
+            continue
+        if len(values) != len(columns):
+            yield number, None, f"Expected {len(columns)} fields, got {len(values)}."
+            continue
+        # An empty cell is a missing value, like a null in JSON
+        yield number, {column: value or None for column, value in zip(columns, values)}, None
+
+
+class UserImporter:
+    def __init__(
+        self,
+        session_maker: async_sessionmaker[AsyncSession],
+        send_activation: bool = True,
+        batch_size: int = settings.USER_IMPORT_BATCH_SIZE,
+        max_errors: int = settings.USER_IMPORT_MAX_ERRORS,
+        on_progress: Callable[[ImportProgress], None] | None = None,
+        on_error: Callable[[RowError], None] | None = None,
+    ):
+        self.session_maker = session_maker
+        self.send_activation = send_activation
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+        self.on_progress = on_progress
+        self.on_error = on_error
+        self.progress = ImportProgress()
+        # Emails of the rows so far, a second row with one is an error
+        self._seen: set[str] = set()
+
+    async def run(self, rows: AsyncIterable[tuple[int, dict | None, str | None]]) -> ImportProgress:
+        started = time.perf_counter()
+        batch: list[tuple[int, UserCreateSer]] = []
+        try:
+            async for line, fields, error in rows:
+                self.progress.rows += 1
+                if error is not None:
+                    self._fail(line, None, error)
+                    continue
+                try:
+                    user = UserCreateSer.model_validate(fields)
+                except ValidationError as e:
+                    email = fields.get("email")
+                    self._fail(line, email if isinstance(email, str) else None, describe(e))
+                    continue
+                if user.email in self._seen:
+                    self._fail(line, user.email, "Email repeats an earlier row.")
+                    continue
+                self._seen.add(user.email)
+
+                batch.append((line, user))
+                if len(batch) >= self.batch_size:
+                    await self._import(batch)
+                    batch = []
+                    self._report(started)
+        except ImportFormatError as e:
+            self.progress.error = str(e)
+        if batch:
+            await self._import(batch)
+        self._report(started)
+        return self.progress
+
+    def _report(self, started: float):
+        self.progress.seconds = time.perf_counter() - started
+        if self.on_progress:
+            self.on_progress(self.progress)
+
+    def _fail(self, line: int, email: str | None, error: str):
+        row_error = RowError(line, email, error)
+        self.progress.failed += 1
+        if len(self.progress.errors) < self.max_errors:
+            self.progress.errors.append(row_error)
+        if self.on_error:
+            self.on_error(row_error)
+
+    async def _taken(self, batch: list[tuple[int, UserCreateSer]]) -> list[tuple[int, UserCreateSer]]:
+        """Fails the rows whose email is already in use, returns the others."""
+        async with self.session_maker() as db:
+            taken = set(await db.scalars(select(User.email).where(User.email.in_([user.email for _, user in batch]))))
+        for line, user in batch:
+            if user.email in taken:
+                self._fail(line, user.email, "Email already in use.")
+        return [(line, user) for line, user in batch if user.email not in taken]
+
+    async def _import(self, batch: list[tuple[int, UserCreateSer]]):
+        batch = await self._taken(batch)
+        if not batch:
+            return
+        hashes = await hash_all([user.password for _, user in batch])
+        rows = {
+            user.email: {**user.model_dump(exclude={"password"}), "password": hashed}
+            for (_, user), hashed in zip(batch, hashes)
+        }
+
+        while batch:
+            try:
+                async with self.session_maker() as db:
+                    user_ids = await db.scalars(
+                        insert(User).returning(User.id),
+                        [rows[user.email] for _, user in batch],
+                    )
+                    if self.send_activation:
+                        await db.execute(
+                            insert(Job),
+                            [
+                                {
+                                    "kind": JobChoices.OTP_EMAIL,
+                                    "payload": {"user_id": user_id, "used_for": OTPChoices.ACCOUNT_ACTIVATION},
+                                }
+                                for user_id in user_ids
+                            ],
+                        )
+                    await db.commit()
+            except exc.IntegrityError:
+                # Signed up since the check, which fails those rows this time
+                remaining = await self._taken(batch)
+                if len(remaining) == len(batch):
+                    raise
+                batch = remaining
+                continue
+            self.progress.created += len(batch)
+            return
+
+
+async def hash_all(passwords: list[str]) -> list[str]:
+    """Hashes of `passwords`, split evenly across the worker processes."""
+    size = -(-len(passwords) // settings.USER_IMPORT_WORKERS)
+    loop = asyncio.get_running_loop()
+    chunks = await asyncio.gather(
+        *(
+            loop.run_in_executor(get_pool(), hash_passwords, passwords[start:start + size])
+            for start in range(0, len(passwords), size)
+        )
+    )
+    return [hashed for chunk in chunks for hashed in chunk]
+
+
+def describe(error: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in error.errors())
@@ -0,0 +1,94 @@
+"""Checks and warm-up run by the lifespan of every API process.
+
+Routes are registered when app.main is imported, and schema changes are
+applied once per deploy with `alembic upgrade head`. A worker's startup only:
+  * compares the database's Alembic revision with the head of alembic/versions, one query
+  * opens DB_POOL_WARMUP connections per engine
+  * loads the bcrypt backend and starts a hashing thread
+"""
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy import exc, text
+
+from contextlib import contextmanager
+from pathlib import Path
+import asyncio
+import logging
+import time
+import re
+
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / "alembic" / "versions"
+REVISION = re.compile(r"^revision\b[^=]*=\s*['\"](\w+)['\"]", re.MULTILINE)
+DOWN_REVISION = re.compile(r"^down_revision\b[^=]*=(.*)$", re.MULTILINE)
+
+
+class StartupTimings(dict):
+    """Milliseconds spent in each startup phase."""
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self[name] = round((time.perf_counter() - started) * 1000, 2)
+
+
+def head_revisions(directory: Path = MIGRATIONS_DIR) -> set[str]:
+    """Revisions no other migration revises.
+
+    Reads the migration files instead of going through alembic.script, whose
+    import alone takes longer than the rest of the startup.
+    """
+    revisions, revised = set(), set()
+    for path in directory.glob("*.py"):
+        source = path.read_text()
+        if match := REVISION.search(source):
+            revisions.add(match.group(1))
+        if match := DOWN_REVISION.search(source):
+            revised.update(re.findall(r"['\"](\w+)['\"]", match.group(1)))
+    return revisions - revised
+
+
+async def check_schema(engine: AsyncEngine, mode: str):
+    """Raises, or only logs with mode="warn", when the database is not at the Alembic head."""
+    if mode == "off":
+        return
+    heads = head_revisions()
+    try:
+        async with engine.connect() as conn:
+            current = set((await conn.execute(text("SELECT version_num FROM alembic_version"))).scalars())
+    except exc.DBAPIError as e:
+        logger.debug("Could not read alembic_version: %s", e)
+        current = set()
+    if current == heads:
+        return
+
+    message = (
+        f"Database is at revision {', '.join(sorted(current)) or 'none'}, the code expects "
+        f"{', '.join(sorted(heads))}. Run `alembic upgrade head`. On a database created by "
+        "Base.metadata.create_all, run `alembic stamp 87da2d335a6c` first, the revision matching its tables."
+    )
+    if mode == "warn":
+        logger.warning(message)
+    else:
+        raise RuntimeError(message)
+
+
+async def warm_pool(engine: AsyncEngine, connections: int):
+    """Opens `connections` pooled connections at once, so the first requests find them idle."""
+
+    async def connect():
+        conn = await engine.connect()
+        await conn.execute(text("SELECT 1"))
+        return conn
+
+    results = await asyncio.gather(*(connect() for _ in range(connections)), return_exceptions=True)
+    for result in results:
+        if not isinstance(result, BaseException):
+            await result.close()
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
@@ -0,0 +1,152 @@
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.types import Scope
+
+from app.middlewares.compression import media_type_matches, negotiate_encoding
+from app.config import settings
+
+from mimetypes import guess_type
+from urllib.parse import quote
+import argparse
+import gzip
+import re
+import os
+
+
+# <sha256>.<ext> uploads and their <sha256>_<size>.<format> variants never change
+IMMUTABLE_NAME = re.compile(r"^[0-9a-f]{64}(_\d+)?\.\w+$")
+PRECOMPRESSED_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles that lets clients and proxies cache content-hashed files forever.
+
+    A hashed file gets its name as a strong ETag and `Cache-Control: immutable`,
+    so browsers never revalidate it. Other files are revalidated with the mtime
+    based ETag of FileResponse (`no-cache`, or `max_age` seconds). Conditional
+    requests are answered with a 304 and Range requests are handled by
+    FileResponse, which hands the file to the server with `pathsend` when the
+    server supports it.
+
+    With `accel_redirect_prefix` no bytes go through Python. The response only
+    carries `X-Accel-Redirect: <prefix>/<path>` for nginx to serve from an
+    `internal` location.
+
+    For media types in `precompressed_types`, a `<file>.br` or `<file>.gz`
+    sibling (see `python -m app.staticfiles`) is served instead of the file to
+    clients that accept it, so nothing is compressed per request. Behind nginx
+    `gzip_static` / `brotli_static` do the same.
+    """
+
+    def __init__(
+        self,
+        *args,
+        accel_redirect_prefix: str | None = None,
+        max_age: int = 0,
+        precompressed_types: list[str] = (),
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.accel_redirect_prefix = accel_redirect_prefix.rstrip("/") if accel_redirect_prefix else None
+        self.max_age = max_age
+        self.precompressed_types = list(precompressed_types)
+
+    def cache_headers(self, full_path: str) -> dict[str, str]:
+        name = os.path.basename(full_path)
+        if IMMUTABLE_NAME.match(name):
+            return {"cache-control": "public, max-age=31536000, immutable", "etag": f'"{name}"'}
+        if self.max_age:
+            return {"cache-control": f"public, max-age={self.max_age}"}
+        return {"cache-control": "no-cache"}
+
+    def file_response(
+        self,
+        full_path: str,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        request_headers = Headers(scope=scope)
+        headers = self.cache_headers(full_path)
+        media_type, file_encoding = guess_type(full_path)
+        if (
+            media_type
+            and not file_encoding
+            and not self.accel_redirect_prefix
+            and media_type_matches(media_type, self.precompressed_types)
+        ):
+            siblings = {}
+            for encoding, suffix in PRECOMPRESSED_SUFFIXES.items():
+                try:
+                    siblings[encoding] = (suffix, os.stat(full_path + suffix))
+                except OSError:
+                    pass
+            if siblings:
+                headers["vary"] = "Accept-Encoding"
+                encoding = negotiate_encoding(request_headers.get("accept-encoding", ""), list(siblings))
+                if encoding and "range" not in request_headers:
+                    suffix, stat_result = siblings[encoding]
+                    full_path += suffix
+                    headers["content-encoding"] = encoding
+                    if "etag" in headers:
+                        headers["etag"] = f'"{os.path.basename(full_path)}"'
+
+        response = FileResponse(
+            full_path,
+            status_code=status_code,
+            headers=headers,
+            media_type=media_type if "content-encoding" in headers else None,
+            stat_result=stat_result,
+        )
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        if self.accel_redirect_prefix:
+            headers["x-accel-redirect"] = f"{self.accel_redirect_prefix}/{quote(self.get_path(scope))}"
+            return Response(status_code=status_code, headers=headers, media_type=response.media_type)
+        return response
+
+
+def precompress(directory: str, content_types: list[str], minimum_size: int) -> list[str]:
+    """Writes `.br` (when brotli is installed) and `.gz` siblings of compressible files at the highest level."""
+    compressors = {".gz": lambda data: gzip.compress(data, 9, mtime=0)}
+    try:
+        import brotli
+
+        compressors[".br"] = lambda data: brotli.compress(data, quality=11)
+    except ImportError:
+        pass
+
+    written = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            media_type, file_encoding = guess_type(path)
+            if not media_type or file_encoding or not media_type_matches(media_type, content_types):
+                continue
+            stat_result = os.stat(path)
+            if stat_result.st_size < minimum_size:
+                continue
+            with open(path, "rb") as f:
+                data = f.read()
+            for suffix, compress in compressors.items():
+                sibling = path + suffix
+                if os.path.exists(sibling) and os.stat(sibling).st_mtime >= stat_result.st_mtime:
+                    continue
+                with open(sibling, "wb") as f:
+                    f.write(compress(data))
+                written.append(sibling)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompresses the static files served by CachedStaticFiles.")
+    parser.add_argument("directory", nargs="?", default="app/static")
+    args = parser.parse_args()
+
+    for sibling in precompress(args.directory, settings.COMPRESSION_CONTENT_TYPES, settings.COMPRESSION_MINIMUM_SIZE):
+        print(sibling)
+
+
+if __name__ == "__main__":
+    main()
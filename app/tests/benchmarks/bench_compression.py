@@ -0,0 +1,105 @@
+"""Server CPU time per request with response compression under load.
+
+    python -m app.tests.benchmarks.bench_compression --concurrency 20 --requests 3000
+
+Boots its own uvicorn worker and reads its user+system CPU time from /proc
+around each run, so the load generator's own CPU is not counted. Fetches
+/ping (too small to compress) and a ~130KB JSON file under /app/static, once
+compressed per request and once from precompressed siblings. Linux only.
+"""
+from app.tests.benchmarks.load import run_load
+
+import subprocess
+import argparse
+import tempfile
+import asyncio
+import shutil
+import json
+import time
+import sys
+import os
+
+import httpx
+
+
+BROWSER_ACCEPT_ENCODING = "gzip, deflate, br, zstd"
+
+
+def cpu_seconds(pid: int) -> float:
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--accept-encoding", default=BROWSER_ACCEPT_ENCODING)
+    parser.add_argument("--port", type=int, default=8197)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    env = {
+        **os.environ,
+        "DATABASE_URL": f"sqlite:///{tmp}/bench.db",
+        "SECRET_KEY": os.environ.get("SECRET_KEY") or "bench-secret",
+        "APP_TITLE": os.environ.get("APP_TITLE") or "bench",
+        "EMAIL_TRANSPORT": "memory",
+        "OTP_REAPER_INTERVAL": "0",
+    }
+    directory = os.path.join("app", "static", "bench_compression")
+    os.makedirs(directory, exist_ok=True)
+    payload = json.dumps([{"id": i, "first_name": f"User {i}", "is_active": i % 3 == 0} for i in range(3000)])
+    for name in ("dynamic.json", "precompressed.json"):
+        with open(os.path.join(directory, name), "w") as f:
+            f.write(payload)
+
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(args.port), "--log-level", "warning"],
+        env=env,
+    )
+    url = f"http://127.0.0.1:{args.port}"
+    headers = {"Accept-Encoding": args.accept_encoding}
+    reports = {}
+    try:
+        for _ in range(100):
+            try:
+                httpx.get(f"{url}/ping")
+                break
+            except httpx.HTTPError:
+                time.sleep(0.1)
+        try:
+            from app.staticfiles import precompress
+
+            precompress(directory, ["application/json"], 0)
+            os.unlink(os.path.join(directory, "dynamic.json.gz"))
+            os.unlink(os.path.join(directory, "dynamic.json.br"))
+        except (ImportError, FileNotFoundError):
+            pass  # builds without precompressed static files
+
+        for label, path in [
+            ("ping", "/ping"),
+            ("static_json", "/app/static/bench_compression/dynamic.json"),
+            ("static_json_precompressed", "/app/static/bench_compression/precompressed.json"),
+        ]:
+            with httpx.stream("GET", f"{url}{path}", headers=headers) as probe:
+                content_encoding = probe.headers.get("content-encoding")
+                bytes_on_wire = sum(len(chunk) for chunk in probe.iter_raw())
+            before = cpu_seconds(server.pid)
+            report = asyncio.run(run_load(url, path, args.concurrency, args.requests, headers=headers))
+            report["cpu_us_per_request"] = round((cpu_seconds(server.pid) - before) / report["requests"] * 1e6)
+            report["content_encoding"] = content_encoding
+            report["bytes_on_wire"] = bytes_on_wire
+            reports[label] = report
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(tmp)
+        shutil.rmtree(directory)
+
+    print(json.dumps(reports, indent=2))
+
+
+if __name__ == "__main__":
+    main()
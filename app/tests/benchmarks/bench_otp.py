@@ -0,0 +1,117 @@
+"""OTP issuance and verification latency against a pre-filled `otp` table.
+
+    python -m app.tests.benchmarks.bench_otp --rows 100000 10000000 --samples 2000
+
+Runs against a throwaway SQLite file, never against DATABASE_URL. `--legacy`
+also times the old generate-and-probe loop. Each of its probes is an unindexed
+scan of `otp.code`, and it never finishes once all 90k codes are taken.
+"""
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy import create_engine, select
+
+from app.tests.benchmarks.load import percentile
+from app.choices import OTPChoices
+from app.models.base import Base, OTP
+from app.models.user import User  # noqa: F401, mapper OTP.user resolves to
+from app.utils import create_otp
+
+from datetime import datetime
+from random import randint
+from types import SimpleNamespace
+import argparse
+import asyncio
+import tempfile
+import time
+import json
+import os
+
+
+PURPOSES = [choice.value for choice in OTPChoices]
+
+
+def seed(url: str, rows: int):
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        batch = []
+        for i in range(rows):
+            user_id, purpose = divmod(i, len(PURPOSES))
+            batch.append(
+                {"code": str(randint(10000, 99999)), "user_id": user_id + 1, "used_for": PURPOSES[purpose], "s_time": now}
+            )
+            if len(batch) == 50000:
+                conn.execute(OTP.__table__.insert(), batch)
+                batch = []
+        if batch:
+            conn.execute(OTP.__table__.insert(), batch)
+    engine.dispose()
+
+
+async def legacy_create_otp(db: AsyncSession, user_id: int, used_for: str):
+    while True:
+        code = str(randint(10000, 99999))
+        if not await db.scalar(select(OTP.id).where(OTP.code == code).limit(1)):
+            break
+    obj = await db.scalar(select(OTP).where(OTP.user_id == user_id, OTP.used_for == used_for).limit(1))
+    if obj:
+        await db.delete(obj)
+        await db.flush()
+    db.add(OTP(code=code, used_for=used_for, user_id=user_id))
+    await db.commit()
+
+
+async def verify(db: AsyncSession, user_id: int, used_for: str):
+    await OTP.verify_otp(db, SimpleNamespace(id=user_id), "00000", used_for)
+
+
+async def time_calls(url: str, fn, users: int, samples: int) -> dict:
+    engine = create_async_engine(url)
+    latencies = []
+    async with AsyncSession(engine, expire_on_commit=False) as db:
+        for _ in range(samples):
+            user_id = randint(1, users)
+            start = time.perf_counter()
+            await fn(db, user_id, PURPOSES[randint(0, len(PURPOSES) - 1)])
+            latencies.append(time.perf_counter() - start)
+    await engine.dispose()
+    return {
+        "samples": samples,
+        "p50_us": round(percentile(latencies, 50) * 1e6, 1),
+        "p99_us": round(percentile(latencies, 99) * 1e6, 1),
+        "mean_us": round(sum(latencies) / samples * 1e6, 1),
+    }
+
+
+def run(rows: int, samples: int, legacy: bool) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        seed(f"sqlite:///{path}", rows)
+        url = f"sqlite+aiosqlite:///{path}"
+        users = max(1, rows // len(PURPOSES))
+        report = {
+            "rows": rows,
+            "verify_otp": asyncio.run(time_calls(url, verify, users, samples)),
+            "create_otp": asyncio.run(time_calls(url, create_otp, users, samples)),
+        }
+        if legacy:
+            if rows >= 500_000:
+                report["legacy_create_otp"] = "skipped, all 90k codes are taken so it never terminates"
+            else:
+                report["legacy_create_otp"] = asyncio.run(time_calls(url, legacy_create_otp, users, samples))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--samples", type=int, default=2000)
+    parser.add_argument("--legacy", action="store_true")
+    args = parser.parse_args()
+
+    reports = [run(rows, args.samples, args.legacy) for rows in args.rows]
+    print(json.dumps(reports, indent=2))
+
+
+if __name__ == "__main__":
+    main()
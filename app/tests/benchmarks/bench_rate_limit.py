@@ -0,0 +1,115 @@
+"""Server work for a credential stuffing burst, with and without the login limits.
+
+    python -m app.tests.benchmarks.bench_rate_limit --accounts 20 --attempts 10
+
+Replays --attempts wrong passwords for each of --accounts users, from one IP,
+in-process against a throwaway SQLite file, never against DATABASE_URL. Each
+configuration reports the wall time, how many bcrypt verifications ran and the
+status codes returned. Also times a single limiter hit with --keys counters
+already stored.
+"""
+import argparse
+import asyncio
+import tempfile
+import time
+import json
+import os
+
+
+async def burst(app, accounts: int, attempts: int) -> dict:
+    import httpx
+
+    from app.services.password import password_hasher
+
+    verified = 0
+    verify_and_update = password_hasher.verify_and_update
+
+    async def counting(*args):
+        nonlocal verified
+        verified += 1
+        return await verify_and_update(*args)
+
+    password_hasher.verify_and_update = counting
+    statuses: dict[int, int] = {}
+    started = time.perf_counter()
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+            for attempt in range(attempts):
+                for account in range(accounts):
+                    resp = await client.post(
+                        "/api/v1/users/login/",
+                        json={"email": f"stuffing{account:05d}@example.com", "password": f"guess{attempt:04d}"},
+                    )
+                    statuses[resp.status_code] = statuses.get(resp.status_code, 0) + 1
+    finally:
+        password_hasher.verify_and_update = verify_and_update
+    return {
+        "requests": accounts * attempts,
+        "seconds": round(time.perf_counter() - started, 3),
+        "bcrypt_verifications": verified,
+        "statuses": statuses,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--accounts", type=int, default=20)
+    parser.add_argument("--attempts", type=int, default=10)
+    parser.add_argument("--keys", type=int, default=100000)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite:///{directory}/bench.db"
+    os.environ["USER_CACHE_BACKEND"] = "none"
+
+    from sqlalchemy import create_engine
+
+    from app.services.rate_limit import MemoryRateLimitBackend, NullRateLimitBackend, rate_limiter
+    from app.services.password import pwd_context
+    from app.models.base import Base
+    from app.models.user import User
+    from app.config import settings
+    from app.main import app
+
+    engine = create_engine(os.environ["DATABASE_URL"])
+    Base.metadata.create_all(engine)
+    password = pwd_context.hash("correct-password")
+    with engine.begin() as conn:
+        conn.execute(User.__table__.insert(), [
+            {"email": f"stuffing{i:05d}@example.com", "first_name": "Bench", "password": password, "is_active": True}
+            for i in range(args.accounts)
+        ])
+    engine.dispose()
+
+    def reset_users():
+        with create_engine(os.environ["DATABASE_URL"]).begin() as conn:
+            conn.execute(User.__table__.update().values(failed_logins=0, locked_until=None))
+
+    report = {}
+    threshold = settings.LOGIN_LOCKOUT_THRESHOLD
+    for name, backend, lockout in [
+        ("unlimited", NullRateLimitBackend(), 0),
+        ("lockout_only", NullRateLimitBackend(), threshold),
+        ("rate_limits_and_lockout", MemoryRateLimitBackend(settings.RATE_LIMIT_MAX_KEYS), threshold),
+    ]:
+        reset_users()
+        rate_limiter.backend = backend
+        settings.LOGIN_LOCKOUT_THRESHOLD = lockout
+        report[name] = asyncio.run(burst(app, args.accounts, args.attempts))
+
+    async def hits(backend, keys: list[str]) -> float:
+        started = time.perf_counter()
+        for key in keys:
+            await backend.hit(key, 10 ** 9, 60)
+        return time.perf_counter() - started
+
+    backend = MemoryRateLimitBackend(args.keys)
+    asyncio.run(hits(backend, [f"login_ip:10.{i >> 16}.{(i >> 8) & 255}.{i & 255}" for i in range(args.keys)]))
+    samples = [f"login_ip:10.{i >> 16}.{(i >> 8) & 255}.{i & 255}" for i in range(0, args.keys, 7)]
+    best = min(asyncio.run(hits(backend, samples)) for _ in range(5))
+    report["limiter_hit_us"] = round(best / len(samples) * 1e6, 2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Per-request serialization time of the user payloads.
+
+    python -m app.tests.benchmarks.bench_serialization --number 20000
+
+Times, in-process and without HTTP, the ways a handler's result can be
+turned into response bytes:
+  * the `UserResponseSer` payload of /me, from an ORM `User`
+  * the dict payloads of login and the `{"detail": ...}` replies
+"""
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+
+from pydantic import TypeAdapter
+
+from app.serializers.user import UserResponseSer
+from app.responses import ORJSONResponse, model_response
+from app.models.user import User
+
+from datetime import date, datetime
+import argparse
+import timeit
+import json
+
+
+def make_user() -> User:
+    return User(
+        id=42,
+        email="serialization.bench@example.com",
+        first_name="Serialization",
+        last_name="Bench",
+        date_of_birth=date(1990, 1, 1),
+        profile_picture="app/static/profile_pictures/" + "ab" * 32 + ".png",
+        profile_picture_variants="256.webp,256.avif,64.webp,64.avif",
+        last_login=datetime(2024, 1, 1, 12, 30),
+        is_active=True,
+        is_superuser=False,
+        date_joined=datetime(2023, 6, 1, 8, 0),
+        password="x" * 60,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=20000)
+    args = parser.parse_args()
+
+    user = make_user()
+    adapter = TypeAdapter(UserResponseSer)
+    login = {
+        "access_token": "a" * 180,
+        "refresh_token": "r" * 180,
+        "user": {"id": 42, "first_name": "Serialization", "last_name": "Bench", "is_superuser": False},
+    }
+    detail = {"detail": "User account successfully activated."}
+
+    cases = {
+        # FastAPI before the pydantic dump_json fast path: validate, to dict, json.dumps
+        "user_response_model_stdlib_json": lambda: JSONResponse(
+            jsonable_encoder(adapter.validate_python(user, from_attributes=True))
+        ).body,
+        # `response_model` route with a custom default response class, as ORJSONResponse now is
+        "user_response_model_orjson": lambda: ORJSONResponse(
+            jsonable_encoder(adapter.validate_python(user, from_attributes=True))
+        ).body,
+        # FastAPI's fast path for `response_model` routes, only taken with the stock response class
+        "user_response_model_dump_json": lambda: Response(
+            adapter.dump_json(adapter.validate_python(user, from_attributes=True)), media_type="application/json"
+        ).body,
+        "user_model_response": lambda: model_response(UserResponseSer, user).body,
+        "login_stdlib_json": lambda: JSONResponse(jsonable_encoder(login)).body,
+        "login_orjson": lambda: ORJSONResponse(jsonable_encoder(login)).body,
+        "detail_stdlib_json": lambda: JSONResponse(jsonable_encoder(detail)).body,
+        "detail_orjson": lambda: ORJSONResponse(jsonable_encoder(detail)).body,
+    }
+    report = {}
+    for name, case in cases.items():
+        best = min(timeit.repeat(case, number=args.number, repeat=5))
+        report[name] = {"us_per_call": round(best / args.number * 1e6, 2)}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Cold start time of an API process, by phase.
+
+    python -m app.tests.benchmarks.bench_startup --runs 10
+    python -m app.tests.benchmarks.bench_startup --check-startup
+
+--check-startup imports app.main and runs its lifespan once in this process,
+prints the breakdown in milliseconds as JSON and exits non-zero when startup
+fails, e.g. on a database that is not at the Alembic head. It doubles as a
+pre-deploy check. Without it, --runs fresh interpreters do that and the
+median and max of every phase are reported, with the wall time of the whole
+process from spawn to exit.
+"""
+import subprocess
+import statistics
+import argparse
+import asyncio
+import time
+import json
+import sys
+
+
+def check_startup() -> int:
+    started = time.perf_counter()
+    from app.main import app
+
+    report = {"import": round((time.perf_counter() - started) * 1000, 2)}
+
+    async def run():
+        started = time.perf_counter()
+        async with app.router.lifespan_context(app):
+            report["lifespan"] = round((time.perf_counter() - started) * 1000, 2)
+            report.update(getattr(app.state, "startup_timings", {}))
+
+    try:
+        asyncio.run(run())
+    except Exception as e:
+        print(f"Startup failed: {e}", file=sys.stderr)
+        return 1
+    print(json.dumps(report))
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--check-startup", action="store_true")
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.check_startup:
+        sys.exit(check_startup())
+
+    samples: dict[str, list[float]] = {}
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-m", __spec__.name, "--check-startup"], capture_output=True, text=True
+        )
+        wall = (time.perf_counter() - started) * 1000
+        if result.returncode:
+            sys.exit(result.stderr.strip().splitlines()[-1])
+        for name, value in {**json.loads(result.stdout.strip().splitlines()[-1]), "process": wall}.items():
+            samples.setdefault(name, []).append(value)
+
+    report = {
+        name: {"median_ms": round(statistics.median(values), 2), "max_ms": round(max(values), 2)}
+        for name, values in samples.items()
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Avatar GETs/sec through the `/app/static` mount.
+
+    python -m app.tests.benchmarks.bench_static --concurrency 50 --requests 5000
+
+Boots its own uvicorn worker, writes a content-hashed avatar into
+app/static/profile_pictures and fetches it: in full, revalidated with
+If-None-Match (304), as a Range request (206), and with
+STATIC_ACCEL_REDIRECT_PREFIX set (headers only, the bytes are left to nginx).
+"""
+from app.tests.benchmarks.load import run_load
+
+import subprocess
+import argparse
+import tempfile
+import asyncio
+import hashlib
+import shutil
+import time
+import json
+import sys
+import os
+
+import httpx
+
+
+def serve(env: dict, port: int) -> subprocess.Popen:
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        env=env,
+    )
+    for _ in range(100):
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/ping")
+            break
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--size-kb", type=int, default=200)
+    parser.add_argument("--port", type=int, default=8198)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    env = {
+        **os.environ,
+        "DATABASE_URL": f"sqlite:///{tmp}/bench.db",
+        "SECRET_KEY": os.environ.get("SECRET_KEY") or "bench-secret",
+        "APP_TITLE": os.environ.get("APP_TITLE") or "bench",
+        "EMAIL_TRANSPORT": "memory",
+        "OTP_REAPER_INTERVAL": "0",
+    }
+    payload = b"RIFF\x00\x00\x00\x00WEBP" + os.urandom(args.size_kb * 1024 - 12)
+    name = f"{hashlib.sha256(payload).hexdigest()}.webp"
+    avatar = os.path.join("app", "static", "profile_pictures", name)
+    os.makedirs(os.path.dirname(avatar), exist_ok=True)
+    with open(avatar, "wb") as f:
+        f.write(payload)
+
+    path = f"/app/static/profile_pictures/{name}"
+    scenarios = [
+        ("full", env, {}),
+        ("if_none_match", env, {"If-None-Match": f'"{name}"'}),
+        ("range", env, {"Range": "bytes=0-16383"}),
+        ("accel_redirect", {**env, "STATIC_ACCEL_REDIRECT_PREFIX": "/_static"}, {}),
+    ]
+    reports = {}
+    try:
+        for label, scenario_env, headers in scenarios:
+            server = serve(scenario_env, args.port)
+            try:
+                reports[label] = asyncio.run(
+                    run_load(f"http://127.0.0.1:{args.port}", path, args.concurrency, args.requests, headers=headers)
+                )
+            finally:
+                server.terminate()
+                server.wait()
+    finally:
+        os.unlink(avatar)
+        shutil.rmtree(tmp)
+
+    print(json.dumps({"size_kb": args.size_kb, **reports}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Peak server RSS while N clients upload profile pictures at once.
+
+    python -m app.tests.benchmarks.bench_uploads --clients 50 --size-mb 20
+
+Boots its own uvicorn worker on a throwaway SQLite database and compares the
+worker's peak RSS (VmHWM) after the uploads with its RSS when idle. Linux only.
+"""
+from sqlalchemy.orm import Session
+from sqlalchemy import create_engine
+
+from app.tests.benchmarks.load import percentile
+
+import subprocess
+import argparse
+import tempfile
+import asyncio
+import shutil
+import time
+import json
+import sys
+import os
+
+import httpx
+
+
+def read_status_kb(pid: int, field: str) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith(field):
+                return int(line.split()[1])
+    return 0
+
+
+def seed_user(database_url: str) -> int:
+    from app.models.base import Base
+    from app.models.user import User
+    import app.models.job  # noqa: F401
+
+    engine = create_engine(database_url)
+    Base.metadata.create_all(engine)
+    with Session(engine) as db:
+        user = User(email="upload.bench@example.com", first_name="Upload", last_name="Bench", password="x", is_active=True)
+        db.add(user)
+        db.commit()
+        return user.id
+
+
+async def upload_all(url: str, token: str, clients: int, payload: bytes) -> list[tuple[int, float]]:
+    async with httpx.AsyncClient(base_url=url, timeout=300, headers={"Authorization": f"Bearer {token}"}) as client:
+
+        async def upload():
+            start = time.perf_counter()
+            resp = await client.patch(
+                "/api/v1/users/me/", files={"profile_picture": ("avatar.png", payload, "image/png")}
+            )
+            elapsed = time.perf_counter() - start
+            if resp.status_code == 200 and resp.json()["profile_picture"]:
+                os.unlink(resp.json()["profile_picture"])
+            return resp.status_code, elapsed
+
+        return await asyncio.gather(*(upload() for _ in range(clients)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--size-mb", type=float, default=20)
+    parser.add_argument("--port", type=int, default=8199)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    size = int(args.size_mb * 1024 * 1024)
+    env = {
+        **os.environ,
+        "DATABASE_URL": f"sqlite:///{tmp}/bench.db",
+        "SECRET_KEY": os.environ.get("SECRET_KEY") or "bench-secret",
+        "APP_TITLE": os.environ.get("APP_TITLE") or "bench",
+        "EMAIL_TRANSPORT": "memory",
+        "PROFILE_PICTURE_MAX_SIZE": str(size + 1024),
+        "OTP_REAPER_INTERVAL": "0",
+    }
+    os.environ.update(env)
+    user_id = seed_user(env["DATABASE_URL"])
+    from app.dependencies import access_security
+
+    token = access_security.create_access_token(subject={"id": user_id})
+    payload = b"\x89PNG\r\n\x1a\n" + os.urandom(size - 8)
+
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(args.port), "--log-level", "warning"],
+        env=env,
+    )
+    try:
+        url = f"http://127.0.0.1:{args.port}"
+        for _ in range(100):
+            try:
+                httpx.get(f"{url}/ping")
+                break
+            except httpx.HTTPError:
+                time.sleep(0.1)
+        idle_kb = read_status_kb(server.pid, "VmRSS")
+        started = time.perf_counter()
+        results = asyncio.run(upload_all(url, token, args.clients, payload))
+        elapsed = time.perf_counter() - started
+        peak_kb = read_status_kb(server.pid, "VmHWM")
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(tmp)
+
+    latencies = [latency for _, latency in results]
+    statuses = {}
+    for code, _ in results:
+        statuses[code] = statuses.get(code, 0) + 1
+    print(json.dumps({
+        "clients": args.clients,
+        "size_mb": args.size_mb,
+        "seconds": round(elapsed, 2),
+        "p50_s": round(percentile(latencies, 50), 2),
+        "p99_s": round(percentile(latencies, 99), 2),
+        "idle_rss_mb": round(idle_kb / 1024, 1),
+        "peak_rss_mb": round(peak_kb / 1024, 1),
+        "statuses": statuses,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
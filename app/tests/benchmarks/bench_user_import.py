@@ -0,0 +1,91 @@
+"""Users per second of the bulk import, against one signup per user.
+
+    python -m app.tests.benchmarks.bench_user_import --users 2000 --bcrypt-rounds 4
+
+Imports --users NDJSON rows into a fresh SQLite database with UserImporter.
+Then it creates as many users the way create_new_user does, with an
+existence query, a hash, an insert, a job and a commit per user. At
+production cost bcrypt dominates both, so the default rounds are low to show
+everything else. At --bcrypt-rounds 12 the import scales with
+USER_IMPORT_WORKERS, up to the number of cores.
+"""
+import argparse
+import asyncio
+import tempfile
+import time
+import json
+import os
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--bcrypt-rounds", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-user-import-")
+    os.environ.update({"DATABASE_URL": f"sqlite:///{workdir}/bench.db", "BCRYPT_ROUNDS": str(args.bcrypt_rounds)})
+    os.environ.setdefault("SECRET_KEY", "bench-user-import")
+
+    from alembic.config import Config
+    from alembic import command
+    from sqlalchemy import select
+
+    from app.services.user_import import UserImporter, iter_lines, iter_rows, shutdown
+    from app.dependencies import async_engine, async_session_maker
+    from app.services.password import password_hasher
+    from app.choices import ImportFormatChoices, JobChoices, OTPChoices
+    from app.services.jobs import enqueue_job
+    from app.models.user import User
+    from app.config import settings
+
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+    config = Config(os.path.join(root, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(root, "alembic"))
+    command.upgrade(config, "head")
+
+    def row(prefix: str, i: int) -> dict:
+        return {"email": f"{prefix}-{i:07d}@example.com", "password": "password1", "first_name": "Bench", "last_name": "Import"}
+
+    async def body():
+        for start in range(0, args.users, 1000):
+            yield "".join(json.dumps(row("bulk", i)) + "\n" for i in range(start, min(start + 1000, args.users))).encode()
+
+    async def one_by_one():
+        for i in range(args.users):
+            fields = row("single", i)
+            async with async_session_maker() as db:
+                if await db.scalar(select(User).where(User.email == fields["email"])):
+                    continue
+                user = User(**{k: v for k, v in fields.items() if k != "password"})
+                await user.aset_password(fields["password"])
+                db.add(user)
+                await db.flush()
+                enqueue_job(db, JobChoices.OTP_EMAIL, user_id=user.id, used_for=OTPChoices.ACCOUNT_ACTIVATION)
+                await db.commit()
+
+    async def run():
+        importer = UserImporter(async_session_maker, batch_size=args.batch_size)
+        progress = await importer.run(iter_rows(iter_lines(body()), ImportFormatChoices.NDJSON))
+        started = time.perf_counter()
+        await one_by_one()
+        single = time.perf_counter() - started
+        password_hasher.shutdown()
+        shutdown()
+        await async_engine.dispose()
+        return progress, single
+
+    progress, single = asyncio.run(run())
+    print(json.dumps({
+        "users": args.users,
+        "bcrypt_rounds": args.bcrypt_rounds,
+        "import_workers": settings.USER_IMPORT_WORKERS,
+        "import_users_per_second": round(progress.users_per_second, 1),
+        "one_by_one_users_per_second": round(args.users / single, 1),
+        "import_failed": progress.failed,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
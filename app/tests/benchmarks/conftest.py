@@ -0,0 +1,11 @@
+import pytest
+
+
+def pytest_collection_modifyitems(config, items):
+    # Benchmarks take minutes, a plain `pytest app/tests` only runs the tests
+    if config.getoption("benchmark_only", False):
+        return
+    skip = pytest.mark.skip(reason="benchmark, run python -m app.tests.benchmarks.regressions")
+    for item in items:
+        if "benchmark" in getattr(item, "fixturenames", ()):
+            item.add_marker(skip)
@@ -0,0 +1,89 @@
+"""Closed-loop HTTP load generator.
+
+    python -m app.tests.benchmarks.load --url http://127.0.0.1:8000 \
+        --path /api/v1/users/me/ --token <access token> --concurrency 100 --requests 10000
+
+Run it against a single worker (`uvicorn app.main:app --workers 1`) and compare the
+requests/sec reported for different builds.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    index = min(len(samples) - 1, round(pct / 100 * (len(samples) - 1)))
+    return samples[index]
+
+
+async def run_load(
+    url: str,
+    path: str,
+    concurrency: int,
+    requests: int,
+    method: str = "GET",
+    headers: dict | None = None,
+    body: dict | None = None,
+) -> dict:
+    latencies: list[float] = []
+    statuses: dict[int | str, int] = {}
+    remaining = requests
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, headers=headers, limits=limits, timeout=60) as client:
+
+        async def worker():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                start = time.perf_counter()
+                try:
+                    resp = await client.request(method, path, json=body)
+                    status = resp.status_code
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                latencies.append(time.perf_counter() - start)
+                statuses[status] = statuses.get(status, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "path": path,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "seconds": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "statuses": statuses,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--path", default="/api/v1/users/me/")
+    parser.add_argument("--method", default="GET")
+    parser.add_argument("--token", help="Bearer access token sent with every request")
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=10000)
+    args = parser.parse_args()
+
+    headers = {"Authorization": f"Bearer {args.token}"} if args.token else None
+    result = asyncio.run(
+        run_load(args.url, args.path, args.concurrency, args.requests, args.method, headers)
+    )
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
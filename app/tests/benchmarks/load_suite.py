@@ -0,0 +1,442 @@
+"""Reproducible load test of the user API: seeded database, real uvicorn, local email sink.
+
+    python -m app.tests.benchmarks.load_suite --users 1000 --concurrency 50 --duration 15 --output after.json
+    python -m app.tests.benchmarks.load_suite --compare before.json after.json
+
+Seeds --users active users into a fresh SQLite database in a temporary
+directory, or into --database-url (e.g. Postgres), migrated to the Alembic
+head first. Seeded and signed up emails carry a per-run prefix, so a
+database can be reused. Then starts `uvicorn app.main:app` with one worker
+and the job worker. Both use the file email transport as a local sink in place
+of Mailjet. Rate limits are off, since every request comes from 127.0.0.1.
+BCRYPT_ROUNDS and the other settings are taken from the environment.
+
+Each scenario runs --concurrency closed-loop clients for --duration seconds:
+
+    login     POST login/ as a random seeded user, bound by bcrypt
+    me        GET me/ with the access token of a random seeded user
+    refresh   POST refresh/token/ with their refresh token, keeping the new pair
+    signup    create/, the activation OTP from the email sink, activate/, login/, me/, refresh/
+    mixed     the above, picked at random with the --mix weights
+
+The JSON report has requests/sec with p50/p95/p99 latency per endpoint, and
+the resident memory of the API and worker processes, per scenario. It also
+records the git revision and the settings of the run.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+
+from app.tests.benchmarks.load import percentile
+
+
+ROOT_DIR = Path(__file__).resolve().parents[3]
+SCENARIOS = ("login", "me", "refresh", "signup", "mixed")
+PASSWORD = "load-password-1"
+OTP_PATTERN = re.compile(r"\b(\d{5})\b")
+
+
+def rss_mb(pid: int) -> float | None:
+    """Resident memory of a process, from /proc (Linux only)."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        return None
+    return None
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Outbox:
+    """OTPs of the emails the worker wrote to the file transport, by recipient."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.offset = 0
+        self.otps: dict[str, str] = {}
+
+    def _read(self):
+        if not self.path.exists():
+            return
+        with open(self.path) as f:
+            f.seek(self.offset)
+            for line in f:
+                if not line.endswith("\n"):
+                    break  # being written, read it next time
+                self.offset += len(line.encode())
+                message = json.loads(line)
+                match = OTP_PATTERN.search(message["text"])
+                if match:
+                    self.otps[message["to"]] = match.group(1)
+
+    async def otp(self, email: str, timeout: float = 30) -> str | None:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            self._read()
+            if email in self.otps:
+                return self.otps.pop(email)
+            await asyncio.sleep(0.02)
+        return None
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = {}
+        self.statuses: dict[str, Counter] = {}
+
+    def record(self, step: str, seconds: float, status: int | str):
+        self.latencies.setdefault(step, []).append(seconds)
+        self.statuses.setdefault(step, Counter())[str(status)] += 1
+
+    def summary(self, elapsed: float) -> dict:
+        steps = {}
+        for step, latencies in self.latencies.items():
+            steps[step] = {
+                "count": len(latencies),
+                "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+                "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+                "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+                "statuses": dict(self.statuses[step]),
+            }
+        # OTP delivery is the worker's latency, not a request
+        requests = [latency for step, values in self.latencies.items() if step != "otp_delivery" for latency in values]
+        errors = sum(
+            n for step, statuses in self.statuses.items() for status, n in statuses.items() if not status.startswith("2")
+        )
+        return {
+            "seconds": round(elapsed, 3),
+            "requests": len(requests),
+            "errors": errors,
+            "rps": round(len(requests) / elapsed, 1) if elapsed else 0.0,
+            "p50_ms": round(percentile(requests, 50) * 1000, 2),
+            "p95_ms": round(percentile(requests, 95) * 1000, 2),
+            "p99_ms": round(percentile(requests, 99) * 1000, 2),
+            "steps": steps,
+        }
+
+
+class Load:
+    """Seeded users with their tokens, and what the scenarios share while they run."""
+
+    def __init__(self, run_id: str, users: list[int], outbox: Outbox, mix: dict[str, float]):
+        from app.dependencies import access_security, refresh_security
+
+        self.run_id = run_id
+        self.users = users
+        self.outbox = outbox
+        self.mix = mix
+        self.signups = 0
+        self.tokens = {}
+        for i, user_id in enumerate(users):
+            subject = {"id": user_id, "first_name": "Loadtest", "last_name": "User"}
+            self.tokens[i] = (
+                access_security.create_access_token(subject=subject),
+                refresh_security.create_refresh_token(subject=subject),
+            )
+
+    def email(self, i: int) -> str:
+        return f"load-{self.run_id}-{i:07d}@example.com"
+
+    def new_email(self) -> str:
+        self.signups += 1
+        return f"load-{self.run_id}-signup-{self.signups:07d}@example.com"
+
+
+async def call(client: httpx.AsyncClient, recorder: Recorder, step: str, method: str, path: str, **kwargs):
+    started = time.perf_counter()
+    try:
+        response = await client.request(method, path, **kwargs)
+        status = response.status_code
+    except httpx.HTTPError as e:
+        response, status = None, type(e).__name__
+    recorder.record(step, time.perf_counter() - started, status)
+    return response if response is not None and response.is_success else None
+
+
+async def login(client, recorder, load: Load, rng: random.Random):
+    email = load.email(rng.randrange(len(load.users)))
+    await call(client, recorder, "login", "POST", "/api/v1/users/login/", json={"email": email, "password": PASSWORD})
+
+
+async def me(client, recorder, load: Load, rng: random.Random):
+    access, _ = load.tokens[rng.randrange(len(load.users))]
+    await call(client, recorder, "me", "GET", "/api/v1/users/me/", headers={"Authorization": f"Bearer {access}"})
+
+
+async def refresh(client, recorder, load: Load, rng: random.Random):
+    i = rng.randrange(len(load.users))
+    _, refresh_token = load.tokens[i]
+    response = await call(
+        client, recorder, "refresh", "POST", "/api/v1/users/refresh/token/",
+        headers={"Authorization": f"Bearer {refresh_token}"},
+    )
+    # Refresh tokens are single use
+    if response is not None and load.tokens[i][1] == refresh_token:
+        tokens = response.json()
+        load.tokens[i] = (tokens["access_token"], tokens["refresh_token"])
+
+
+async def signup(client, recorder, load: Load, rng: random.Random):
+    email = load.new_email()
+    body = {"email": email, "password": PASSWORD, "first_name": "Loadtest", "last_name": "Signup"}
+    if not await call(client, recorder, "signup", "POST", "/api/v1/users/create/", json=body):
+        return
+
+    started = time.perf_counter()
+    otp = await load.outbox.otp(email)
+    recorder.record("otp_delivery", time.perf_counter() - started, 200 if otp else "timeout")
+    if otp is None:
+        return
+    if not await call(client, recorder, "activate", "POST", "/api/v1/users/activate/", json={"email": email, "otp": otp}):
+        return
+    response = await call(
+        client, recorder, "login", "POST", "/api/v1/users/login/", json={"email": email, "password": PASSWORD}
+    )
+    if response is None:
+        return
+    tokens = response.json()
+    await call(
+        client, recorder, "me", "GET", "/api/v1/users/me/", headers={"Authorization": f"Bearer {tokens['access_token']}"}
+    )
+    await call(
+        client, recorder, "refresh", "POST", "/api/v1/users/refresh/token/",
+        headers={"Authorization": f"Bearer {tokens['refresh_token']}"},
+    )
+
+
+async def mixed(client, recorder, load: Load, rng: random.Random):
+    scenario = rng.choices(list(load.mix), weights=list(load.mix.values()))[0]
+    await SCENARIO_FUNCTIONS[scenario](client, recorder, load, rng)
+
+
+SCENARIO_FUNCTIONS = {"login": login, "me": me, "refresh": refresh, "signup": signup, "mixed": mixed}
+
+
+async def run_scenario(
+    url: str, scenario: str, load: Load, concurrency: int, duration: float, seed: int, pids: dict[str, int]
+) -> dict:
+    recorder = Recorder()
+    peaks = {name: rss_mb(pid) for name, pid in pids.items()}
+    fn = SCENARIO_FUNCTIONS[scenario]
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        deadline = time.monotonic() + duration
+
+        async def user(i: int):
+            rng = random.Random(f"{seed}-{scenario}-{i}")
+            while time.monotonic() < deadline:
+                await fn(client, recorder, load, rng)
+
+        async def sample_rss():
+            while True:
+                await asyncio.sleep(0.1)
+                for name, pid in pids.items():
+                    peaks[name] = max(filter(None, (peaks[name], rss_mb(pid))), default=None)
+
+        sampler = asyncio.create_task(sample_rss())
+        started = time.perf_counter()
+        await asyncio.gather(*(user(i) for i in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        sampler.cancel()
+
+    return {
+        **recorder.summary(elapsed),
+        "rss_mb": {name: {"end": rss_mb(pid), "peak": peaks[name]} for name, pid in pids.items()},
+    }
+
+
+def seed_users(count: int, run_id: str, password_hash: str) -> list[int]:
+    from sqlalchemy import insert, select
+
+    from app.dependencies import engine
+    from app.models.user import User
+
+    emails = [f"load-{run_id}-{i:07d}@example.com" for i in range(count)]
+    with engine.begin() as db:
+        for start in range(0, count, 1000):
+            db.execute(
+                insert(User),
+                [
+                    {"email": email, "first_name": "Loadtest", "last_name": "User", "password": password_hash, "is_active": True}
+                    for email in emails[start:start + 1000]
+                ],
+            )
+        ids = dict(db.execute(select(User.email, User.id).where(User.email.like(f"load-{run_id}-%"))).all())
+    return [ids[email] for email in emails]
+
+
+def start(command: list[str], env: dict, log: Path) -> subprocess.Popen:
+    return subprocess.Popen(command, cwd=ROOT_DIR, env=env, stdout=open(log, "w"), stderr=subprocess.STDOUT)
+
+
+def stop(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+async def wait_ready(url: str, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=url) as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                break
+            try:
+                if (await client.get("/ping")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"the API did not start on {url}")
+
+
+def compare(before_path: str, after_path: str):
+    """Throughput and p95 of each scenario in `after` relative to `before`, in percent."""
+    before, after = (json.loads(Path(path).read_text()) for path in (before_path, after_path))
+    report = {}
+    for scenario, result in after["scenarios"].items():
+        previous = before["scenarios"].get(scenario)
+        if not previous:
+            continue
+        report[scenario] = {
+            "rps": [previous["rps"], result["rps"], round((result["rps"] / previous["rps"] - 1) * 100, 1)],
+            "p95_ms": [previous["p95_ms"], result["p95_ms"], round((result["p95_ms"] / previous["p95_ms"] - 1) * 100, 1)],
+        }
+    print(json.dumps({"before": before["run"]["revision"], "after": after["run"]["revision"], "scenarios": report}, indent=2))
+
+
+def parse_mix(value: str) -> dict[str, float]:
+    mix = {name: float(weight) for name, weight in (part.split("=") for part in value.split(","))}
+    unknown = set(mix) - set(SCENARIOS[:-1])
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown scenarios in --mix: {', '.join(sorted(unknown))}")
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000, help="seeded users")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=15, help="seconds per scenario")
+    parser.add_argument("--warmup", type=float, default=2, help="seconds of each scenario run before it is measured")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--mix", type=parse_mix, default="me=70,refresh=10,login=15,signup=5")
+    parser.add_argument("--database-url", help="instead of a fresh SQLite database")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", type=int, default=0, help="seeds which users each client picks")
+    parser.add_argument("--output", help="also write the report to this file")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two reports and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    scenarios = args.scenarios.split(",")
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    workdir = Path(tempfile.mkdtemp(prefix="load-suite-"))
+    os.environ.update({
+        "DATABASE_URL": args.database_url or f"sqlite:///{workdir}/load.db",
+        "EMAIL_TRANSPORT": "file",
+        "EMAIL_FILE_PATH": str(workdir / "emails.jsonl"),
+        "RATE_LIMIT_BACKEND": "none",
+        "SQL_PROFILE": "false",
+    })
+    os.environ.setdefault("SECRET_KEY", f"load-suite-{uuid.uuid4().hex}")
+    os.environ.setdefault("APP_TITLE", "load-suite")
+    os.environ.setdefault("APP_VERSION", "0")
+
+    from alembic.config import Config
+    from alembic import command
+
+    from app.services.password import pwd_context
+    from app.config import settings
+
+    config = Config(str(ROOT_DIR / "alembic.ini"))
+    config.set_main_option("script_location", str(ROOT_DIR / "alembic"))
+    command.upgrade(config, "head")
+
+    run_id = uuid.uuid4().hex[:8]
+    started = time.perf_counter()
+    users = seed_users(args.users, run_id, pwd_context.hash(PASSWORD))
+    seed_seconds = time.perf_counter() - started
+    load = Load(run_id, users, Outbox(Path(os.environ["EMAIL_FILE_PATH"])), args.mix)
+
+    url = f"http://127.0.0.1:{args.port}"
+    env = dict(os.environ)
+    api = start(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(args.port), "--log-level", "warning"],
+        env, workdir / "api.log",
+    )
+    worker = start([sys.executable, "-m", "app.worker", "--poll-interval", "0.05"], env, workdir / "worker.log")
+    pids = {"api": api.pid, "worker": worker.pid}
+    try:
+        asyncio.run(wait_ready(url, api))
+        report = {
+            "run": {
+                "revision": git_revision(),
+                "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "python": sys.version.split()[0],
+                "database": settings.DATABASE_URL.split("://")[0],
+                "bcrypt_rounds": settings.BCRYPT_ROUNDS,
+                "users": args.users,
+                "concurrency": args.concurrency,
+                "duration": args.duration,
+                "mix": args.mix,
+                "seed_seconds": round(seed_seconds, 2),
+                "rss_mb_idle": {name: rss_mb(pid) for name, pid in pids.items()},
+            },
+            "scenarios": {},
+        }
+        for scenario in scenarios:
+            if args.warmup:
+                asyncio.run(run_scenario(url, scenario, load, args.concurrency, args.warmup, args.seed, pids))
+            report["scenarios"][scenario] = asyncio.run(
+                run_scenario(url, scenario, load, args.concurrency, args.duration, args.seed, pids)
+            )
+    except RuntimeError:
+        print((workdir / "api.log").read_text()[-4000:], file=sys.stderr)
+        raise
+    finally:
+        stop(api)
+        stop(worker)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""Runs the micro-benchmarks and fails when one got slower than its stored baseline.
+
+    python -m app.tests.benchmarks.regressions
+    python -m app.tests.benchmarks.regressions --threshold 10 -k otp
+    python -m app.tests.benchmarks.regressions --save
+
+Baselines are pytest-benchmark results committed in
+app/tests/benchmarks/baselines, one directory per platform and Python
+version, and the latest one is compared against. A benchmark fails when its
+median round is more than --threshold percent slower (BENCHMARK_THRESHOLD,
+25 by default). The median moves less than the fastest round between runs
+against SQLite or a subprocess. Timings only compare on the same kind of machine, so save the
+baseline where the gate runs, and again after a change that is meant to
+move the numbers. Other arguments are passed to pytest.
+"""
+import argparse
+import subprocess
+import sys
+import os
+from pathlib import Path
+
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+BASELINES_DIR = BENCHMARKS_DIR / "baselines"
+ROOT_DIR = BENCHMARKS_DIR.parents[2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threshold", type=int, default=int(os.getenv("BENCHMARK_THRESHOLD", 25)), help="percent")
+    parser.add_argument("--save", action="store_true", help="store this run as the new baseline instead")
+    args, pytest_args = parser.parse_known_args()
+
+    command = [
+        sys.executable, "-m", "pytest", str(BENCHMARKS_DIR / "test_hot_paths.py"), "--benchmark-only",
+        f"--benchmark-storage=file://{BASELINES_DIR}", "--benchmark-sort=name",
+    ]
+    if args.save:
+        command.append("--benchmark-save=baseline")
+    else:
+        if not any(BASELINES_DIR.glob("*/*.json")):
+            sys.exit(f"No baseline in {BASELINES_DIR}, run with --save first")
+        command += ["--benchmark-compare", f"--benchmark-compare-fail=median:{args.threshold}%"]
+    sys.exit(subprocess.call(command + pytest_args, cwd=ROOT_DIR))
+
+
+if __name__ == "__main__":
+    main()
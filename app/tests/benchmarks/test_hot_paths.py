@@ -0,0 +1,160 @@
+"""Micro-benchmarks of the hot paths, compared against the baselines in baselines/.
+
+    python -m app.tests.benchmarks.regressions
+    python -m app.tests.benchmarks.regressions --save
+
+Skipped unless pytest runs with --benchmark-only, which is what the command
+above does. The OTP benchmarks run against BENCHMARK_OTP_ROWS rows in the
+otp table, 100000 by default.
+"""
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from fastapi.security import HTTPAuthorizationCredentials
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from starlette.datastructures import UploadFile
+from sqlalchemy import insert, select
+
+from app.tests.benchmarks.bench_serialization import make_user
+from app.utils import create_otp, generate_unique_token, save_profile_picture
+from app.database import build_async_engine, get_async_database_url
+from app.dependencies import access_security, engine, get_jwt_credentials
+from app.serializers.user import UserResponseSer
+from app.services.tokens import token_cache
+from app.choices import OTPChoices
+from app.models.user import User
+from app.models.base import OTP
+from app import utils
+
+from types import SimpleNamespace
+from datetime import datetime
+from pathlib import Path
+from io import BytesIO
+import subprocess
+import asyncio
+import random
+import uuid
+import sys
+import os
+
+
+OTP_ROWS = int(os.getenv("BENCHMARK_OTP_ROWS", 100000))
+PURPOSES = [choice.value for choice in OTPChoices]
+ROOT_DIR = Path(__file__).resolve().parents[3]
+
+
+@pytest.fixture(scope="module")
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture(scope="module")
+def session_maker(migrated_db, loop):
+    async_engine = build_async_engine(get_async_database_url(migrated_db))
+    yield async_sessionmaker(async_engine, expire_on_commit=False)
+    loop.run_until_complete(async_engine.dispose())
+
+
+@pytest.fixture
+def db(session_maker, loop):
+    session = session_maker()
+    yield session
+    loop.run_until_complete(session.close())
+
+
+@pytest.fixture(scope="module")
+def otp_users(migrated_db) -> list[int]:
+    """Ids of users with an OTP for every purpose, OTP_ROWS rows in all."""
+    prefix = f"bench-otp-{uuid.uuid4().hex[:8]}"
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        conn.execute(
+            insert(User),
+            [
+                {"email": f"{prefix}-{i}@example.com", "first_name": "Bench", "last_name": "Otp", "password": "x"}
+                for i in range(OTP_ROWS // len(PURPOSES))
+            ],
+        )
+        user_ids = conn.scalars(select(User.id).where(User.email.like(f"{prefix}-%"))).all()
+        for start in range(0, len(user_ids), 10000):
+            conn.execute(
+                insert(OTP),
+                [
+                    {"code": generate_unique_token(), "user_id": user_id, "used_for": purpose, "s_time": now}
+                    for user_id in user_ids[start:start + 10000]
+                    for purpose in PURPOSES
+                ],
+            )
+    return user_ids
+
+
+def test_verify_otp(benchmark, loop, db, otp_users):
+    rng = random.Random(0)
+
+    def verify():
+        user = SimpleNamespace(id=rng.choice(otp_users))
+        return loop.run_until_complete(OTP.verify_otp(db, user, "00000", OTPChoices.TWO_FACTOR, v_time=86400))
+
+    status, _ = benchmark(verify)
+    assert status == 2  # found and not expired, codes are never 00000
+
+
+def test_create_otp(benchmark, loop, db, otp_users):
+    rng = random.Random(0)
+    otp = benchmark(lambda: loop.run_until_complete(create_otp(db, rng.choice(otp_users), OTPChoices.TWO_FACTOR)))
+    assert len(otp) == 5
+
+
+def test_generate_unique_token(benchmark):
+    assert len(benchmark(generate_unique_token)) == 5
+
+
+def test_user_response_validation(benchmark):
+    user = make_user()
+    assert benchmark(UserResponseSer.model_validate, user).id == user.id
+
+
+@pytest.mark.parametrize("cached", [True, False], ids=["cached", "decoded"])
+def test_get_jwt_credentials(benchmark, loop, monkeypatch, cached):
+    if not cached:
+        monkeypatch.setattr(token_cache, "maxsize", 0)
+    token = access_security.create_access_token(subject={"id": 1, "first_name": "Bench", "last_name": None})
+    bearer = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+
+    def authenticate():
+        return get_jwt_credentials(loop.run_until_complete(access_security(bearer, None)))
+
+    assert benchmark(authenticate)["id"] == 1
+
+
+def test_save_profile_picture(benchmark, loop, monkeypatch, tmp_path):
+    monkeypatch.setattr(utils, "PROFILE_PICTURE_DIR", tmp_path)
+    # Only the header is sniffed, the rest is copied and hashed as is
+    content = b"\x89PNG\r\n\x1a\n" + random.Random(0).randbytes(1024 * 1024)
+    benchmark.extra_info["bytes"] = len(content)
+
+    def save():
+        return loop.run_until_complete(save_profile_picture(UploadFile(BytesIO(content), size=len(content))))
+
+    assert Path(benchmark(save)).parent == tmp_path
+
+
+def test_import_app_main(benchmark):
+    benchmark.pedantic(
+        subprocess.run,
+        args=([sys.executable, "-c", "import app.main"],),
+        kwargs={"cwd": ROOT_DIR, "check": True, "capture_output": True},
+        rounds=5,
+    )
+
+
+def test_startup(benchmark, migrated_db):
+    benchmark.pedantic(
+        subprocess.run,
+        args=([sys.executable, "-m", "app.tests.benchmarks.bench_startup", "--check-startup"],),
+        kwargs={"cwd": ROOT_DIR, "check": True, "capture_output": True},
+        rounds=3,
+    )
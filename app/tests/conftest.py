@@ -0,0 +1,76 @@
+"""Fixtures for tests that call the API in process.
+
+They run against a throwaway SQLite database migrated to the Alembic head,
+or TEST_DATABASE_URL, never the DATABASE_URL of the environment. SQL
+profiling is on, so `query_budget` can hold an endpoint to the number of
+statements it runs.
+"""
+from fastapi.testclient import TestClient
+
+from contextlib import contextmanager
+from pathlib import Path
+import tempfile
+import pytest
+import os
+
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+
+# Read when app.config is first imported, so before any test module imports the app
+os.environ["DATABASE_URL"] = os.getenv(
+    "TEST_DATABASE_URL", f"sqlite:///{tempfile.mkdtemp(prefix='app-tests-')}/test.db"
+)
+os.environ["DATABASE_REPLICA_URLS"] = ""
+os.environ["SQL_PROFILE"] = "true"
+os.environ["EMAIL_TRANSPORT"] = "memory"
+os.environ["OTP_REAPER_INTERVAL"] = "0"
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ.setdefault("SECRET_KEY", "tests")
+os.environ.setdefault("APP_TITLE", "tests")
+os.environ.setdefault("APP_VERSION", "0")
+
+
+@pytest.fixture(scope="session")
+def migrated_db():
+    from alembic.config import Config
+    from alembic import command
+
+    config = Config(str(ROOT_DIR / "alembic.ini"))
+    config.set_main_option("script_location", str(ROOT_DIR / "alembic"))
+    command.upgrade(config, "head")
+    return os.environ["DATABASE_URL"]
+
+
+@pytest.fixture(scope="session")
+def client(migrated_db):
+    from app.main import app
+
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def query_budget():
+    """Fails when a request made in the block runs more than `max_queries` statements.
+
+        with query_budget(2):
+            client.get("/api/v1/users/me/", headers=headers)
+
+    Yields the profiles of the requests, and with `duplicates=False` also fails
+    on a statement run twice or on a lazy load.
+    """
+    from app.profiling import sql_profiler
+
+    @contextmanager
+    def budget(max_queries: int, duplicates: bool = True):
+        with sql_profiler.collect() as profiles:
+            yield profiles
+        assert profiles, "no request was profiled"
+        for profile in profiles:
+            assert len(profile.queries) <= max_queries, (
+                f"over the budget of {max_queries} queries\n{profile.report()}"
+            )
+            if not duplicates:
+                assert not profile.duplicates() and not profile.lazy_loads(), profile.report()
+
+    return budget
@@ -0,0 +1,34 @@
+"""Declared Content-Lengths of multipart bodies: over the limit is a 413, malformed a 400."""
+import pytest
+
+from app.middlewares.body_size import MaxBodySizeMiddleware
+
+import asyncio
+
+
+async def app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+
+@pytest.mark.parametrize(
+    "content_length, status_code",
+    [(b"10", 200), (b"1001", 413), (b"-1", 400), (b"abc", 400), (b" 10", 400), (b"1_0", 400)],
+)
+def test_content_length(content_length, status_code):
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/",
+        "headers": [(b"content-type", b"multipart/form-data; boundary=x"), (b"content-length", content_length)],
+    }
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(MaxBodySizeMiddleware(app, max_body_size=1000)(scope, receive, send))
+    assert sent[0]["status"] == status_code
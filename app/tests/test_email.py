@@ -0,0 +1,119 @@
+"""Which email failures are retried, and that a refused message does not fail or count its whole batch."""
+import httpx
+import pytest
+
+from app.services.email import (
+    EmailDeliveryError,
+    EmailMessage,
+    EmailRejectedError,
+    EmailService,
+    MailjetTransport,
+    SMTPTransport,
+    TransientEmailError,
+)
+
+import smtplib
+import asyncio
+
+
+MESSAGES = [EmailMessage(to=f"user{i}@example.com", subject="Hi", text="Hi") for i in range(3)]
+
+
+def mailjet(status_code: int, body) -> MailjetTransport:
+    transport = MailjetTransport("key", "secret", "noreply@example.com", "App", max_connections=1)
+    transport._client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(status_code, json=body)))
+    return transport
+
+
+def test_mailjet_fails_only_the_failed_messages():
+    results = [
+        {"Status": "success"},
+        {"Status": "error", "Errors": [{"ErrorMessage": "Invalid email", "StatusCode": 400}]},
+        {"Status": "error", "Errors": [{"ErrorMessage": "Internal error", "StatusCode": 500}]},
+    ]
+    failures = asyncio.run(mailjet(400, {"Messages": results}).send(MESSAGES))
+    assert {i: (type(e), str(e)) for i, e in failures.items()} == {
+        1: (EmailRejectedError, "Invalid email"),
+        2: (TransientEmailError, "Internal error"),
+    }
+
+    assert asyncio.run(mailjet(200, {"Messages": [{"Status": "success"}] * 3}).send(MESSAGES)) == {}
+
+
+@pytest.mark.parametrize(
+    "status_code, error",
+    [(401, EmailRejectedError), (400, EmailRejectedError), (429, TransientEmailError), (503, TransientEmailError)],
+)
+def test_mailjet_errors(status_code, error):
+    with pytest.raises(error):
+        asyncio.run(mailjet(status_code, {"ErrorMessage": "API key authentication/authorization failure"}).send(MESSAGES))
+
+
+class FakeSMTP:
+    """Raises `error` on login, and the errors in `refusals` for a recipient, one per send."""
+
+    error: Exception | None = None
+    refusals: dict[str, list[Exception]] = {}
+    sent: list[str] = []
+
+    def __init__(self, host, port, timeout):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def login(self, username, password):
+        if self.error:
+            raise self.error
+
+    def send_message(self, mime):
+        if self.refusals.get(mime["To"]):
+            raise self.refusals[mime["To"]].pop(0)
+        self.sent.append(mime["To"])
+
+
+@pytest.mark.parametrize(
+    "error, raised",
+    [
+        (smtplib.SMTPAuthenticationError(535, b"Bad credentials"), EmailRejectedError),
+        (smtplib.SMTPResponseException(421, b"Try again later"), TransientEmailError),
+        (smtplib.SMTPServerDisconnected("Connection unexpectedly closed"), TransientEmailError),
+        (ConnectionRefusedError(), TransientEmailError),
+    ],
+)
+def test_smtp_errors(monkeypatch, error, raised):
+    monkeypatch.setattr(smtplib, "SMTP", FakeSMTP)
+    monkeypatch.setattr(FakeSMTP, "error", error)
+    transport = SMTPTransport("localhost", 25, "user", "password", use_tls=False, sender="noreply@example.com")
+    with pytest.raises(raised):
+        asyncio.run(transport.send(MESSAGES))
+
+
+def test_email_service_fails_only_the_refused_message(monkeypatch):
+    monkeypatch.setattr(smtplib, "SMTP", FakeSMTP)
+    monkeypatch.setattr(FakeSMTP, "sent", [])
+    monkeypatch.setattr(
+        FakeSMTP,
+        "refusals",
+        {
+            "user1@example.com": [smtplib.SMTPRecipientsRefused({"user1@example.com": (550, b"No such user")})],
+            "user2@example.com": [smtplib.SMTPResponseException(451, b"Try again later")],
+        },
+    )
+    transport = SMTPTransport("localhost", 25, "user", "password", use_tls=False, sender="noreply@example.com")
+    service = EmailService(transport, batch_size=3, max_concurrency=1, max_retries=2, retry_backoff=0, linger=0.1, queue_size=10)
+
+    async def send_all():
+        results = await asyncio.gather(*(service.send(message) for message in MESSAGES), return_exceptions=True)
+        await service.stop()
+        return results
+
+    results = asyncio.run(send_all())
+    assert results[0] is None and results[2] is None
+    assert isinstance(results[1], EmailRejectedError) and isinstance(results[1], EmailDeliveryError)
+    assert "No such user" in str(results[1])
+    # user2 was retried alone, user0 got one email
+    assert FakeSMTP.sent == ["user0@example.com", "user2@example.com"]
@@ -0,0 +1,71 @@
+"""Profile picture variants are advertised once the worker has written them, and only those."""
+import pytest
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import Session
+from sqlalchemy import insert, select
+
+from app.database import build_async_engine, get_async_database_url
+from app.services.images import variant_urls
+from app.models.user import User
+from app.services import images
+
+from pathlib import Path
+import asyncio
+
+
+STEM = "ab" * 32
+
+
+def test_variant_urls():
+    path = f"app/static/profile_pictures/{STEM}.png"
+    assert variant_urls(path, None) == {}
+    assert variant_urls("app/static/profile_pictures/legacy.png", "64.webp") == {}
+    assert variant_urls(path, "256.webp,64.webp") == {
+        "256": {"webp": f"app/static/profile_pictures/{STEM}_256.webp"},
+        "64": {"webp": f"app/static/profile_pictures/{STEM}_64.webp"},
+    }
+
+
+def test_make_variants_leaves_out_formats_pillow_cannot_write(tmp_path, monkeypatch):
+    Image = pytest.importorskip("PIL.Image")
+    from PIL import features
+
+    path = str(tmp_path / f"{STEM}.png")
+    Image.new("RGB", (300, 200), (200, 30, 30)).save(path)
+    monkeypatch.setattr(features, "check", lambda feature: feature != "avif")
+
+    assert images.make_variants(path, (64, 32), ("jpeg", "avif"), 80) == ["64.jpeg", "32.jpeg"]
+    assert sorted(p.name for p in tmp_path.iterdir()) == [f"{STEM}.png", f"{STEM}_32.jpeg", f"{STEM}_64.jpeg"]
+
+
+def test_worker_records_the_variants(migrated_db, tmp_path, monkeypatch):
+    from app.dependencies import engine
+    from app import worker
+
+    path = str(tmp_path / f"{STEM}.png")
+    Path(path).touch()
+    with Session(engine) as db:
+        user_id = db.scalar(
+            insert(User)
+            .values(email="variants-user@example.com", first_name="Variants", last_name="Tester", password="x", profile_picture=path)
+            .returning(User.id)
+        )
+        db.commit()
+
+    async def process_profile_picture(path):
+        return ["256.webp", "64.webp"]
+
+    monkeypatch.setattr(images, "process_profile_picture", process_profile_picture)
+    async_engine = build_async_engine(get_async_database_url(migrated_db))
+
+    async def run():
+        try:
+            async with async_sessionmaker(async_engine)() as db:
+                await worker.process_profile_picture(db, path, user_id=user_id)
+        finally:
+            await async_engine.dispose()
+
+    asyncio.run(run())
+    with Session(engine) as db:
+        assert db.scalar(select(User.profile_picture_variants).where(User.id == user_id)) == "256.webp,64.webp"
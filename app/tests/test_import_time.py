@@ -0,0 +1,41 @@
+"""Cold import of app.main: time budget, deferred dependencies, no side effects.
+
+The budget is machine dependent, set IMPORT_TIME_BUDGET_MS to tighten or
+relax it. `python -m app.importtime` shows where the time goes.
+"""
+from app.importtime import measure, total_ms, import_chain
+
+import os
+
+
+IMPORT_TIME_BUDGET_MS = float(os.getenv("IMPORT_TIME_BUDGET_MS", 1500))
+# Only needed by the worker, or by optional backends, never to serve a request
+DEFERRED_MODULES = ("httpx", "smtplib", "PIL", "redis", "multiprocessing")
+# Settings app.main cannot be imported without
+ENV = {
+    name: os.getenv(name, default)
+    for name, default in {
+        "DATABASE_URL": "sqlite:///:memory:",
+        "SECRET_KEY": "import-time-test",
+        "APP_TITLE": "import-time-test",
+        "APP_VERSION": "0",
+    }.items()
+}
+
+
+def test_cold_import_within_budget():
+    records = measure("app.main", runs=3, env=ENV)
+    assert total_ms(records) <= IMPORT_TIME_BUDGET_MS, (
+        f"import app.main took {total_ms(records):.0f}ms, budget is {IMPORT_TIME_BUDGET_MS:.0f}ms"
+    )
+
+
+def test_optional_dependencies_are_deferred():
+    records = measure("app.main", runs=1, env=ENV)
+    imported = {module: " <- ".join(import_chain(records, module)) for module in DEFERRED_MODULES}
+    assert {module: chain for module, chain in imported.items() if chain} == {}
+
+
+def test_import_has_no_filesystem_side_effects(tmp_path):
+    measure("app.main", runs=1, cwd=tmp_path, env=ENV)
+    assert list(tmp_path.iterdir()) == []
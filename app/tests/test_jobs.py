@@ -0,0 +1,46 @@
+"""Expired leases are claimed again, unless the job is out of attempts."""
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import Session
+from sqlalchemy import insert
+
+from app.database import build_async_engine, get_async_database_url
+from app.choices import JobChoices, JobStatusChoices
+from app.services.jobs import claim_jobs
+from app.models.job import Job
+from app.config import settings
+
+from datetime import datetime, timedelta
+import asyncio
+
+
+def test_claim_jobs_fails_jobs_that_never_finished_their_last_attempt(migrated_db):
+    from app.dependencies import engine
+
+    expired = datetime.utcnow() - timedelta(minutes=1)
+    with Session(engine) as db:
+        crashed, retried = db.scalars(
+            insert(Job).returning(Job.id, sort_by_parameter_order=True),
+            [
+                {"kind": JobChoices.PROFILE_PICTURE, "payload": {}, "status": JobStatusChoices.RUNNING,
+                 "attempts": settings.JOB_MAX_ATTEMPTS, "available_at": expired},
+                {"kind": JobChoices.PROFILE_PICTURE, "payload": {}, "status": JobStatusChoices.RUNNING,
+                 "attempts": settings.JOB_MAX_ATTEMPTS - 1, "available_at": expired},
+            ],
+        ).all()
+        db.commit()
+
+    async_engine = build_async_engine(get_async_database_url(migrated_db))
+
+    async def claim():
+        try:
+            async with async_sessionmaker(async_engine, expire_on_commit=False)() as db:
+                return await claim_jobs(db, limit=100, lease=60)
+        finally:
+            await async_engine.dispose()
+
+    claimed = [job.id for job in asyncio.run(claim())]
+    assert retried in claimed and crashed not in claimed
+    with Session(engine) as db:
+        job = db.get(Job, crashed)
+        assert (job.status, job.attempts) == (JobStatusChoices.FAILED, settings.JOB_MAX_ATTEMPTS)
+        assert "Lease expired" in job.last_error
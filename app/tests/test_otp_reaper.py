@@ -0,0 +1,42 @@
+"""The reaper deletes only expired OTPs and exports its rows and time per run."""
+from sqlalchemy.orm import Session
+from sqlalchemy import func, insert, select
+
+from app.services.otp_reaper import reap_expired_otps, reaper_stats
+from app.choices import OTPChoices
+from app.models.user import User
+from app.models.base import OTP
+from app.metrics import registry
+
+from datetime import datetime, timedelta
+import asyncio
+
+
+def test_reap_expired_otps(client):
+    from app.dependencies import engine
+
+    with Session(engine) as db:
+        user_id = db.scalar(
+            insert(User)
+            .values(email="reaper-user@example.com", first_name="Reaper", last_name="Tester", password="x")
+            .returning(User.id)
+        )
+        now = datetime.utcnow()
+        db.execute(
+            insert(OTP),
+            [
+                {"code": "11111", "user_id": user_id, "used_for": OTPChoices.TWO_FACTOR, "s_time": now - timedelta(days=2)},
+                {"code": "22222", "user_id": user_id, "used_for": OTPChoices.FORGOT_PASSWORD, "s_time": now},
+            ],
+        )
+        db.commit()
+
+    runs = reaper_stats.runs
+    assert asyncio.run(reap_expired_otps(max_age=86400)) == 1
+    with Session(engine) as db:
+        assert db.scalar(select(func.count()).where(OTP.user_id == user_id)) == 1
+
+    assert reaper_stats.runs == runs + 1 and reaper_stats.last_run_seconds > 0
+    metrics = registry.render()
+    assert "otp_reaper_seconds_total " in metrics
+    assert f"otp_reaper_last_run_seconds {reaper_stats.last_run_seconds}" in metrics
@@ -0,0 +1,25 @@
+"""Sends coalesced within the OTP resend cooldown still check the user."""
+from sqlalchemy.orm import Session
+from sqlalchemy import update
+
+from app.models.user import User
+
+
+def test_resend_activation_checks_the_user_within_the_cooldown(client):
+    from app.dependencies import engine
+
+    email = "resend-user@example.com"
+    response = client.post(
+        "/api/v1/users/create/",
+        json={"email": email, "password": "password1", "first_name": "Resend", "last_name": "Tester"},
+    )
+    assert response.status_code == 201, response.text
+    first = client.post("/api/v1/users/resend_activation_token/", json=email)
+    assert first.status_code == 200, first.text
+
+    with Session(engine) as db:
+        db.execute(update(User).where(User.email == email).values(is_active=True))
+        db.commit()
+    response = client.post("/api/v1/users/resend_activation_token/", json=email)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "User is already active."
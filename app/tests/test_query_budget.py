@@ -0,0 +1,72 @@
+"""SQL statements per request of the user endpoints, and the profiler's N+1 and lazy-load detection."""
+from sqlalchemy.orm import Session
+from sqlalchemy import select, update
+
+from app.profiling import sql_profiler
+from app.choices import OTPChoices
+from app.models.user import User
+from app.models.base import OTP
+
+
+EMAIL = "budget-user@example.com"
+PASSWORD = "password1"
+
+
+def create_active_user(client, email: str) -> int:
+    from app.dependencies import engine
+
+    response = client.post(
+        "/api/v1/users/create/",
+        json={"email": email, "password": PASSWORD, "first_name": "Budget", "last_name": "Tester"},
+    )
+    assert response.status_code == 201, response.text
+    with Session(engine) as db:
+        db.execute(update(User).where(User.email == email).values(is_active=True))
+        db.commit()
+    return response.json()["id"]
+
+
+def test_create_user(client, query_budget):
+    # The email check, the user and the activation email job
+    with query_budget(3, duplicates=False):
+        response = client.post(
+            "/api/v1/users/create/",
+            json={"email": "budget-new@example.com", "password": PASSWORD, "first_name": "Budget", "last_name": "Tester"},
+        )
+    assert response.status_code == 201, response.text
+    assert response.headers["X-DB-Queries"] == "3"
+    assert float(response.headers["X-DB-Time"]) > 0
+
+
+def test_login_and_profile(client, query_budget):
+    create_active_user(client, EMAIL)
+    # The user by email and the last_login update
+    with query_budget(2, duplicates=False):
+        response = client.post("/api/v1/users/login/", json={"email": EMAIL, "password": PASSWORD})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    with query_budget(1):
+        client.get("/api/v1/users/me/", headers=headers)
+    # Then from the user cache
+    with query_budget(0):
+        response = client.get("/api/v1/users/me/", headers=headers)
+    assert response.json()["email"] == EMAIL
+
+
+def test_n_plus_one_lazy_loads_are_flagged(client):
+    from app.dependencies import engine
+
+    user_ids = [create_active_user(client, f"budget-lazy-{i}@example.com") for i in range(2)]
+    with Session(engine) as db:
+        db.add_all(OTP(code="12345", user_id=user_id, used_for=OTPChoices.TWO_FACTOR) for user_id in user_ids)
+        db.commit()
+
+    with Session(engine) as db, sql_profiler.profile("test") as profile:
+        otps = db.scalars(select(OTP).where(OTP.user_id.in_(user_ids))).all()
+        emails = [otp.user.email for otp in otps]
+
+    assert len(emails) == 2
+    lazy_loads = profile.lazy_loads()
+    assert [query.lazy_load for query in lazy_loads] == ["OTP.user", "OTP.user"]
+    assert all("test_query_budget.py" in query.call_site for query in profile.queries)
+    assert profile.duplicates() == {lazy_loads[0].statement: 2}
@@ -0,0 +1,54 @@
+"""Revocations reach the in-process denylist only once they are committed, and refresh tokens are single use."""
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.database import build_async_engine, get_async_database_url
+from app.services.tokens import TokenDenylist
+
+from datetime import datetime, timedelta
+import asyncio
+import uuid
+
+
+def claims(user_id: int) -> dict:
+    now = datetime.utcnow()
+    return {
+        "subject": {"id": user_id},
+        "jti": str(uuid.uuid4()),
+        "iat": int(now.timestamp()),
+        "exp": (now + timedelta(hours=1)).timestamp(),
+    }
+
+
+def test_revocations_wait_for_the_commit(migrated_db):
+    denylist = TokenDenylist()
+    rolled_back, committed = claims(1), claims(1)
+    async_engine = build_async_engine(get_async_database_url(migrated_db))
+    session_maker = async_sessionmaker(async_engine, expire_on_commit=True)
+
+    async def run():
+        try:
+            async with session_maker() as db:
+                denylist.revoke(db, rolled_back)
+                assert not denylist.is_revoked(rolled_back)
+                await db.rollback()
+            async with session_maker() as db:
+                denylist.revoke(db, committed)
+                await db.commit()
+        finally:
+            await async_engine.dispose()
+
+    asyncio.run(run())
+    assert not denylist.is_revoked(rolled_back)
+    assert denylist.is_revoked(committed)
+
+
+def test_refresh_tokens_are_rotated(client):
+    from app.dependencies import refresh_security
+
+    old = refresh_security.create_refresh_token(subject={"id": 1})
+    response = client.post("/api/v1/users/refresh/token/", headers={"Authorization": f"Bearer {old}"})
+    assert response.status_code == 200, response.text
+    new = response.json()["refresh_token"]
+
+    assert client.post("/api/v1/users/refresh/token/", headers={"Authorization": f"Bearer {old}"}).status_code == 401
+    assert client.post("/api/v1/users/refresh/token/", headers={"Authorization": f"Bearer {new}"}).status_code == 200
@@ -0,0 +1,60 @@
+"""The user cache holds no password hashes and is never filled from a replica."""
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import Session
+from sqlalchemy import update
+
+from app.services.replicas import ReplicaRouter, RoutingSession, copy_sqlite
+from app.database import build_async_engine, get_async_database_url
+from app.services.user_cache import MemoryCacheBackend, UserCache
+from app.models.user import User
+
+import asyncio
+
+
+PASSWORD = "password1"
+
+
+def test_user_cache(client, migrated_db, tmp_path):
+    from app.dependencies import engine
+
+    response = client.post(
+        "/api/v1/users/create/",
+        json={"email": "cached-user@example.com", "password": PASSWORD, "first_name": "Before", "last_name": "Cache"},
+    )
+    user_id = response.json()["id"]
+    replica_url = f"sqlite:///{tmp_path}/replica.db"
+    copy_sqlite(migrated_db, [replica_url])
+    # The replica lags behind this rename
+    with Session(engine) as db:
+        db.execute(update(User).where(User.id == user_id).values(first_name="After"))
+        db.commit()
+
+    primary = build_async_engine(get_async_database_url(migrated_db))
+    replica = build_async_engine(get_async_database_url(replica_url))
+    replica_session_maker = async_sessionmaker(
+        primary,
+        expire_on_commit=False,
+        sync_session_class=RoutingSession,
+        router=ReplicaRouter(primary, [replica], sticky_seconds=0, max_lag=60),
+        info={"replica_reads": True},
+    )
+    cache = UserCache(MemoryCacheBackend(maxsize=10, ttl=60))
+
+    async def run():
+        try:
+            async with replica_session_maker() as db:
+                assert (await db.get(User, user_id)).first_name == "Before"
+            async with replica_session_maker() as db:
+                assert (await cache.get(db, user_id)).first_name == "After"
+            assert "password" not in await cache.backend.get(user_id)
+
+            # A hit loads the password hash when it is needed
+            async with replica_session_maker() as db:
+                user = await cache.get(db, user_id)
+                assert cache.hits == 1
+                assert await user.averify_password(PASSWORD)
+        finally:
+            await primary.dispose()
+            await replica.dispose()
+
+    asyncio.run(run())
@@ -0,0 +1,111 @@
+"""Bulk user import endpoint: superusers only, per-row errors, statements per batch rather than per row."""
+from sqlalchemy.orm import Session
+from sqlalchemy import func, select, update
+
+from app.choices import JobChoices
+from app.models.user import User
+from app.models.job import Job
+
+import json
+
+
+PASSWORD = "password1"
+
+
+def superuser_headers(client) -> dict:
+    from app.dependencies import engine
+
+    email = "import-admin@example.com"
+    client.post(
+        "/api/v1/users/create/",
+        json={"email": email, "password": PASSWORD, "first_name": "Import", "last_name": "Admin"},
+    )
+    with Session(engine) as db:
+        db.execute(update(User).where(User.email == email).values(is_active=True, is_superuser=True))
+        db.commit()
+    response = client.post("/api/v1/users/login/", json={"email": email, "password": PASSWORD})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def ndjson(rows: list[dict]) -> str:
+    return "".join(json.dumps(row) + "\n" for row in rows)
+
+
+def test_import_users(client, query_budget):
+    from app.dependencies import engine
+
+    headers = superuser_headers(client)
+    rows = [
+        {"email": f"imported-{i:03d}@example.com", "password": PASSWORD, "first_name": "Imported", "last_name": "Person"}
+        for i in range(50)
+    ]
+    body = ndjson(rows) + "not json\n" + ndjson([{**rows[0], "first_name": "Bob"}, {**rows[1], "email": "import-admin@example.com"}])
+
+    # The user check, then for the one batch the emails taken, the users and their jobs
+    with query_budget(4):
+        response = client.post(
+            "/api/v1/users/import/", content=body, headers={**headers, "Content-Type": "application/x-ndjson"}
+        )
+    assert response.status_code == 200, response.text
+    report = response.json()
+    assert (report["rows"], report["created"], report["failed"]) == (53, 50, 3)
+    assert [(error["line"], error["email"]) for error in report["errors"]] == [
+        (51, None),
+        (52, "imported-000@example.com"),
+        (53, "import-admin@example.com"),
+    ]
+    assert report["errors"][2]["error"] == "Email already in use."
+
+    with Session(engine) as db:
+        emails = [row["email"] for row in rows]
+        assert db.scalar(select(func.count()).where(User.email.in_(emails), User.is_active.is_(False))) == 50
+        assert db.scalar(select(func.count()).where(Job.kind == JobChoices.OTP_EMAIL)) >= 50
+
+    # Again, as CSV: every email is taken now
+    csv = "email,password,first_name,last_name\n" + "".join(
+        f"{row['email']},{PASSWORD},Imported,Person\n" for row in rows[:5]
+    )
+    response = client.post("/api/v1/users/import/?format=csv", content=csv, headers=headers)
+    assert (response.json()["created"], response.json()["failed"]) == (0, 5)
+
+
+def test_import_users_needs_a_superuser(client):
+    email = "import-someone@example.com"
+    client.post(
+        "/api/v1/users/create/",
+        json={"email": email, "password": PASSWORD, "first_name": "Import", "last_name": "Someone"},
+    )
+    from app.dependencies import engine
+
+    with Session(engine) as db:
+        db.execute(update(User).where(User.email == email).values(is_active=True))
+        db.commit()
+    token = client.post("/api/v1/users/login/", json={"email": email, "password": PASSWORD}).json()["access_token"]
+
+    response = client.post(
+        "/api/v1/users/import/", content="", headers={"Authorization": f"Bearer {token}", "Content-Type": "text/csv"}
+    )
+    assert response.status_code == 403
+
+
+def test_import_users_rejects_unknown_formats(client):
+    response = client.post(
+        "/api/v1/users/import/", content="{}", headers={**superuser_headers(client), "Content-Type": "application/json"}
+    )
+    assert response.status_code == 400
+
+
+def test_import_users_reports_the_rows_before_unreadable_input(client):
+    rows = [
+        {"email": f"partial-{i}@example.com", "password": PASSWORD, "first_name": "Partial", "last_name": "Import"}
+        for i in range(2)
+    ]
+    body = ndjson(rows).encode() + b"\xff\xfe not utf-8\n"
+    response = client.post(
+        "/api/v1/users/import/",
+        content=body,
+        headers={**superuser_headers(client), "Content-Type": "application/x-ndjson"},
+    )
+    assert response.status_code == 400
+    report = response.json()
+    assert (report["rows"], report["created"], report["error"]) == (2, 2, "Line 3 is not UTF-8.")
@@ -1,108 +1,169 @@
 from fastapi import HTTPException, status, UploadFile
+from fastapi.concurrency import run_in_threadpool
 
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from app.models.base import Base
 
 from app.choices import OTPChoices
 from app.models.user import User
 from app.models.base import OTP
+from app.services.email import EmailMessage, email_service
 from app.config import settings
 
-from random import randint
+from datetime import datetime
 from pathlib import Path
-from uuid import uuid4
-
-from mailjet_rest import Client
+import tempfile
+import hashlib
+import asyncio
+import secrets
+import os
 
 PROFILE_PICTURE_DIR = Path("./app/static/profile_pictures/")
-PROFILE_PICTURE_DIR.mkdir(parents=True, exist_ok=True)
 
 
-def generate_unique_token(db: Session):
-    while True:
-        code = randint(10000, 99999)
-        if not db.query(OTP).filter(OTP.code == code).first():
-            return code
+def generate_unique_token() -> str:
+    # Codes only need to be unique per (user, purpose), which the otp table enforces
+    return str(10000 + secrets.randbelow(90000))
 
 
-def create_otp(db: Session, user_id: int, used_for: str):
-    otp = generate_unique_token(db)
-    obj = db.query(OTP).filter(OTP.user_id == user_id, OTP.used_for == used_for).first()
-    if obj:
-        db.delete(obj)
-    obj = OTP(code=otp, used_for=used_for, user_id=user_id)
-    db.add(obj)
-    db.commit()
-    return otp
+def get_insert(db: AsyncSession | Session):
+    """Dialect specific `insert`, for ON CONFLICT upserts."""
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+
+        return insert
+    from sqlalchemy.dialects.sqlite import insert
 
+    return insert
 
-def send_email(to_email: str, subject: str, body: str):
-    mailjet = Client(
-        auth=(settings.MAILJET_API_PUB, settings.MAILJET_API_PRI), version="v3.1"
+
+async def create_otp(db: AsyncSession, user_id: int, used_for: str):
+    otp = generate_unique_token()
+    stmt = get_insert(db)(OTP).values(code=otp, used_for=used_for, user_id=user_id, s_time=datetime.utcnow())
+    await db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[OTP.user_id, OTP.used_for],
+            set_={"code": stmt.excluded.code, "s_time": stmt.excluded.s_time},
+        )
     )
+    await db.commit()
+    return otp
+
 
-    msg = {
-        "Messages": [
-            {
-                "From": {
-                    "Email": settings.MAILJET_SENDER_EMAIL,
-                    "Name": settings.MAILJET_SENDER_NAME,
-                },
-                "To": [{"Email": to_email}],
-                "Subject": subject,
-                "TextPart": body,
-                #   "HTMLPart": "<h3>Dear passenger 1, welcome to <a href=\"https://www.mailjet.com/\">Mailjet</a>!</h3><br />May the delivery force be with you!"
-            }
-        ]
-    }
-
-    resp = mailjet.send.create(data=msg)
-    if resp.status_code == 200:
-        print(f"\nemail sent to '{to_email}' successfully\n\n")
-    else:
-        print(f"\nemail sent to '{to_email}' failed\n\n")
-        print(resp.json())
-
-
-def account_activation_email(db: Session, user: User):
-    otp = create_otp(db, user.id, OTPChoices.ACCOUNT_ACTIVATION)
+async def send_email(to_email: str, subject: str, body: str):
+    await email_service.send(EmailMessage(to=to_email, subject=subject, text=body))
+
+
+async def account_activation_email(db: AsyncSession, user: User):
+    otp = await create_otp(db, user.id, OTPChoices.ACCOUNT_ACTIVATION)
     subject = "FastAPI Account Activation Token"
     name = f"{user.first_name}{' ' + user.last_name if user.last_name else ''}"
     body = f"Hi {name}, Your OTP for account activation is: {otp}. This OTP is valid for next 5 mins."
-    return send_email(user.email, subject, body)
+    return await send_email(user.email, subject, body)
 
 
-def email_forgot_password_token(db: Session, user: User):
-    otp = create_otp(db, user.id, OTPChoices.FORGOT_PASSWORD)
+async def email_forgot_password_token(db: AsyncSession, user: User):
+    otp = await create_otp(db, user.id, OTPChoices.FORGOT_PASSWORD)
     subject = "OTP to update your FastAPI Account password..."
     name = f"{user.first_name}{' ' + user.last_name if user.last_name else ''}"
     body = f"Hi {name}, Use this OTP: {otp} to update your password. This OTP is valid for next 2 mins."
-    return send_email(user.email, subject, body)
+    return await send_email(user.email, subject, body)
 
 
-def two_factor_token_email(db: Session, user: User):
-    otp = create_otp(db, user.id, OTPChoices.TWO_FACTOR)
+async def two_factor_token_email(db: AsyncSession, user: User):
+    otp = await create_otp(db, user.id, OTPChoices.TWO_FACTOR)
     subject = "Your FastAPI Two-Factor Authentication (2FA) Token..."
     name = f"{user.first_name}{' ' + user.last_name if user.last_name else ''}"
     body = f"Hi {name}, Use this OTP: {otp} to pass through Two-Factor Authentication (2FA). This OTP is valid for next 2 mins."
-    return send_email(user.email, subject, body)
+    return await send_email(user.email, subject, body)
 
 
-def update_email(db: Session, user: User, email: str):
-    otp = create_otp(db, user.id, OTPChoices.UPDATE_EMAIL)
+async def update_email(db: AsyncSession, user: User, email: str):
+    otp = await create_otp(db, user.id, OTPChoices.UPDATE_EMAIL)
     subject = "Your FastAPI Update Email Token..."
     name = f"{user.first_name}{' ' + user.last_name if user.last_name else ''}"
     body = f"Hi {name}, Use this OTP: {otp} to update your email. This OTP is valid for next 2 mins."
-    return send_email(email, subject, body)
-
-
-def save_profile_picture(file: UploadFile) -> str:
-    unique_filename = f"{uuid4().hex}_{file.filename}"
-    file_location = PROFILE_PICTURE_DIR / unique_filename
-    
-    with open(file_location, "wb") as buffer:
-        buffer.write(file.file.read())
+    return await send_email(email, subject, body)
+
+
+# Leading bytes of the image formats accepted as profile pictures
+IMAGE_SIGNATURES = {
+    b"\xff\xd8\xff": "jpg",
+    b"\x89PNG\r\n\x1a\n": "png",
+    b"GIF87a": "gif",
+    b"GIF89a": "gif",
+}
+upload_slots = asyncio.Semaphore(settings.MAX_CONCURRENT_UPLOADS)
+
+
+def sniff_image_type(head: bytes) -> str | None:
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    for signature, extension in IMAGE_SIGNATURES.items():
+        if head.startswith(signature):
+            return extension
+    return None
+
+
+def _copy_upload(src, directory: Path, max_size: int) -> Path | None:
+    """Copies `src` into `directory` in fixed-size chunks, returns the stored path.
+
+    The file is named after the sha256 of its content, so a picture that was
+    uploaded before is not stored twice. It is written to a temporary file and
+    renamed into place, so a partial upload is never visible. Returns None for
+    unsupported content.
+    """
+    src.seek(0)
+    head = src.read(settings.UPLOAD_CHUNK_SIZE)
+    extension = sniff_image_type(head)
+    if extension is None:
+        return None
+
+    digest = hashlib.sha256()
+    directory.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".part")
+    try:
+        size = 0
+        with os.fdopen(fd, "wb") as buffer:
+            chunk = head
+            while chunk:
+                size += len(chunk)
+                if size > max_size:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"Profile picture exceeds {max_size} bytes.",
+                    )
+                digest.update(chunk)
+                buffer.write(chunk)
+                chunk = src.read(settings.UPLOAD_CHUNK_SIZE)
+        dest = directory / f"{digest.hexdigest()}.{extension}"
+        if dest.exists():
+            os.unlink(tmp_path)
+        else:
+            os.replace(tmp_path, dest)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return dest
+
+
+async def save_profile_picture(file: UploadFile) -> str:
+    max_size = settings.PROFILE_PICTURE_MAX_SIZE
+    if file.size is not None and file.size > max_size:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Profile picture exceeds {max_size} bytes.",
+        )
 
+    async with upload_slots:
+        file_location = await run_in_threadpool(_copy_upload, file.file, PROFILE_PICTURE_DIR, max_size)
+    if file_location is None:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Profile picture must be a JPEG, PNG, GIF or WebP image.",
+        )
     return str(file_location)
 
 
@@ -131,3 +192,27 @@ def db_commit(db: Session):
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed, due to internal server error, please try again later",
         )
+
+
+async def aget_by_id(db: AsyncSession, model: Base, id: int):
+    return await db.get(model, id)
+
+
+async def adelete_by_id(db: AsyncSession, model: Base, id: int):
+    obj = await db.get(model, id)
+    if obj:
+        await db.delete(obj)
+        await adb_commit(db)
+        return True
+    return False
+
+
+async def adb_commit(db: AsyncSession):
+    try:
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed, due to internal server error, please try again later",
+        )
@@ -0,0 +1,141 @@
+"""Drains the `jobs` table.
+
+    python -m app.worker --concurrency 8
+    python -m app.worker --metrics-port 9100  # Prometheus metrics, like the API's /metrics
+"""
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import update
+
+from app.dependencies import async_session_maker
+from app.services.jobs import claim_jobs, complete_job, retry_or_fail_job
+from app.services.email import EmailRejectedError, email_service
+from app.services.user_cache import user_cache
+from app.services import images
+from app import metrics
+from app.choices import JobChoices, OTPChoices
+from app.models.user import User
+from app.models.job import Job
+from app.config import settings
+from app.utils import (
+    email_forgot_password_token,
+    account_activation_email,
+    two_factor_token_email,
+    update_email,
+)
+
+import argparse
+import asyncio
+import logging
+import signal
+import time
+import os
+
+
+logger = logging.getLogger(__name__)
+
+jobs_run = metrics.registry.counter("jobs_total", "Jobs run by the worker.", ["kind", "result"])
+job_duration = metrics.registry.histogram("job_duration_seconds", "Time to run a job.", ["kind"])
+
+OTP_EMAILS = {
+    OTPChoices.ACCOUNT_ACTIVATION: account_activation_email,
+    OTPChoices.FORGOT_PASSWORD: email_forgot_password_token,
+    OTPChoices.TWO_FACTOR: two_factor_token_email,
+}
+
+
+async def send_otp_email(db: AsyncSession, user_id: int, used_for: str, email: str | None = None):
+    user = await db.get(User, user_id)
+    if not user:
+        logger.warning("Skipping %s OTP email, user %s no longer exists", used_for, user_id)
+        return
+    if used_for == OTPChoices.UPDATE_EMAIL:
+        await update_email(db, user, email)
+    else:
+        await OTP_EMAILS[OTPChoices(used_for)](db, user)
+
+
+async def process_profile_picture(db: AsyncSession, path: str, user_id: int | None = None):
+    if not os.path.exists(path):
+        logger.warning("Skipping %s, it no longer exists", path)
+        return
+    variants = await images.process_profile_picture(path)
+    # Jobs queued before user_id was in the payload update every user of the picture
+    query = update(User).where(User.profile_picture == path)
+    if user_id is not None:
+        query = query.where(User.id == user_id)
+    user_ids = (await db.scalars(query.values(profile_picture_variants=",".join(variants)).returning(User.id))).all()
+    await db.commit()
+    for user_id in user_ids:
+        await user_cache.invalidate(user_id)
+
+
+JOB_HANDLERS = {
+    JobChoices.OTP_EMAIL: send_otp_email,
+    JobChoices.PROFILE_PICTURE: process_profile_picture,
+}
+
+
+async def run_job(job: Job):
+    started = time.perf_counter()
+    async with async_session_maker() as db:
+        try:
+            await JOB_HANDLERS[JobChoices(job.kind)](db, **job.payload)
+        except Exception as e:
+            logger.exception("%s failed on attempt %d", job, job.attempts)
+            jobs_run.labels(job.kind, "failed").inc()
+            await db.rollback()
+            # A refused email is refused again on the next attempt
+            await retry_or_fail_job(db, job, repr(e), retry=not isinstance(e, EmailRejectedError))
+        else:
+            jobs_run.labels(job.kind, "succeeded").inc()
+            await complete_job(db, job)
+    job_duration.labels(job.kind).observe(time.perf_counter() - started)
+
+
+async def consume(stopping: asyncio.Event, lease: float, poll_interval: float):
+    while not stopping.is_set():
+        async with async_session_maker() as db:
+            jobs = await claim_jobs(db, limit=1, lease=lease)
+        if not jobs:
+            try:
+                await asyncio.wait_for(stopping.wait(), poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        for job in jobs:
+            await run_job(job)
+
+
+async def run_worker(concurrency: int, lease: float, poll_interval: float, metrics_port: int = 0):
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+
+    logger.info("Worker started with %d consumers", concurrency)
+    server = await metrics.serve("0.0.0.0", metrics_port) if metrics_port else None
+    email_service.start()
+    try:
+        await asyncio.gather(*(consume(stopping, lease, poll_interval) for _ in range(concurrency)))
+    finally:
+        if server:
+            server.close()
+        await email_service.stop()
+        images.shutdown()
+    logger.info("Worker stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=settings.WORKER_CONCURRENCY)
+    parser.add_argument("--lease", type=float, default=settings.JOB_LEASE_SECONDS)
+    parser.add_argument("--poll-interval", type=float, default=settings.WORKER_POLL_INTERVAL)
+    parser.add_argument("--metrics-port", type=int, default=settings.WORKER_METRICS_PORT)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    asyncio.run(run_worker(args.concurrency, args.lease, args.poll_interval, args.metrics_port))
+
+
+if __name__ == "__main__":
+    main()